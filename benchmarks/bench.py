@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+#
+# Throughput benchmarks for TxtStyle.
+#
+# Every case runs in a fresh interpreter so that its peak RSS isn't
+# affected by the cases before it. Examples:
+#
+#   python -m benchmarks.bench
+#   python -m benchmarks.bench --filter java --save baseline.json
+#   python -m benchmarks.bench --compare baseline.json
+#   python -m benchmarks.bench --backend re --backend re2
+#   python -m benchmarks.bench --startup
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import generators
+from txtstyle import txts
+from txtstyle.confparser import ConfParser
+from txtstyle.linestyleprocessor import LineStyleProcessor
+from txtstyle.regexbackend import BACKENDS
+from txtstyle.regexbackend import BACKEND_RE
+from txtstyle.regexbackend import get_module
+from txtstyle.transformer import Transformer
+from txtstyle.txtsconf import DEFAULT_CONF
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+TARGETS = ['style', 'style_map', 'cli', 'logging']
+# Default number of lines for built-in style corpora (80 columns per
+# line is assumed when scaling synthetic corpora with longer lines)
+DEFAULT_LINES = 20000
+DEFAULT_REPEAT = 3
+# Relative drop in lines/s reported as a regression
+DEFAULT_THRESHOLD = 0.10
+# Runs of txts per style and mode when measuring startup time
+DEFAULT_STARTUP_RUNS = 20
+_SEED = 42
+
+
+class Case(object):
+
+    def __init__(self, target, corpus, line_length=None, density=None, rule_count=None,
+                 backend=BACKEND_RE):
+        self.target = target
+        self.corpus = corpus
+        self.line_length = line_length
+        self.density = density
+        self.rule_count = rule_count
+        self.backend = backend
+
+    @property
+    def id(self):
+        if self.corpus == 'synthetic':
+            case_id = '%s/synthetic-len%i-density%g-rules%i' % (
+                self.target, self.line_length, self.density, self.rule_count)
+        else:
+            case_id = '%s/%s' % (self.target, self.corpus)
+        # ids of re cases are unchanged so older results still compare
+        if self.backend != BACKEND_RE:
+            case_id += '@' + self.backend
+        return case_id
+
+    def lines(self, count):
+        rng = random.Random(_SEED)
+        if self.corpus == 'synthetic':
+            count = max(100, count * 80 // self.line_length)
+            return generators.synthetic_lines(
+                rng, count, self.line_length, self.density, self.rule_count)
+        return generators.STYLE_GENERATORS[self.corpus](rng, count)
+
+    def conf(self):
+        """\
+        Returns the conf and the name of the style to use.
+        """
+        if self.corpus == 'synthetic':
+            rules = ['%s: regex("%s")' % r for r in generators.synthetic_rules(self.rule_count)]
+            return '[Style="synthetic"]\n%s\n' % '\n'.join(rules), 'synthetic'
+        return DEFAULT_CONF, self.corpus
+
+
+def get_cases(backends=(BACKEND_RE,)):
+    cases = []
+    for backend in backends:
+        for target in TARGETS:
+            for corpus in sorted(generators.STYLE_GENERATORS):
+                cases.append(Case(target, corpus, backend=backend))
+
+        for line_length in [80, 1000, 10000]:
+            cases.append(Case('style', 'synthetic', line_length, 0.1, 8, backend))
+        for density in [0.0, 0.5]:
+            cases.append(Case('style', 'synthetic', 200, density, 8, backend))
+        for rule_count in [1, 32]:
+            cases.append(Case('style', 'synthetic', 200, 0.1, rule_count, backend))
+    return cases
+
+
+def run_case(case, line_count, repeat):
+    lines = case.lines(line_count)
+    conf, style_name = case.conf()
+    styles = ConfParser(conf.splitlines(), case.backend).get_styles(style_name)
+    input_bytes = sum(len(line.encode('utf-8')) + 1 for line in lines)
+
+    run = {
+        'style': _run_style,
+        'style_map': _run_style_map,
+        'cli': _run_cli,
+        'logging': _run_logging,
+    }[case.target]
+
+    seconds = min(run(lines, styles, conf, style_name, case.backend) for i in range(repeat))
+    style = Transformer(styles).style
+    output_bytes = sum(len(style(line).encode('utf-8')) + 1 for line in lines)
+    return {
+        'case': case.id,
+        'lines': len(lines),
+        'bytes': input_bytes,
+        'output_bytes_per_line': output_bytes / len(lines),
+        'seconds': seconds,
+        'lines_per_s': len(lines) / seconds,
+        'mb_per_s': input_bytes / seconds / 1e6,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def _run_style(lines, styles, conf, style_name, backend):
+    style = Transformer(styles).style
+    start = time.perf_counter()
+    for line in lines:
+        style(line)
+    return time.perf_counter() - start
+
+
+def _run_style_map(lines, styles, conf, style_name, backend):
+    get_style_map = LineStyleProcessor().get_style_map
+    start = time.perf_counter()
+    for line in lines:
+        get_style_map(line, styles)
+    return time.perf_counter() - start
+
+
+def _run_cli(lines, styles, conf, style_name, backend):
+    tmpdir = tempfile.mkdtemp()
+    conf_path = os.path.join(tmpdir, 'txts.conf')
+    input_path = os.path.join(tmpdir, 'input.log')
+    with open(conf_path, 'w') as f:
+        f.write(conf)
+    with open(input_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    argv, stdout = sys.argv, sys.stdout
+    sys.argv = ['txts', '--color-always', '--no-cache', '--regex-backend', backend,
+                '-c', conf_path, '-n', style_name, input_path]
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.perf_counter()
+        txts.main()
+        return time.perf_counter() - start
+    finally:
+        sys.stdout.close()
+        sys.argv, sys.stdout = argv, stdout
+        os.remove(conf_path)
+        os.remove(input_path)
+        os.rmdir(tmpdir)
+
+
+def _run_logging(lines, styles, conf, style_name, backend):
+    import logging
+    from txtstyle.loghandler import TxtStyleHandler
+
+    stream = open(os.devnull, 'w')
+    handler = TxtStyleHandler(stream, styles=styles, color_always=True,
+                              fmt='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.Logger('bench')
+    logger.addHandler(handler)
+    try:
+        start = time.perf_counter()
+        for line in lines:
+            logger.info(line)
+        handler.flush()
+        return time.perf_counter() - start
+    finally:
+        handler.close()
+        stream.close()
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+
+def run_in_subprocess(case, line_count, repeat):
+    output = subprocess.check_output([
+        sys.executable, '-m', 'benchmarks.bench', '--run-case', case.id,
+        '--backend', case.backend, '--lines', str(line_count), '--repeat', str(repeat)])
+    return json.loads(output.decode('utf-8'))
+
+
+def run_startup(style_names, runs):
+    """\
+    Returns the median time in seconds txts takes to style an empty file
+    with each built-in style, with a cached style and with --no-cache.
+    Runs of both modes alternate so that both see the same load.
+    """
+    import shutil
+    import statistics
+
+    tmpdir = tempfile.mkdtemp()
+    conf_path = os.path.join(tmpdir, 'txts.conf')
+    input_path = os.path.join(tmpdir, 'empty.log')
+    with open(conf_path, 'w') as f:
+        f.write(DEFAULT_CONF)
+    open(input_path, 'w').close()
+    env = dict(os.environ, XDG_CACHE_HOME=os.path.join(tmpdir, 'cache'))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def run(args):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-m', 'txtstyle.txts', '--color-always',
+                               '-c', conf_path] + args + [input_path], cwd=root, env=env)
+        return time.perf_counter() - start
+
+    results = []
+    try:
+        for style_name in style_names:
+            run(['-n', style_name]) # fills the cache
+            times = {'cache': [], 'no_cache': []}
+            for i in range(runs):
+                times['cache'].append(run(['-n', style_name]))
+                times['no_cache'].append(run(['--no-cache', '-n', style_name]))
+            results.append({
+                'style': style_name,
+                'cache_seconds': statistics.median(times['cache']),
+                'no_cache_seconds': statistics.median(times['no_cache']),
+            })
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return results
+
+
+def print_startup_report(results):
+    print('%-12s %10s %12s %9s' % ('style', 'cache ms', 'no-cache ms', 'change'))
+    for r in results:
+        print('%-12s %10.1f %12.1f %+8.1f%%' % (
+            r['style'], r['cache_seconds'] * 1000, r['no_cache_seconds'] * 1000,
+            (r['cache_seconds'] / r['no_cache_seconds'] - 1) * 100))
+
+
+def compare(results, baseline, threshold):
+    """\
+    Returns the ids of cases whose lines/s dropped by more than threshold.
+    """
+    baseline_by_case = dict((r['case'], r) for r in baseline)
+    regressions = []
+    for result in results:
+        before = baseline_by_case.get(result['case'])
+        if before is None:
+            result['change'] = None
+            continue
+        result['change'] = result['lines_per_s'] / before['lines_per_s'] - 1
+        if result['change'] < -threshold:
+            regressions.append(result['case'])
+    return regressions
+
+
+def print_report(results, regressions=()):
+    print('%-52s %12s %9s %9s %9s %9s' % ('case', 'lines/s', 'MB/s', 'out B/ln', 'RSS MB', 'change'))
+    for r in results:
+        rss = '%9.1f' % r['peak_rss_mb'] if r['peak_rss_mb'] is not None else '%9s' % '-'
+        change = '%+8.1f%%' % (r['change'] * 100) if r.get('change') is not None else '%9s' % '-'
+        flag = '  REGRESSION' if r['case'] in regressions else ''
+        print('%-52s %12.0f %9.2f %9.1f %s %s%s' % (
+            r['case'], r['lines_per_s'], r['mb_per_s'], r['output_bytes_per_line'], rss, change, flag))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='TxtStyle throughput benchmarks.')
+    parser.add_argument('--filter', help='Only run cases whose id contains this string.')
+    parser.add_argument('--list', help='List case ids.', action='store_true')
+    parser.add_argument('--lines', type=int, default=DEFAULT_LINES, help='Lines per corpus. Default is: %i' % DEFAULT_LINES)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Runs per case, the fastest is reported. Default is: %i' % DEFAULT_REPEAT)
+    parser.add_argument('--save', help='Save results to a JSON file.')
+    parser.add_argument('--compare', help='Compare results to a JSON file saved with --save.')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Relative slowdown reported as a regression. Default is: %g' % DEFAULT_THRESHOLD)
+    parser.add_argument('--backend', choices=BACKENDS, action='append', help='Regex backend to run the cases with. Repeat to compare backends. Default is: re')
+    parser.add_argument('--startup', help='Measure the startup time of txts with cached and uncached styles instead.', action='store_true')
+    parser.add_argument('--runs', type=int, default=DEFAULT_STARTUP_RUNS, help='Runs per style with --startup, the median is reported. Default is: %i' % DEFAULT_STARTUP_RUNS)
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.startup:
+        style_names = sorted(generators.STYLE_GENERATORS)
+        if args.filter:
+            style_names = [n for n in style_names if args.filter in n]
+        print_startup_report(run_startup(style_names, args.runs))
+        return
+
+    backends = []
+    for backend in args.backend or [BACKEND_RE]:
+        if get_module(backend) is None:
+            sys.stderr.write('Skipping regex backend "%s", it is not installed\n' % backend)
+        elif backend not in backends:
+            backends.append(backend)
+    cases = [c for c in get_cases(backends) if not args.filter or args.filter in c.id]
+
+    if args.run_case:
+        case = [c for c in cases if c.id == args.run_case][0]
+        sys.stdout.write(json.dumps(run_case(case, args.lines, args.repeat)))
+        return
+
+    if args.list:
+        for case in cases:
+            print(case.id)
+        return
+
+    results = [run_in_subprocess(c, args.lines, args.repeat) for c in cases]
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)['results'], args.threshold)
+
+    print_report(results, regressions)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
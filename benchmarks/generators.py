@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Deterministic generators of input lines for benchmarks. Each generator
+# takes a random.Random instance and a line count and returns a list of
+# lines without trailing newlines.
+
+import random
+
+_WORDS = ['connect', 'disconnect', 'request', 'response', 'session', 'user',
+          'cache', 'query', 'timeout', 'retry', 'worker', 'queue', 'started',
+          'stopped', 'payload', 'handler', 'client', 'server', 'status', 'ok']
+
+_MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+           'August', 'September', 'October', 'November', 'December']
+
+
+def _ip(rng):
+    return '%i.%i.%i.%i' % (rng.randint(1, 254), rng.randint(0, 255),
+                            rng.randint(0, 255), rng.randint(1, 254))
+
+def _date(rng):
+    return '20%02i-%02i-%02i' % (rng.randint(0, 30), rng.randint(1, 12), rng.randint(1, 28))
+
+def _time(rng):
+    return '%02i:%02i:%02i' % (rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+
+def _words(rng, count):
+    return ' '.join(rng.choice(_WORDS) for i in range(count))
+
+
+def example_lines(rng, count):
+    lines = []
+    for i in range(count):
+        service = rng.choice(['dns 53/udp/tcp', 'http 80/tcp', 'smtp 25/tcp'])
+        message = rng.choice([
+            'connect', 'disconnect',
+            'recv: Query Type A, Class IN, Name evil.org',
+            'send: mail.evil.org 3600 IN A %s' % _ip(rng),
+            'recv: GET /index.html HTTP/1.1',
+            'send: 200 OK',
+            'error: connection lost',
+            'stat: %i qtype=A qclass=IN' % rng.randint(1, 9)])
+        lines.append('%s %s [samplesession] [%s] [%s:%i] %s' % (
+            _date(rng), _time(rng), service, _ip(rng), rng.randint(1024, 65535), message))
+    return lines
+
+
+def java_lines(rng, count):
+    lines = []
+    while len(lines) < count:
+        level = rng.choice(['INFO', 'DEBUG', 'WARN', 'INFO', 'ERROR'])
+        lines.append('%s %s,%03i %s [%s] com.example.%s.%s: %s' % (
+            _date(rng), _time(rng), rng.randint(0, 999), level,
+            rng.choice(['main', 'worker-1', 'http-nio-8080-exec-3']),
+            rng.choice(['service', 'web', 'dao']),
+            rng.choice(['UserService', 'OrderController', 'CacheManager']),
+            _words(rng, rng.randint(3, 10))))
+
+        if rng.random() < 0.05:
+            lines.append('java.lang.IllegalStateException: %s' % _words(rng, 4))
+            for j in range(rng.randint(3, 12)):
+                cls = rng.choice(['Foo', 'Bar', 'Baz'])
+                lines.append('\tat %s.example.%s.%s(%s.java:%i)' % (
+                    rng.choice(['com', 'org']), cls.lower(), cls, cls, rng.randint(1, 999)))
+    return lines[:count]
+
+
+def ps_lines(rng, count):
+    lines = ['USER       PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND']
+    while len(lines) < count:
+        lines.append('%-8s %6i %4.1f %4.1f %6i %5i %-8s %-4s %5s %6s %s' % (
+            rng.choice(['root', 'www-data', 'postgres', 'arman']),
+            rng.randint(1, 99999), rng.random() * 100, rng.random() * 20,
+            rng.randint(1000, 999999), rng.randint(100, 99999),
+            rng.choice(['?', 'pts/0', 'pts/1']), rng.choice(['S', 'Ss', 'R+', 'Sl']),
+            _time(rng)[:5], '%i:%02i' % (rng.randint(0, 99), rng.randint(0, 59)),
+            rng.choice(['/usr/sbin/sshd -D', 'postgres: writer process', 'bash',
+                        '/usr/bin/python3 -m http.server 8000'])))
+    return lines[:count]
+
+
+def ifconfig_lines(rng, count):
+    lines = []
+    while len(lines) < count:
+        mac = ':'.join('%02x' % rng.randint(0, 255) for i in range(6))
+        lines.extend([
+            '%-10sLink encap:Ethernet  HWaddr %s' % (rng.choice(['eth0', 'wlan0', 'lo']), mac),
+            '          inet addr:%s  Bcast:%s  Mask:255.255.255.0' % (_ip(rng), _ip(rng)),
+            '          UP BROADCAST RUNNING MULTICAST  MTU:1500  Metric:1',
+            '          RX packets:%i errors:%i dropped:0 overruns:0 frame:0' % (
+                rng.randint(0, 10 ** 7), rng.randint(0, 9)),
+            '          TX packets:%i errors:%i dropped:0 overruns:0 carrier:0' % (
+                rng.randint(0, 10 ** 7), rng.randint(0, 9)),
+            ''])
+    return lines[:count]
+
+
+def calendar_lines(rng, count):
+    lines = []
+    while len(lines) < count:
+        year = rng.randint(1990, 2030)
+        months = rng.sample(_MONTHS, 3)
+        lines.append('%s%i' % (' ' * 29, year))
+        lines.append('      '.join('%20s' % m for m in months))
+        lines.append('  '.join(['Su Mo Tu We Th Fr Sa'] * 3))
+        for week in range(5):
+            days = ' '.join('%2i' % ((week * 7 + d) % 31 + 1) for d in range(7))
+            lines.append('  '.join([days] * 3))
+        lines.append('')
+    return lines[:count]
+
+
+STYLE_GENERATORS = {
+    'example': example_lines,
+    'java': java_lines,
+    'ps': ps_lines,
+    'ifconfig': ifconfig_lines,
+    'calendar': calendar_lines,
+}
+
+
+def synthetic_lines(rng, count, line_length, density, rule_count):
+    """\
+    Returns lines of about line_length characters where roughly `density`
+    of the tokens match one of the rules returned by synthetic_rules().
+    """
+    lines = []
+    for i in range(count):
+        tokens = []
+        length = 0
+        while length < line_length:
+            if rng.random() < density:
+                token = 'key%i=%i' % (rng.randrange(rule_count), rng.randint(0, 9999))
+            else:
+                token = rng.choice(_WORDS)
+            tokens.append(token)
+            length += len(token) + 1
+        lines.append(' '.join(tokens)[:line_length])
+    return lines
+
+
+def synthetic_rules(rule_count):
+    """\
+    Returns (transform keys, pattern) pairs of a style with rule_count rules.
+    """
+    colors = ['red', 'green', 'yellow', 'blue', 'magenta', 'cyan']
+    return [(colors[i % len(colors)], r'key%i=\d+' % i) for i in range(rule_count)]
+
+
+def generate(corpus, count, seed=0):
+    rng = random.Random(seed)
+    if corpus in STYLE_GENERATORS:
+        return STYLE_GENERATORS[corpus](rng, count)
+    raise KeyError(corpus)
@@ -38,6 +38,43 @@ assert_exit_code 0 "--color-always $test_log"
 assert_exit_code 0 "--color-always -n java $test_log"
 assert_exit_code 0 "--color-always -r 'some pattern' $test_log"
 
+# --no-cache
+assert_exit_code 0 "--no-cache -n java $test_log"
+assert_exit_code 0 "--no-cache --conf $test_data_dir/test.txts.conf -n first $test_log"
+
+# --jobs
+assert_exit_code 0 "--jobs 2 --color-always -n java $test_log"
+assert_exit_code 0 "-j 2 -n java $test_log"
+
+# several files
+assert_exit_code 0 "-n java $test_log $test_log"
+assert_exit_code 0 "--prefix --color-always -n java $test_log $test_log"
+
+# rotated log sets
+assert_exit_code 0 "-n java $test_data_dir"
+assert_exit_code 0 "-j 2 --color-always -n java '${test_data_dir}/*-log'"
+
+# --regex-backend
+assert_exit_code 0 "--regex-backend re2 -n java $test_log"
+assert_exit_code 0 "--regex-backend regex -r foo $test_log"
+
+# --stats
+assert_exit_code 0 "--stats -n java $test_log"
+
+# --line-budget
+assert_exit_code 0 "--line-budget 50 -n java $test_log"
+
+# --cache-size
+assert_exit_code 0 "--cache-size 100 --color-always -n java $test_log"
+
+# --pager writes the file as usual if the output isn't a terminal
+assert_exit_code 0 "--pager -n java $test_log"
+
+# --lines and --tail
+assert_exit_code 0 "--lines 2:4 -n java $test_log"
+assert_exit_code 0 "--lines 3: --color-always -n java $test_log"
+assert_exit_code 0 "--tail 5 -n java $test_log"
+
 # --version
 assert_exit_code 0 "--version"
 assert_exit_code 2 "-v"
@@ -47,6 +84,20 @@ assert_exit_code 2 "-v"
 #
 assert_exit_code 1 "-n INVALID_STYLE_NAME $test_log"
 assert_exit_code 2 "INVALID_FILE_PATH"
+assert_exit_code 2 "'INVALID_PATTERN*'"
+assert_exit_code 2 "-j 0 $test_log"
+assert_exit_code 2 "--cache-size -1 $test_log"
+assert_exit_code 2 "--line-budget 0 $test_log"
+assert_exit_code 2 "--follow"
+assert_exit_code 2 "--regex-backend pcre -n java $test_log"
+assert_exit_code 2 "--offset-file offsets $test_log"
+assert_exit_code 2 "--offset-file offsets -f $test_log $test_log"
+assert_exit_code 2 "--pager -n java $test_log $test_log"
+assert_exit_code 2 "--pager -f -n java $test_log"
+assert_exit_code 2 "--lines 4:2 -n java $test_log"
+assert_exit_code 2 "--tail -1 -n java $test_log"
+assert_exit_code 2 "--tail 5 -f -n java $test_log"
+assert_exit_code 2 "--tail 5 -n java $test_log $test_log"
 assert_exit_code 2 "--conf INVALID_CONF_FILE -n java"
 # cannot combine --name and --regex
 assert_exit_code 2 "--name java --regex 'some pattern' $test_log"
@@ -0,0 +1,3 @@
+#!/bin/sh
+
+python -m benchmarks.bench "$@"
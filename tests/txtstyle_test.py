@@ -1,17 +1,78 @@
+import asyncio
+import bz2
+import gzip
+import io
+import logging
+import lzma
+import os
+import platform
 import re
+import shutil
+import signal
+import subprocess
 import sys
+import tempfile
 import unittest
 
+from txtstyle.atomicfile import write_atomically
+from txtstyle.blocks import LineSplitter
+from txtstyle.blocks import read_blocks
+from txtstyle.confparser import ConfIndex
 from txtstyle.confparser import ConfParser
+from txtstyle.confparser import ConfParserException
+from txtstyle.linestyleprocessor import BudgetedLineStyleProcessor
+from txtstyle.linestyleprocessor import StylePlan
 from txtstyle.linestyleprocessor import LineStyleProcessor
+from txtstyle.linestyleprocessor import RegionAllocator
+from txtstyle.parallel import ParallelStyler
+from benchmarks import bench
+from txtstyle import patternanalysis
+from txtstyle.stylecache import StyleCache
+from txtstyle.decompression import DecompressionError
+from txtstyle.decompression import get_compression
+from txtstyle.decompression import read_ahead
+from txtstyle.follow import DEFAULT_TAIL_LINES
+from txtstyle.follow import Follower
+from txtstyle.follow import PollWatcher
+from txtstyle.lineindex import LineOffsetIndex
+from txtstyle.lineindex import line_range
+from txtstyle.lineindex import tail_offset
+from txtstyle.loghandler import TxtStyleFormatter
+from txtstyle.loghandler import TxtStyleHandler
+from txtstyle.lrucache import LRUCache
+from txtstyle.multiplex import Multiplexer
+from txtstyle.multiplex import style_stream
+from txtstyle.pager import LineIndex
+from txtstyle.pager import Pager
+from txtstyle.pager import clip
+from txtstyle.patternanalysis import backtracking_risk
+from txtstyle import rotation
+from txtstyle.rotation import RotatedSetStyler
+from txtstyle.patternanalysis import can_match_empty
+from txtstyle.patternanalysis import may_overlap
+from txtstyle.patternanalysis import is_digit_agnostic
+from txtstyle import regexbackend
+from txtstyle.stats import Stats
+from txtstyle.patternanalysis import required_literals
+from txtstyle.styleprogram import _MIN_WORK
+from txtstyle.styleprogram import _WORK_PER_CHAR
+from txtstyle.styleprogram import compile_program
 from txtstyle.transformer import _STYLES
 from txtstyle.transformer import IndexStyle
 from txtstyle.transformer import RegexStyle
 from txtstyle.transformer import Transformer
+from txtstyle.transformer import ENGINE_PROGRAM
+from txtstyle.palette import NAMED_STYLE_MAP
+from txtstyle.txts import Txts
+from txtstyle.txts import parse_common_args
+from txtstyle.txts import parse_line_range
+from txtstyle.txtsconf import DEFAULT_CONF
 
 sys.path.append("..")
 
 _TEST_DATA_DIR = 'tests/testdata'
+# Maximum time for importing the txts entry point
+_IMPORT_TIME_BUDGET = 0.030
 
 def regex(pattern):
     return re.compile(pattern)
@@ -136,11 +197,135 @@ class LineStyleProcessorTests(unittest.TestCase):
         self.assertEqual(style_map[(55,60)], s2)
         self.assertEqual(style_map[(60,65)], s3)
 
+    def test_get_style_map_is_ordered_by_region(self):
+        line = "a test string that needs to be longer than 65 characters.........."
+        s1 = IndexStyle([(60,65), (15,20), (1,5)], ['red'])
+        s2 = RegexStyle(regex("t"), ['blue'])
+        style_map = self.lineStyleProcessor.get_style_map(line, [s1, s2])
+        self.assertEqual(sorted(style_map.keys()), list(style_map.keys()))
+
+    def test_region_allocator(self):
+        allocator = RegionAllocator()
+        self.assertTrue(allocator.allocate(10, 20, 's1'))
+        self.assertTrue(allocator.allocate(0, 5, 's2'))
+        self.assertTrue(allocator.allocate(20, 25, 's3'))
+        self.assertTrue(allocator.allocate(5, 10, 's4'))
+        self.assertFalse(allocator.allocate(19, 21, 's5'))
+        self.assertFalse(allocator.allocate(0, 30, 's5'))
+        self.assertFalse(allocator.allocate(12, 13, 's5'))
+        # empty regions never overlap
+        self.assertTrue(allocator.allocate(12, 12, 's6'))
+        self.assertEqual([((0,5), 's2'), ((5,10), 's4'), ((10,20), 's1'),
+                          ((12,12), 's6'), ((20,25), 's3')],
+                         list(allocator.style_map().items()))
+
     def assert_results(self, expected_results, results):
         self.assertEqual(len(expected_results), len(results))
         for i, result in enumerate(results):
             self.assertEqual(expected_results[i], result)
 
+    def test_index_plan(self):
+        styles = [
+            RegexStyle('^HEADER', ['red'], apply_to_whole_line=True),
+            IndexStyle([(0, 4)], ['green']),
+            RegexStyle(r'\d+', ['blue']),
+            IndexStyle([(2, 8), (10, None)], ['cyan']),
+            IndexStyle([(30, 40)], ['white']),
+            ]
+        plan = StylePlan(styles)
+        processor = LineStyleProcessor()
+        for line in ['HEADER line', 'abcdefghijklmn', 'abcde 12 ghijklmn', 'ab', '']:
+            self.assertEqual(processor.get_style_map(line, styles),
+                             processor.get_style_map(line, styles, plan=plan), line)
+
+        style_map = processor.get_style_map('abcdefghijkl', styles, plan=plan)
+        self.assertIs(style_map, processor.get_style_map('mnopqrstuvwx', styles, plan=plan))
+        self.assertEqual([(0,4), (10,12)], list(style_map))
+
+    def test_style_plan_reorders_independent_styles(self):
+        digits = RegexStyle(r'\d+', ['red'])
+        words = RegexStyle('[a-z]+', ['blue'])
+        spaces = RegexStyle(r'\s+', ['green'])
+        styles = [RegexStyle('^#', ['grey'], apply_to_whole_line=True), digits, words, spaces]
+        plan = StylePlan(styles, reorder_interval=2)
+        self.assertEqual([(1, 4)], plan.groups)
+
+        processor = LineStyleProcessor()
+        for line in ['abc def', 'x y', '1 a', '# 1 a']:
+            self.assertEqual(processor.get_style_map(line, styles),
+                             processor.get_style_map(line, styles, plan=plan), line)
+        self.assertEqual([words, spaces, digits], plan.order[1:])
+
+        # [a-z]+ and \w+ can overlap, so declared order decides
+        self.assertEqual([], StylePlan([words, RegexStyle(r'\w+', ['red'])]).groups)
+
+    def test_style_plan_stops_when_line_is_styled(self):
+        stats = Stats()
+        styles = [IndexStyle([(0, 3)], ['red']), RegexStyle('o', ['blue']), RegexStyle('x*', ['green'])]
+        processor = LineStyleProcessor(stats)
+        plan = StylePlan(styles[:2])
+        self.assertEqual([(0, 3)], list(processor.get_style_map('foo', styles[:2], plan=plan)))
+        self.assertEqual(0, stats.rule(styles[1]).evaluations)
+
+        # x* matches empty regions, which are styled regardless
+        plan = StylePlan(styles)
+        self.assertEqual([(0, 0), (0, 3), (1, 1), (2, 2)],
+                         list(processor.get_style_map('foo', styles, plan=plan)))
+        self.assertEqual(1, stats.rule(styles[2]).evaluations)
+
+    def test_line_budget(self):
+        processor = BudgetedLineStyleProcessor(0.05)
+        styles = [RegexStyle(r'(a+)+$', ['red']), RegexStyle('b', ['blue'])]
+        try:
+            self.assertEqual({}, processor.get_style_map('a' * 40 + 'b', styles))
+            self.assertEqual(1, processor.exceeded)
+            style_map = processor.get_style_map('aaa b', styles)
+            self.assertEqual([(4,5)], list(style_map))
+            self.assertEqual(1, processor.exceeded)
+        finally:
+            processor.stop_timer()
+
+    def test_lines_over_budget_are_not_cached(self):
+        styles = [RegexStyle('line', ['red'])]
+        uncached = Transformer(styles)
+        transformer = Transformer(styles, line_budget=60, cache_size=10)
+        processor = transformer.line_style_processor
+        self.assertIsNotNone(transformer.shape_cache)
+        try:
+            # starts the timer
+            self.assertEqual('other', transformer.style('other'))
+            # any line goes over a negative budget, e.g. after a GC pause
+            processor.budget = -1
+            self.assertEqual('line 1', transformer.style('line 1'))
+            processor.budget = 60
+            self.assertEqual(uncached.style('line 2'), transformer.style('line 2'))
+            self.assertEqual(uncached.style('line 1'), transformer.style('line 1'))
+            self.assertEqual(1, processor.exceeded)
+        finally:
+            transformer.close()
+
+    @unittest.skipUnless(hasattr(signal, 'setitimer'), 'requires setitimer')
+    def test_line_budget_timer_is_restored(self):
+        def handler(signum, frame):
+            pass
+        previous = signal.signal(signal.SIGALRM, handler)
+        try:
+            transformer = Transformer([RegexStyle('a', ['red'])], line_budget=0.05)
+            transformer.style('a')
+            self.assertNotEqual(handler, signal.getsignal(signal.SIGALRM))
+            self.assertNotEqual(0, signal.getitimer(signal.ITIMER_REAL)[0])
+            transformer.close()
+            self.assertEqual(handler, signal.getsignal(signal.SIGALRM))
+            self.assertEqual((0, 0), signal.getitimer(signal.ITIMER_REAL))
+
+            # restarted by the next line
+            transformer.style('a')
+            self.assertNotEqual(0, signal.getitimer(signal.ITIMER_REAL)[0])
+            transformer.close()
+            self.assertEqual(handler, signal.getsignal(signal.SIGALRM))
+        finally:
+            signal.signal(signal.SIGALRM, previous)
+
     def test_repeated_invocation_returns_new_list(self):
         results1 = self.find_regions('string', 'in')
         results2 = self.find_regions('string', 'in')
@@ -360,6 +545,76 @@ class ConfParserTests(unittest.TestCase):
             msg = "Expected apply_to_whole_line=%s for %r" % (expected.apply_to_whole_line, style)
             self.assertEqual(expected.apply_to_whole_line, style.apply_to_whole_line, msg)
 
+    def test_conf_file_is_indexed_like_lines(self):
+        conf_path = '%s/test.txts.conf' % _TEST_DATA_DIR
+        with open(conf_path) as f:
+            index = ConfIndex(f.readlines())
+        file_index = ConfIndex(conf_path=conf_path)
+        self.assertEqual(sorted(index.styles), sorted(file_index.styles))
+
+        file_parser = ConfParser(conf_path=conf_path)
+        for name in index.styles:
+            self.assertEqual(self.confparser._get_style_defs(name), file_parser._get_style_defs(name))
+
+    def test_includes(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        os.mkdir(os.path.join(tmpdir, 'teams'))
+        conf_files = {
+            'main.conf': '[Style="main"]\nred: regex("a")\n\ninclude "teams/team.conf"\n'
+                         '[Style="team"]\nblue: regex("shadowed")\n',
+            'teams/team.conf': '[Style="team"]\ngreen: regex("b")\ninclude cycle.conf\n',
+            'teams/cycle.conf': 'include team.conf\n',
+        }
+        for name, conf in conf_files.items():
+            with open(os.path.join(tmpdir, name), 'w') as f:
+                f.write(conf)
+
+        confparser = ConfParser(conf_path=os.path.join(tmpdir, 'main.conf'))
+        self.assertEqual(['a'], [s.regex_obj.pattern for s in confparser.get_styles('main')])
+        # checked for definitions that would belong to "main"
+        self.assertEqual([os.path.join(tmpdir, 'teams/team.conf')], confparser.included_paths)
+        self.assertEqual(['b'], [s.regex_obj.pattern for s in confparser.get_styles('team')])
+        self.assertEqual([os.path.join(tmpdir, 'teams/team.conf'), os.path.join(tmpdir, 'teams/cycle.conf')],
+                         confparser.included_paths)
+        self.assert_style_error('missing', 'Conf file includes itself: %s' % os.path.join(tmpdir, 'teams/team.conf'),
+                                confparser)
+
+        confparser = ConfParser(['include missing.conf'], conf_path=os.path.join(tmpdir, 'main.conf'))
+        self.assert_style_error('main', 'Included conf file not found: %s' % os.path.join(tmpdir, 'missing.conf'),
+                                confparser)
+
+        # definitions that would not belong to the style they follow
+        with open(os.path.join(tmpdir, 'frag.conf'), 'w') as f:
+            f.write('# fragment\n\nred: regex("z")\n')
+        conf_lines = ['[Style="a"]', 'blue: regex("x")', 'include "teams/team.conf"', 'green: regex("y")']
+        confparser = ConfParser(conf_lines, conf_path=os.path.join(tmpdir, 'main.conf'))
+        self.assert_style_error('a', 'Style definitions after include "teams/team.conf" must follow a style header',
+                                confparser)
+        conf_lines = ['[Style="a"]', 'blue: regex("x")', 'include "frag.conf"', '', '[Style="b"]']
+        confparser = ConfParser(conf_lines, conf_path=os.path.join(tmpdir, 'main.conf'))
+        self.assert_style_error('a', 'Included conf file must start with a style header: %s' % os.path.join(tmpdir, 'frag.conf'),
+                                confparser)
+        with open(os.path.join(tmpdir, 'after.conf'), 'w') as f:
+            f.write('[Style="a"]\nblue: regex("x")\ninclude "teams/team.conf"\n# comment\ngreen: regex("y")\n')
+        self.assert_style_error('a', 'Style definitions after include "teams/team.conf" must follow a style header',
+                                ConfParser(conf_path=os.path.join(tmpdir, 'after.conf')))
+
+    def test_pattern_warnings(self):
+        confparser = ConfParser([
+            '[Style="slow"]',
+            'red: regex("(\\w+\\s?)*$")',
+            'blue: regex("\\d+")',
+        ])
+        confparser.get_styles('slow')
+        self.assertEqual(['Style "slow": pattern "(\\w+\\s?)*$" may be very slow on some lines (nested quantifiers)'],
+                         confparser.warnings)
+
+        confparser = ConfParser(DEFAULT_CONF.splitlines())
+        for name in re.findall(r'\[Style="(\w+)"\]', DEFAULT_CONF):
+            confparser.get_styles(name)
+            self.assertEqual([], confparser.warnings, name)
+
     def assert_index_styles(self, styles):
         self.assertEqual(len(self.expected_styles), len(styles))
         for i, style in enumerate(styles):
@@ -367,9 +622,9 @@ class ConfParserTests(unittest.TestCase):
             self.assertEqual(expected.regions, style.regions)
             self.assertEqual(expected.transforms, style.transforms)
 
-    def assert_style_error(self, style, expected_error_msg):
+    def assert_style_error(self, style, expected_error_msg, confparser=None):
         try:
-            styles = self.confparser.get_styles(style)
+            styles = (confparser or self.confparser).get_styles(style)
             self.fail('should fail on invalid style definition')
         except Exception as e:
             self.assertEqual(e.message, expected_error_msg)
@@ -378,8 +633,8 @@ class TransformerTests(unittest.TestCase):
     
     def test_substring_style(self):
         input_line = "some text..."
-        # <red>some<default> text...<default>
-        expected_output_line = "\033[31msome\033[m text...\033[m"
+        # <red>some<default> text...
+        expected_output_line = "\033[31msome\033[m text..."
 
         self.assert_styled_line([IndexStyle([(0,4)], ["red"])],
                                 input_line, expected_output_line)
@@ -406,6 +661,59 @@ class TransformerTests(unittest.TestCase):
         self.assert_styled_line([IndexStyle([(0, 99999)], ["red"])],
                                 input_line, expected_output_line)
 
+    def test_escape_sequences_are_coalesced(self):
+        self.assertEqual('\033[37;1;48;5;19m', RegexStyle('x', ['white', 'bold', 'on-19']).transforms)
+        self.assertEqual('\033[1m', RegexStyle('x', ['bold']).transforms)
+        styles = [RegexStyle(r"\d+", ["red"]), RegexStyle("-", ["red"]), RegexStyle("x", ["blue"])]
+        transformer = Transformer(styles)
+        # adjacent regions with the same style are merged
+        self.assertEqual('\033[31m10-12\033[m ok', transformer.style('10-12 ok'))
+        # a reset is written where a style ends, not after unstyled text
+        self.assertEqual('a \033[31m1\033[m b', transformer.style('a 1 b'))
+        self.assertEqual('\033[31m1\033[34mx\033[m', transformer.style('1x'))
+
+        # styles that don't show on spaces span the spaces between their regions
+        self.assertEqual('\033[38;5;220;1mMo  Tu\033[m', Transformer([RegexStyle(r"\w+", ["220", "bold"])]).style('Mo  Tu'))
+        self.assertEqual('\033[4mMo\033[m \033[4mTu\033[m', Transformer([RegexStyle(r"\w+", ["underline"])]).style('Mo Tu'))
+        # and are reset only if the next style doesn't override them
+        self.assertEqual('\033[31m1 \033[34mx\033[m', transformer.style('1 x'))
+
+        line = 'nothing to style'
+        self.assertIs(line, transformer.style(line))
+        self.assertIs(line, Transformer([IndexStyle([(0, 4)], [])]).style(line))
+        line = b'nothing to style'
+        self.assertIs(line, transformer._style(line, transformer.ascii_styles, None, transformer.ascii_plan))
+
+    def test_ascii_blocks_are_styled_like_text(self):
+        styles = [
+            RegexStyle(r"\d+", ["red"]),
+            RegexStyle(r"a\sb", ["blue"]),
+            RegexStyle("(?i)error", ["bold"], apply_to_whole_line=True),
+            IndexStyle([(0, 2)], ["green"]),
+            ]
+        transformer = Transformer(styles)
+        self.assertIsNotNone(transformer.ascii_styles)
+        lines = ['x 12 a b', 'Error 3', '', 'a\x1cb 4']
+        expected = ''.join(transformer.style(line) + '\n' for line in lines).encode('utf-8')
+        self.assertEqual(expected, transformer.style_block('\n'.join(lines).encode('utf-8')))
+
+    def test_index_styles_are_rendered_from_plan(self):
+        styles = [IndexStyle([(0, 2), (4, None)], ['red']), RegexStyle('x', ['blue'])]
+        transformer = Transformer(styles)
+        self.assertEqual('\033[31mab\033[mcd\033[31mef\033[m', transformer.style('abcdef'))
+        self.assertEqual('\033[31mgh\033[mij\033[31mkl\033[m', transformer.style('ghijkl'))
+        self.assertEqual('\033[31mgh\033[34mx\033[mj\033[31mkl\033[m', transformer.style('ghxjkl'))
+        self.assertEqual(b'\033[31mab\033[m\n', transformer.style_block(b'ab'))
+
+    def test_style_block_preserves_invalid_utf8(self):
+        transformer = Transformer([RegexStyle("bad", ["red"])])
+        self.assertEqual(b'\xff\xfe \x1b[31mbad\x1b[m caf\xc3\xa9\n',
+                         transformer.style_block(b'\xff\xfe bad caf\xc3\xa9'))
+
+    def test_no_ascii_styles_for_non_ascii_patterns(self):
+        self.assertIsNone(Transformer([RegexStyle("caf\u00e9", ["red"])]).ascii_styles)
+        self.assertIsNone(Transformer([RegexStyle("café", ["red"])]).ascii_styles)
+
     def assert_styled_line(self, styles, input_line, expected_output_line):
         transformer = Transformer(styles)
         actual_output_line = transformer.style(input_line)
@@ -432,19 +740,1093 @@ class TransformerTests(unittest.TestCase):
             unstyled_line = self.remove_styles(styled_line)
             self.assertEqual(original_line, unstyled_line)
 
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        # b is the least recently used
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(1, cache.get('a'))
+        cache.put('d', 4)
+        self.assertNotIn('c', cache)
+        self.assertEqual(['a', 'd'], sorted(k for k in 'abcd' if k in cache))
+        self.assertEqual((3, 1), (cache.hits, cache.misses))
+
+        cache.clear()
+        self.assertEqual((0, 0, 0), (len(cache), cache.hits, cache.misses))
+        self.assertRaises(Exception, LRUCache, 0)
+
+    def test_cached_lines_are_styled_as_uncached(self):
+        with open('example.log') as f:
+            lines = [line.strip('\n') for line in f for i in range(2)]
+        lines += ['ERROR %i at line %i' % (i, i * 7) for i in range(50)]
+        confparser = ConfParser(DEFAULT_CONF.splitlines())
+        for name in ['example', 'java', 'ps']:
+            styles = confparser.get_styles(name)
+            expected = [Transformer(styles).style(line) for line in lines]
+            # small enough for entries to be evicted
+            transformer = Transformer(styles, cache_size=5)
+            self.assertEqual(expected, [transformer.style(line) for line in lines], name)
+            self.assertGreater(transformer.line_cache.hits, 0, name)
+
+        styles = [RegexStyle(r'\d+', ['bold']), RegexStyle('ERROR', ['red'])]
+        transformer = Transformer(styles, cache_size=100)
+        self.assertIsNotNone(transformer.shape_cache)
+        self.assertEqual([Transformer(styles).style(line) for line in lines],
+                         [transformer.style(line) for line in lines])
+        self.assertEqual(Transformer(styles).style_block(b'ERROR 1\nERROR 22\n'),
+                         transformer.style_block(b'ERROR 1\nERROR 22\n'))
+        # lines that differ only in their digits share a style map
+        self.assertGreater(transformer.shape_cache.hits, 0)
+
+    def test_shape_cache_requires_digit_agnostic_patterns(self):
+        # the same digits are matched in lines of the same shape
+        transformer = Transformer([RegexStyle(r'\d{3}', ['bold'])], cache_size=10)
+        self.assertIsNotNone(transformer.shape_cache)
+
+        for pattern in ['[0-5]', '1', r'\b2\d']:
+            transformer = Transformer([RegexStyle('ERROR', ['red']), RegexStyle(pattern, ['bold'])],
+                                      cache_size=10)
+            self.assertIsNone(transformer.shape_cache, pattern)
+            self.assertIsNotNone(transformer.line_cache, pattern)
+            self.assertEqual(Transformer(transformer.styles).style('ERROR 123 045'),
+                             transformer.style('ERROR 123 045'))
+        self.assertIsNone(Transformer([RegexStyle('a', ['red'])]).line_cache)
+
     def remove_styles(self, line):
         unstyled = line.replace(r'\x1b[m', '', 1000)
         unstyled = unstyled.replace("\\'", "'", 1000)
-        for style_key in _STYLES:
-            transform = _STYLES[style_key]
-            escape_code = transform.encode('unicode_escape').decode('utf-8')
-            unstyled = unstyled.replace(escape_code, '', 1000)
-        return unstyled
+        # styles with several keys are written as a single sequence
+        return re.sub(r'\\x1b\[[0-9;]*m', '', unstyled)
 
     def get_lines(self, fname):
         with open(fname, 'r') as f:
             return f.readlines()
 
+class StyleCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.conf_path = os.path.join(self.tmpdir, 'txts.conf')
+        shutil.copy('%s/test.txts.conf' % _TEST_DATA_DIR, self.conf_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cached_styles_are_equal_to_parsed_styles(self):
+        with open(self.conf_path) as f:
+            confparser = ConfParser(f.readlines())
+
+        for name in ['example', 'seventh', 'twelfth']:
+            expected = confparser.get_styles(name)
+            for i in range(2): # miss, then hit
+                styles = StyleCache(self.conf_path, self.cache_dir).get_styles(name)
+                self.assertEqual([self.describe(s) for s in expected],
+                                 [self.describe(s) for s in styles])
+
+    def test_cache_hit_does_not_parse_conf(self):
+        StyleCache(self.conf_path, self.cache_dir).get_styles('first')
+
+        # neither the conf nor the patterns are parsed again
+        names = ['required_literals', 'can_match_empty', 'may_overlap', 'is_digit_agnostic']
+        saved = [getattr(patternanalysis, name) for name in names]
+        get_styles = ConfParser.get_styles
+        for name in names:
+            setattr(patternanalysis, name, None)
+        ConfParser.get_styles = None
+        try:
+            styles = StyleCache(self.conf_path, self.cache_dir).get_styles('first')
+            Transformer(styles, cache_size=10)
+        finally:
+            for name, function in zip(names, saved):
+                setattr(patternanalysis, name, function)
+            ConfParser.get_styles = get_styles
+        self.assertEqual(4, len(styles))
+
+    def test_changed_conf_invalidates_cache(self):
+        styles = StyleCache(self.conf_path, self.cache_dir).get_styles('second')
+        self.assertEqual(r'\w+', styles[0].regex_obj.pattern)
+
+        stat = os.stat(self.conf_path)
+        with open(self.conf_path, 'w') as f:
+            f.write('[Style="second"]\nred: regex("changed")\n')
+        # same mtime, different size
+        os.utime(self.conf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        styles = StyleCache(self.conf_path, self.cache_dir).get_styles('second')
+        self.assertEqual('changed', styles[0].regex_obj.pattern)
+
+    def test_changed_include_invalidates_cache(self):
+        include_path = os.path.join(self.tmpdir, 'team.conf')
+        with open(self.conf_path, 'w') as f:
+            f.write('include team.conf\n')
+        with open(include_path, 'w') as f:
+            f.write('[Style="team"]\nred: regex("before")\n')
+        styles = StyleCache(self.conf_path, self.cache_dir).get_styles('team')
+        self.assertEqual('before', styles[0].regex_obj.pattern)
+
+        with open(include_path, 'w') as f:
+            f.write('[Style="team"]\nred: regex("after")\n')
+        styles = StyleCache(self.conf_path, self.cache_dir).get_styles('team')
+        self.assertEqual('after', styles[0].regex_obj.pattern)
+
+    def test_undefined_style(self):
+        cache = StyleCache(self.conf_path, self.cache_dir)
+        self.assertRaises(ConfParserException, cache.get_styles, 'FOO')
+
+    def test_backend_override_is_not_cached(self):
+        with open(self.conf_path, 'w') as f:
+            f.write('[Style="fast" backend="re2"]\nred: regex("a+")\n')
+
+        styles = StyleCache(self.conf_path, self.cache_dir, backend='regex').get_styles('fast')
+        self.assertEqual('regex', styles[0].backend)
+        for i in range(2): # miss, then hit
+            styles = StyleCache(self.conf_path, self.cache_dir).get_styles('fast')
+            self.assertEqual('re2', styles[0].backend)
+
+    def test_write_atomically(self):
+        path = os.path.join(self.tmpdir, 'state.json')
+        write_atomically(path, b'old')
+        write_atomically(path, b'new')
+        with open(path, 'rb') as f:
+            self.assertEqual(b'new', f.read())
+
+        # a directory can't be replaced by a file
+        os.mkdir(self.cache_dir)
+        self.assertRaises(OSError, write_atomically, self.cache_dir, b'data')
+        # no temporary files left behind
+        self.assertEqual(['cache', 'state.json', 'txts.conf'], sorted(os.listdir(self.tmpdir)))
+
+    def describe(self, style):
+        if isinstance(style, IndexStyle):
+            return (style.regions, style.transforms)
+        return (style.regex_obj.pattern, style.regex_obj.flags,
+                style.apply_to_whole_line, style.transforms)
+
+
+class RegexBackendTests(unittest.TestCase):
+
+    def test_conf_backend(self):
+        conf = ['[Style="fast" backend="re2"]', 'red: regex("a+")',
+                '[Style = "slow"]', 'red: regex("a+")',
+                '[Style="bad" backend="pcre"]', 'red: regex("a+")']
+        self.assertEqual('re2', ConfParser(conf).get_styles('fast')[0].backend)
+        self.assertEqual('re', ConfParser(conf).get_styles('slow')[0].backend)
+        self.assertEqual('regex', ConfParser(conf, 'regex').get_styles('fast')[0].backend)
+        self.assertRaises(ConfParserException, ConfParser(conf).get_styles, 'bad')
+
+    def test_invalid_backend(self):
+        self.assertRaises(Exception, regexbackend.compile_pattern, 'a', 'pcre')
+
+    def test_fallback_for_unsupported_patterns(self):
+        # RE2 has no backreferences
+        style = RegexStyle(r'(\w)\1', ['red'], backend=regexbackend.BACKEND_RE2)
+        self.assertEqual('re', regexbackend.get_backend(style.regex_obj))
+        self.assertEqual([(2, 4)], LineStyleProcessor().find_regions('abccd', style.regex_obj))
+
+    def test_flags_are_kept(self):
+        regex_obj = re.compile('a', re.IGNORECASE)
+        for backend in regexbackend.BACKENDS:
+            self.assertIs(regex_obj, regexbackend.compile_pattern(regex_obj, backend))
+
+    def test_backends_style_alike(self):
+        with open('example.log') as f:
+            lines = [line.strip('\n') for line in f]
+
+        for backend in regexbackend.available_backends():
+            for name in ['example', 'java', 'ifconfig', 'calendar', 'ps']:
+                expected = Transformer(ConfParser(DEFAULT_CONF.splitlines()).get_styles(name))
+                actual = Transformer(ConfParser(DEFAULT_CONF.splitlines(), backend).get_styles(name))
+                for line in lines:
+                    self.assertEqual(expected.style(line), actual.style(line))
+
+class PatternAnalysisTests(unittest.TestCase):
+
+    def test_required_literals(self):
+        self.assertEqual(('Exception',), required_literals(regex('Exception')))
+        self.assertEqual(('evil.org',), required_literals(regex(r'evil\.org')))
+        self.assertEqual(('DEBUG', 'INFO', 'WARN'), required_literals(regex('INFO|DEBUG|WARN')))
+        self.assertEqual(('eth', 'lo', 'wlan'), required_literals(regex(r'(eth|wlan|lo)\d?')))
+        self.assertEqual(('.java:',), required_literals(regex(r'\(\w+\.java:\d+\)')))
+        self.assertEqual(('ab',), required_literals(regex('x?(ab)+')))
+        self.assertEqual(('a',), required_literals(regex('a|ab')))
+
+    def test_no_required_literals(self):
+        self.assertIsNone(required_literals(regex(r'\d+')))
+        self.assertIsNone(required_literals(regex('(ab)?c*')))
+        self.assertIsNone(required_literals(regex('foo|\\w+')))
+        self.assertIsNone(required_literals(regex('(?i)error')))
+        self.assertIsNone(required_literals(regex('(?i:error)')))
+        self.assertIsNone(required_literals(re.compile('error', re.IGNORECASE)))
+        self.assertIsNone(required_literals(regex('')))
+
+    def test_digit_agnostic(self):
+        for pattern in [r'\d+', r'[0-9a-f]+', r'\w+', r'[^\]]*', r'\S+ms', '.*', r'[a-z\d]', r'\d\d:\d\d']:
+            self.assertTrue(is_digit_agnostic(regex(pattern)), pattern)
+        for pattern in ['500', r'[1-3]\d', r'[^5]', r'(\d)\1', r'v[0-4]']:
+            self.assertFalse(is_digit_agnostic(regex(pattern)), pattern)
+
+    def test_backtracking_risk(self):
+        for pattern in [r'(a+)+$', r'(a*)*', r'(\w+\s?)*$', r'(\d+\.?)+x', r'(x+x+)+y', r'(\w+|\d+)*!']:
+            self.assertEqual('nested quantifiers', backtracking_risk(regex(pattern)), pattern)
+        for pattern in [r'(a\w|\wb)*c', r'(\d\w|\w\d)*x', r'(x|x)*y', r'(a|aa)+$', r'(ab|abab)*c', r'(a|a?)+b']:
+            self.assertEqual('overlapping alternatives in a repeat', backtracking_risk(regex(pattern)), pattern)
+        for pattern in [r'(a+b)+', r'([^"]*")*', r'(\w+\s)*', r'(foo|bar)+', r'(?>a+)+$', r'(a++)+$', r'\d+',
+                        r'(a|ab)*c', r'(ab|ac)+']:
+            self.assertIsNone(backtracking_risk(regex(pattern)), pattern)
+
+    def test_may_overlap(self):
+        for a, b in [(r'\d+', '[a-z]+'), ('foo', 'bar'), (r'\s+', r'[a-z]\d'), (r'\[\w+\]', r'\s'), ('(?=a)b', 'a')]:
+            self.assertFalse(may_overlap(regex(a), regex(b)), (a, b))
+        for a, b in [(r'\d+', r'\w+'), ('foo', 'o'), (r'\d+', '.'), ('(?i)x', 'y'), ('[^a]', 'b'), (r'(a)\1', 'b')]:
+            self.assertTrue(may_overlap(regex(a), regex(b)), (a, b))
+
+    def test_can_match_empty(self):
+        for pattern in [r'\d*', '^', '(?=a)', 'a|']:
+            self.assertTrue(can_match_empty(regex(pattern)), pattern)
+        for pattern in [r'\d+', 'a?b', '(a|bc)']:
+            self.assertFalse(can_match_empty(regex(pattern)), pattern)
+
+    def test_prefilter_does_not_change_results(self):
+        with open('example.log') as f:
+            lines = [line.strip('\n') for line in f]
+        confparser = ConfParser(DEFAULT_CONF.splitlines())
+        processor = LineStyleProcessor()
+
+        for name in ['example', 'java', 'ifconfig', 'calendar', 'ps']:
+            styles = confparser.get_styles(name)
+            unfiltered = confparser.get_styles(name)
+            for style in unfiltered:
+                style.required_literals = None
+            for line in lines:
+                expected = processor.get_style_map(line, unfiltered)
+                actual = processor.get_style_map(line, styles)
+                self.assertEqual([(r, unfiltered.index(s)) for r, s in expected.items()],
+                                 [(r, styles.index(s)) for r, s in actual.items()])
+
+
+class StyleProgramTests(unittest.TestCase):
+
+    def test_matches_per_rule_regions(self):
+        lines = self.get_lines('example.log') + self.get_lines('%s/test-log' % _TEST_DATA_DIR)
+        confparser = ConfParser(DEFAULT_CONF.splitlines())
+
+        for name in ['example', 'java', 'ifconfig', 'calendar', 'ps']:
+            styles = confparser.get_styles(name)
+            per_rule = Transformer(styles)
+            program = Transformer(styles, engine=ENGINE_PROGRAM)
+            self.assertIsNotNone(program.program)
+            for line in lines:
+                self.assertEqual(per_rule.style(line), program.style(line))
+
+    def test_long_matches(self):
+        # a 20 KB match another pattern may overlap would be searched again
+        # from every position inside it, so the line is matched rule by rule
+        line = 'a' * 20000 + ' ERROR ' + 'b' * 20000
+        program = self.assert_same_regions([r'\S+', 'ERROR'], line)
+        self.assertGreater(program.work, _WORK_PER_CHAR * len(line) + _MIN_WORK)
+        # short matches of overlapping patterns are searched in one pass
+        line = 'x com.' + 'a.b' * 30000
+        program = self.assert_same_regions([r'\w+', r'com\.[\w+|\.]+'], line)
+        self.assertLessEqual(program.work, 2 * len(line))
+        # patterns that can't overlap resume after each match
+        line = ('a' * 1000 + '1' * 1000) * 50
+        program = self.assert_same_regions([r'[a-z]+', r'\d+'], line)
+        self.assertEqual(len(line), program.work)
+
+    def test_overlapping_matches(self):
+        # lower precedence rule starts before a higher precedence one
+        self.assert_same_regions(['ab', 'xab'], 'xab xab ab')
+        # longer match of a lower precedence rule at the same position
+        self.assert_same_regions(['12', r'\d+'], '123 12 1234')
+        self.assert_same_regions([r'\d+\.\d+', r'\[[^\]]+\]', r'\d'], '[1.2] 3.4 [5]')
+
+    def test_unmergeable_patterns(self):
+        self.assertIsNone(compile_program([regex(r'(a)\1')]))
+        self.assertIsNone(compile_program([regex('(?P<x>a)(?P=x)')]))
+        self.assertIsNone(compile_program([regex(r'\b')]))
+        self.assertIsNone(compile_program([regex('a*')]))
+        self.assertIsNone(compile_program([regex('a'), re.compile('b', re.IGNORECASE)]))
+        self.assertIsNone(compile_program([regex('(?P<x>a)'), regex('(?P<x>b)')]))
+
+    def test_fallback_to_per_rule_engine(self):
+        styles = [RegexStyle(r'(a)\1', ['red']), RegexStyle('b', ['blue'])]
+        transformer = Transformer(styles, engine=ENGINE_PROGRAM)
+        self.assertIsNone(transformer.program)
+        self.assertEqual(Transformer(styles).style('aab'), transformer.style('aab'))
+
+    def assert_same_regions(self, patterns, line):
+        regex_objs = [regex(p) for p in patterns]
+        program = compile_program(regex_objs)
+        expected = [LineStyleProcessor().find_regions(line, r) for r in regex_objs]
+        self.assertEqual(expected, program.find_regions(line))
+        return program
+
+    def get_lines(self, fname):
+        with open(fname, 'r') as f:
+            return [line.strip('\n') for line in f]
+
+class TxtsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = sys.stdout
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def test_pass_through_is_unchanged(self):
+        data = b'first line\nsecond \xff line\r\n\nno newline'
+        txts = Txts([RegexStyle('line', ['red'])], block_size=4)
+        self.assertEqual(data, self.transform(txts, data))
+
+    def test_lines_split_across_blocks(self):
+        styles = [RegexStyle('line', ['red'])]
+        data = b'first line\nsecond line\n\nlast line'
+        transformer = Transformer(styles)
+        expected = ''.join(transformer.style(line) + '\n'
+                           for line in data.decode('utf-8').split('\n'))
+
+        for block_size in [1, 4, 11, 1024]:
+            txts = Txts(styles, color_always=True, block_size=block_size)
+            self.assertEqual(expected.encode('utf-8'), self.transform(txts, data))
+
+    def test_parallel_output_is_identical_to_serial(self):
+        styles = ConfParser(DEFAULT_CONF.splitlines()).get_styles('example')
+        with open('example.log', 'rb') as f:
+            data = f.read()
+
+        serial = self.transform(Txts(styles, color_always=True, block_size=100), data)
+        parallel = self.transform(Txts(styles, color_always=True, block_size=100, jobs=3), data)
+        self.assertEqual(serial, parallel)
+
+    def test_parallel_styler_window(self):
+        transformer = Transformer([RegexStyle('line', ['red'])])
+        blocks = [('line %i\n' % i).encode('utf-8') for i in range(20)]
+        styler = ParallelStyler(transformer, jobs=2, window=3)
+        self.assertEqual([transformer.style_block(b) for b in blocks],
+                         list(styler.style_blocks(iter(blocks))))
+
+    def test_parallel_line_budget(self):
+        transformer = Transformer([RegexStyle(r'(a+)+$', ['red'])], line_budget=0.05)
+        blocks = [b'a' * 40 + b'b\n', b'aaa\n', b'a' * 40 + b'b\n']
+        try:
+            list(ParallelStyler(transformer, jobs=2).style_blocks(iter(blocks)))
+            # counted in the workers, reported by the parent
+            self.assertEqual(2, transformer.line_style_processor.exceeded)
+        finally:
+            transformer.close()
+
+    def test_mapped_file_blocks(self):
+        data = b'first line\na much longer second line\n\nlast'
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(data)
+        try:
+            for block_size in [1, 4, 12, 1024]:
+                txts = Txts([], block_size=block_size)
+                with open(f.name, 'rb') as infile:
+                    with txts._map(infile) as mapped:
+                        blocks = [bytes(b) for b in txts._map_blocks(mapped)]
+                self.assertEqual(data, b''.join(blocks))
+                for block in blocks[:-1]:
+                    self.assertTrue(block.endswith(b'\n'))
+        finally:
+            os.remove(f.name)
+
+    def test_line_splitter(self):
+        splitter = LineSplitter()
+        self.assertIsNone(splitter.split(b'fir'))
+        self.assertEqual(b'first\n', splitter.split(b'st\nsec'))
+        self.assertIsNone(splitter.split(b'ond'))
+        self.assertEqual(b'second\nthird\n', splitter.split(b'\nthird\n'))
+        self.assertEqual(b'', splitter.flush())
+
+        splitter.split(b'a\npartial')
+        self.assertEqual(b'partial', splitter.flush())
+        self.assertEqual(b'', splitter.remainder)
+
+        data = b'first line\na much longer second line\n\nlast'
+        for block_size in [1, 4, 12, 1024]:
+            blocks = list(read_blocks(io.BytesIO(data).read, block_size))
+            self.assertEqual(data, b''.join(blocks))
+            for block in blocks[:-1]:
+                self.assertTrue(block.endswith(b'\n'))
+
+    def test_compressed_input(self):
+        styles = [RegexStyle('line', ['red'])]
+        data = b'first line\nsecond line\n\nlast line'
+        expected = self.transform(Txts(styles, color_always=True), data)
+
+        for compress in [gzip.compress, bz2.compress, lzma.compress]:
+            compressed = compress(data)
+            for block_size in [4, 1024]:
+                txts = Txts(styles, color_always=True, block_size=block_size)
+                self.assertEqual(expected, self.transform(txts, compressed))
+            # decompressed even if not styled
+            self.assertEqual(data, self.transform(Txts(styles), compressed))
+
+        # concatenated members, e.g. appended to by several writers
+        compressed = gzip.compress(b'a line\n') + gzip.compress(b'b line\n')
+        self.assertEqual(b'a line\nb line\n', self.transform(Txts(styles), compressed))
+
+        truncated = gzip.compress(data)[:-10]
+        self.assertRaises(DecompressionError, self.transform, Txts(styles), truncated)
+
+    def test_compression_is_detected_without_consuming_input(self):
+        for data, compression in [(gzip.compress(b'x'), 'gzip'), (bz2.compress(b'x'), 'bzip2'),
+                                  (lzma.compress(b'x'), 'xz'), (b'(\xb5/\xfd', 'zstd'),
+                                  (b'BZh9 is not bzip2', None), (b'', None)]:
+            infile = io.BufferedReader(io.BytesIO(data))
+            self.assertEqual(compression, get_compression(infile))
+            self.assertEqual(data, infile.read())
+
+    def test_read_ahead(self):
+        self.assertEqual(list(range(10)), list(read_ahead(iter(range(10)), count=2)))
+
+        def failing_blocks():
+            yield b'a'
+            raise IOError('read failed')
+        blocks = read_ahead(failing_blocks())
+        self.assertEqual(b'a', next(blocks))
+        self.assertRaises(IOError, next, blocks)
+
+        # a reader blocked on a full queue stops once the generator is closed
+        blocks = read_ahead(iter(range(100)), count=1)
+        next(blocks)
+        blocks.close()
+
+    def test_empty_file_is_not_mapped(self):
+        with tempfile.TemporaryFile() as f:
+            self.assertIsNone(Txts([])._map(f))
+
+    def transform(self, txts, data):
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        txts.use_color = txts.color_always
+        txts._transform_stream(io.BufferedReader(io.BytesIO(data)))
+        return sys.stdout.buffer.getvalue()
+
+class FollowerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'app.log')
+        self.offset_path = os.path.join(self.tmpdir, 'app.offset')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_appended_lines(self):
+        self.write('wb', b'first\nsecond\n')
+        blocks = self.follow()
+        self.assertEqual(b'first\nsecond\n', next(blocks))
+
+        self.write('ab', b'thi')
+        self.write('ab', b'rd\n')
+        self.assertEqual(b'third\n', next(blocks))
+        blocks.close()
+
+    def test_existing_lines_are_not_output(self):
+        lines = [b'line %i\n' % i for i in range(100000)]
+        self.write('wb', b''.join(lines))
+        blocks = self.follow()
+        # only the last lines, like tail -F
+        self.assertEqual(b''.join(lines[-DEFAULT_TAIL_LINES:]), next(blocks))
+        self.write('ab', b'appended\n')
+        self.assertEqual(b'appended\n', next(blocks))
+        blocks.close()
+
+        follower = Follower(self.path, 1024, tail=0)
+        follower.open()
+        try:
+            self.assertIsNone(follower.read())
+            self.write('ab', b'appended again\n')
+            self.assertEqual(b'appended again\n', follower.read())
+        finally:
+            follower.close()
+
+    def test_truncated_file(self):
+        self.write('wb', b'a long first line\n')
+        blocks = self.follow()
+        next(blocks)
+
+        self.write('wb', b'short\n')
+        self.assertEqual(b'short\n', next(blocks))
+        blocks.close()
+
+    def test_rotated_file(self):
+        self.write('wb', b'first\n')
+        blocks = self.follow()
+        next(blocks)
+
+        self.write('ab', b'last in old\npartial')
+        os.rename(self.path, self.path + '.1')
+        self.write('wb', b'first in new\n')
+        self.assertEqual(b'last in old\n', next(blocks))
+        self.assertEqual(b'partial', next(blocks))
+        self.assertEqual(b'first in new\n', next(blocks))
+        blocks.close()
+
+    def test_resume_from_saved_offset(self):
+        self.write('wb', b'first\n')
+        blocks = self.follow(self.offset_path)
+        next(blocks)
+        self.write('ab', b'second\n')
+        next(blocks)
+        blocks.close()
+
+        # a block counts as processed once the next one is requested
+        self.write('ab', b'third\n')
+        blocks = self.follow(self.offset_path)
+        self.assertEqual(b'second\nthird\n', next(blocks))
+        blocks.close()
+
+    def test_saved_offset_of_another_file_is_ignored(self):
+        self.write('wb', b'first\n')
+        blocks = self.follow(self.offset_path)
+        next(blocks)
+        blocks.close()
+
+        os.remove(self.path)
+        self.write('wb', b'new\n')
+        blocks = self.follow(self.offset_path)
+        self.assertEqual(b'new\n', next(blocks))
+        blocks.close()
+
+    def test_poll_watcher_backoff(self):
+        watcher = PollWatcher(min_interval=0.001, max_interval=0.004)
+        for i in range(4):
+            watcher.wait()
+        self.assertEqual(0.004, watcher.timeout)
+        watcher.reset()
+        self.assertEqual(0.001, watcher.timeout)
+
+    def follow(self, offset_path=None):
+        watcher = PollWatcher(min_interval=0.001, max_interval=0.001)
+        return Follower(self.path, 1024, offset_path, watcher).blocks()
+
+    def write(self, mode, data):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+class StatsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = sys.stdout
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def test_rule_counters(self):
+        stats = Stats()
+        index = IndexStyle([(0, 3)], ['red'])
+        word = RegexStyle('o', ['blue'])
+        whole_line = RegexStyle('bar', ['green'], apply_to_whole_line=True)
+        transformer = Transformer([index, word, whole_line], stats=stats)
+        for line in ['foo', 'foo bar', 'baz']:
+            transformer.style(line)
+
+        self.assertEqual(3, stats.lines)
+        # "foo" and "baz" are fully styled by the index and the whole-line
+        # rule is skipped once a line has been styled
+        self.assertEqual([3, 1, 0], [stats.rule(s).evaluations for s in [index, word, whole_line]])
+        # "foo bar" matches twice inside the indexed region
+        self.assertEqual((2, 0, 2), self.counts(stats, word))
+        self.assertEqual((3, 3, 0), self.counts(stats, index))
+        self.assertEqual((0, 0, 0), self.counts(stats, whole_line))
+
+    def test_whole_line_on_clean_line(self):
+        stats = Stats()
+        style = RegexStyle('bar', ['green'], apply_to_whole_line=True)
+        Transformer([style], stats=stats).style('foo bar')
+        self.assertEqual((1, 1, 0), self.counts(stats, style))
+
+    def test_throughput(self):
+        stats = Stats()
+        data = b'first line\nsecond line\n'
+        txts = Txts([RegexStyle('line', ['red'])], color_always=True, stats=stats, jobs=2)
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        txts.use_color = True
+        txts._transform_stream(io.BufferedReader(io.BytesIO(data)))
+        output = sys.stdout.buffer.getvalue()
+
+        self.assertEqual(2, stats.lines)
+        self.assertEqual(len(data), stats.bytes_in)
+        self.assertEqual(len(output), stats.bytes_out)
+        self.assertIn('line', stats.report())
+
+    def counts(self, stats, style):
+        rule = stats.rule(style)
+        return rule.matches, rule.accepted, rule.rejected
+
+class MultiplexerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.tmpdir)
+
+    def test_files_are_read_in_turn(self):
+        a = self.write('a.log', b'a1\na2\na3')
+        b = self.write('b.log', b'b1\n')
+        blocks = list(Multiplexer([a, b], block_size=3).blocks())
+        self.assertEqual([(a, b'a1\n'), (b, b'b1\n'), (a, b'a2\n'), (a, b'a3')], blocks)
+
+    def test_compressed_files(self):
+        a = self.write('a.log.gz', gzip.compress(b'a1\na2\n'))
+        b = self.write('b.log', b'b1\n')
+        self.assertEqual([(a, b'a1\na2\n'), (b, b'b1\n')], list(Multiplexer([a, b]).blocks()))
+
+    @unittest.skipUnless(os.path.exists('/dev/fd'), 'needs /dev/fd')
+    def test_pipes_and_files(self):
+        a = self.write('a.log', b'a1\n')
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b'p1\np')
+        os.write(write_fd, b'2\n')
+        os.close(write_fd)
+        pipe = '/dev/fd/%i' % read_fd
+        try:
+            blocks = list(Multiplexer([pipe, a]).blocks())
+        finally:
+            os.close(read_fd)
+        self.assertEqual(sorted([(a, b'a1\n'), (pipe, b'p1\np2\n')]), sorted(blocks))
+
+    def test_prefixed_lines(self):
+        a = self.write('a.log', b'one line\n')
+        b = self.write('b.log', b'another line\n')
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        Txts([RegexStyle('line', ['red'])], filepaths=[a, b], prefix=True).transform()
+        self.assertEqual(('%s: one line\n%s: another line\n' % (a, b)).encode('utf-8'),
+                         sys.stdout.buffer.getvalue())
+
+    def test_style_stream(self):
+        transformer = Transformer([RegexStyle('line', ['red'])])
+
+        async def style_lines(data):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return [line async for line in style_stream(transformer, reader, block_size=4)]
+
+        lines = asyncio.run(style_lines(b'first line\n\nlast line'))
+        self.assertEqual([transformer.style(l) for l in ['first line', '', 'last line']], lines)
+
+        # invalid UTF-8 is kept
+        lines = asyncio.run(style_lines(b'bad \xff line\n\xe2\x82'))
+        self.assertEqual(transformer.style_block(b'bad \xff line\n\xe2\x82\n'),
+                         b''.join(l.encode('utf-8', 'surrogateescape') + b'\n' for l in lines))
+
+    def write(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+class RotationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.tmpdir)
+
+    def test_paths_are_expanded(self):
+        a = self.write('app.log', b'')
+        b = self.write('app.log.1', b'')
+        os.mkdir(os.path.join(self.tmpdir, 'subdir'))
+        self.assertEqual(([a, b], True), rotation.expand_paths([self.tmpdir]))
+        self.assertEqual(([b], True), rotation.expand_paths([os.path.join(self.tmpdir, '*.1')]))
+        self.assertEqual(([a, 'x*'], True), rotation.expand_paths([a, 'x*']))
+        self.assertEqual(([a, b], False), rotation.expand_paths([a, b]))
+
+    def test_rotated_files_are_ordered_oldest_first(self):
+        paths = [self.write(name, b'') for name in
+                 ['app.log', 'app.log.1', 'app.log.2.gz', 'app.log.10.gz']]
+        self.assertTrue(rotation.is_rotation_set(paths))
+        self.assertEqual([paths[3], paths[2], paths[1], paths[0]], rotation.order_rotated(paths))
+
+        paths = [self.write(name, b'') for name in
+                 ['app.log', 'app.log-20240102.gz', 'app.log-20240101.gz']]
+        self.assertEqual([paths[2], paths[1], paths[0]], rotation.order_rotated(paths))
+
+        # unrelated files are ordered by modification time
+        other = self.write('other.log', b'')
+        os.utime(other, (0, 0))
+        self.assertFalse(rotation.is_rotation_set(paths + [other]))
+        self.assertEqual(other, rotation.order_rotated(paths + [other])[0])
+
+    def test_parallel_output_is_identical_to_serial(self):
+        styles = ConfParser(DEFAULT_CONF.splitlines()).get_styles('example')
+        with open('example.log', 'rb') as f:
+            lines = f.read().splitlines(True)
+        paths = [self.write('app.log.2.gz', gzip.compress(b''.join(lines[:10]))),
+                 self.write('app.log.1', b''.join(lines[10:20])),
+                 self.write('app.log', b''.join(lines[20:]) + b'no newline')]
+
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        txts = Txts(styles, color_always=True, filepaths=paths, prefix=True, rotated=True)
+        txts.transform()
+        serial = sys.stdout.buffer.getvalue()
+        self.assertEqual(len(lines) + 1, serial.count(b'\n'))
+
+        # parts of the uncompressed files styled by different workers
+        styler = RotatedSetStyler(Transformer(styles), jobs=2, part_size=100, block_size=64, window=3)
+        prefixes = dict((path, txts._prefix(path, 0)) for path in paths)
+        self.assertEqual(serial, b''.join(styler.style_files(paths, prefixes)))
+
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        Txts(styles, color_always=True, filepaths=paths, prefix=True, rotated=True, jobs=2).transform()
+        self.assertEqual(serial, sys.stdout.buffer.getvalue())
+
+    def test_rotated_set_line_budget(self):
+        paths = [self.write('app.log.1', b'a' * 40 + b'b\n'), self.write('app.log', b'aaa\n')]
+        transformer = Transformer([RegexStyle(r'(a+)+$', ['red'])], line_budget=0.05)
+        try:
+            list(RotatedSetStyler(transformer, jobs=2).style_files(paths))
+            self.assertEqual(1, transformer.line_style_processor.exceeded)
+        finally:
+            transformer.close()
+
+    def test_compressed_files_are_styled_in_parts(self):
+        data = b''.join(b'line %i\n' % i for i in range(1000))
+        path = self.write('app.log.1.gz', gzip.compress(data))
+        styler = RotatedSetStyler(Transformer([]), jobs=2, part_size=1000)
+        parts = [part[3] for part in styler.get_parts([path])]
+        self.assertEqual(data, b''.join(parts))
+        # the spool of a part is bounded by the part size, not the file
+        self.assertGreater(len(parts), 5)
+        for part in parts:
+            # a partial last line is carried over to the next part
+            self.assertLessEqual(len(part), 1000 + len(b'line 999\n'))
+            self.assertTrue(part.endswith(b'\n'))
+
+    def test_parts_split_lines_once(self):
+        data = b''.join(b'x' * (i % 7) + b'\n' for i in range(100)) + b'last'
+        path = self.write('app.log', data)
+        for part_size in [1, 3, 10, 1000]:
+            blocks = [b for start in range(0, len(data), part_size)
+                      for b in rotation._range_blocks(path, start, start + part_size, 4)]
+            self.assertEqual(data, b''.join(blocks))
+
+    def write(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+class PagerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.data = b''.join(b'line %i\n' % i for i in range(1, 101))
+        self.transformer = Transformer([RegexStyle(regex('line'), ['red'])])
+
+    def test_lines_are_found_from_offsets(self):
+        index = LineIndex(b'a\nbb\n\nccc\n')
+        self.assertEqual(2, index.next(0))
+        self.assertEqual(5, index.next(2))
+        self.assertEqual(None, index.next(6))
+        self.assertEqual(5, index.previous(6))
+        self.assertEqual(None, index.previous(0))
+        self.assertEqual(6, index.last())
+        self.assertEqual(6, LineIndex(b'a\nbb\n\nccc').last())
+        self.assertEqual(b'ccc', index.line(6))
+        self.assertEqual(b'', index.line(5))
+
+        # lines are numbered as far as they are looked up
+        self.assertEqual(None, index.line_number(6))
+        self.assertEqual(6, index.offset_of(4))
+        self.assertEqual(4, index.line_number(6))
+        self.assertEqual(6, index.offset_of(100))
+
+    def test_keys_move_the_page(self):
+        pager = Pager(self.data, self.transformer, 10, 80)
+        self.assertEqual(b'line 10', pager.index.line(pager.page()[-1]))
+        self.assertTrue(self.handle_keys(pager, b'5', b'j'))
+        self.assertEqual(' line 6', pager.status())
+        self.handle_keys(pager, b' ')
+        self.assertEqual(' line 16', pager.status())
+        self.handle_keys(pager, b'b', b'k', b'\x1b[A')
+        self.assertEqual(' line 4', pager.status())
+        self.handle_keys(pager, b'b')
+        self.assertEqual(0, pager.top)
+        self.handle_keys(pager, b'5', b'0', b'g')
+        self.assertEqual(' line 50', pager.status())
+        self.handle_keys(pager, b'9', b'9', b'g')
+        self.assertEqual(' line 91 (END)', pager.status())
+        self.assertFalse(self.handle_keys(pager, b'q'))
+
+    def test_end_is_shown_without_styling_the_file(self):
+        data = b''.join(b'line %i\n' % i for i in range(1, 200001))
+        pager = Pager(data, self.transformer, 10, 80)
+        self.handle_keys(pager, b'G')
+        screen = pager.render()
+        self.assertIn('\x1b[31mline\x1b[m 200000', screen)
+        self.assertNotIn('line 199990', screen)
+        self.assertEqual(10, len(pager.cache))
+        self.assertEqual(0, pager.index.indexed)
+        self.assertEqual(' 99% (END)', pager.status())
+
+        # the lines around the page are styled while idle
+        self.assertEqual(20, len(list(pager.read_ahead())))
+        self.assertEqual(30, len(pager.cache))
+        self.assertEqual([], list(pager.read_ahead()))
+
+    def test_styled_lines_are_cached(self):
+        pager = Pager(self.data, self.transformer, 10, 80, cache_size=15)
+        pager.render()
+        self.handle_keys(pager, b' ')
+        pager.render()
+        self.assertEqual(15, len(pager.cache))
+        self.assertNotIn(0, pager.cache)
+        self.handle_keys(pager, b'g')
+        self.assertEqual('\x1b[31mline\x1b[m 1', pager.styled_line(0))
+
+    def test_lines_are_clipped_to_the_screen(self):
+        styled_line = '\x1b[31mab\tc\x1b[m d\r'
+        self.assertEqual('\x1b[31mab      c\x1b[m d', clip(styled_line, 0, 80))
+        self.assertEqual('\x1b[31mb   \x1b[m', clip(styled_line, 1, 4))
+        self.assertEqual('\x1b[31m\x1b[md', clip(styled_line, 10, 4))
+        self.assertEqual('\x1b[31mab\x1b[m', clip('\x1b[31mabc', 0, 2))
+        self.assertEqual('plain', clip('plain text', 0, 5))
+
+    def handle_keys(self, pager, *keys):
+        return all([pager.handle_key(key) for key in keys])
+
+class LineOffsetIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.path = os.path.join(self.tmpdir, 'app.log')
+        self.lines = [b'x' * (i * 7 % 45) + b'\n' for i in range(200)]
+        self.write(b''.join(self.lines))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lines_are_found_by_number(self):
+        index = self.index()
+        self.assertEqual(len(self.data) // 16, index.update())
+        offsets = [0]
+        for line in self.lines:
+            offsets.append(offsets[-1] + len(line))
+        self.assertEqual(offsets, [index.offset_of(n) for n in range(len(self.lines) + 1)])
+        self.assertEqual(len(self.data), index.offset_of(1000))
+
+    def test_index_is_extended_as_the_file_grows(self):
+        self.assertEqual(len(self.data) // 16, self.index().update())
+        self.assertEqual(0, self.index().update())
+
+        indexed = len(self.data) // 16
+        self.write(self.data + b'appended line\n' * 10)
+        index = self.index()
+        self.assertEqual(len(self.data) // 16 - indexed, index.update())
+        self.assertEqual(len(self.data) - 14, index.offset_of(len(self.lines) + 9))
+
+        # a rewritten file is indexed again
+        self.write(b'\n' * len(self.data))
+        index = self.index()
+        self.assertEqual(len(self.data) // 16, index.update())
+        self.assertEqual(5, index.offset_of(5))
+
+    def test_line_ranges_are_styled(self):
+        start, end = line_range(self.path, self.data, 3, 5, cache_dir=self.cache_dir)
+        self.assertEqual(b''.join(self.lines[2:5]), self.data[start:end])
+        start, end = line_range(self.path, self.data, 199, None, cache_dir=self.cache_dir)
+        self.assertEqual(b''.join(self.lines[198:]), self.data[start:end])
+        self.assertEqual((len(self.data),) * 2,
+                         line_range(self.path, self.data, 300, 400, cache_dir=self.cache_dir))
+
+        self.assertEqual(b''.join(self.lines[-3:]), self.data[tail_offset(self.data, 3):])
+        self.assertEqual(0, tail_offset(b'a\nb', 5))
+        self.assertEqual(2, tail_offset(b'a\nb', 1))
+        self.assertEqual(3, tail_offset(b'a\nb', 0))
+
+        stdout = sys.stdout
+        try:
+            sys.stdout = io.TextIOWrapper(io.BytesIO())
+            Txts([RegexStyle(regex('x+'), ['red'])], self.path, True, tail=2).transform()
+            expected = b''.join(b'\x1b[31m%s\x1b[m\n' % line.strip() for line in self.lines[-2:])
+            self.assertEqual(expected, sys.stdout.buffer.getvalue())
+        finally:
+            sys.stdout = stdout
+
+    def test_line_ranges_of_pipes(self):
+        data = b''.join(self.lines)
+        for args, expected in [(['--tail', '2'], self.lines[-2:]),
+                               (['--lines', '3:5'], self.lines[2:5]),
+                               (['--lines', '199:'], self.lines[198:]),
+                               (['--tail', '0'], [])]:
+            output = subprocess.run(
+                [sys.executable, '-m', 'txtstyle.txts'] + args + ['/dev/stdin'],
+                input=data, stdout=subprocess.PIPE, check=True).stdout
+            self.assertEqual(b''.join(expected), output, args)
+
+    def index(self):
+        with open(self.path, 'rb') as f:
+            self.data = f.read()
+        return LineOffsetIndex(self.path, self.data, interval=16, cache_dir=self.cache_dir)
+
+    def write(self, data):
+        # rewrites the file in place, keeping its inode
+        with open(self.path, 'r+b' if os.path.exists(self.path) else 'wb') as f:
+            f.write(data)
+            f.truncate()
+        self.data = data
+
+class LogHandlerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.styles = [RegexStyle(regex('ERROR'), ['red']), RegexStyle(regex(r'\d+'), ['bold'])]
+
+    def test_formatter_styles_records(self):
+        formatter = TxtStyleFormatter('%(levelname)s %(message)s', styles=self.styles, color_always=True)
+        self.assertEqual('\x1b[31mERROR\x1b[m \x1b[1m42\x1b[m',
+                         formatter.format(self.record(logging.ERROR, '%d', 42)))
+
+        # tracebacks and other multi-line messages are styled per line
+        self.assertEqual('\x1b[31mERROR\x1b[m \n\x1b[1m7\x1b[m',
+                         formatter.format(self.record(logging.ERROR, '\n7')))
+
+    def test_formatter_does_not_style_for_non_terminals(self):
+        formatter = TxtStyleFormatter('%(levelname)s', styles=self.styles, stream=io.StringIO())
+        self.assertFalse(formatter.use_color)
+        self.assertEqual('ERROR', formatter.format(self.record(logging.ERROR, '')))
+        self.assertRaises(Exception, TxtStyleFormatter)
+
+    def test_handler_buffers_records(self):
+        stream = io.StringIO()
+        handler = TxtStyleHandler(stream, styles=self.styles, fmt='%(message)s',
+                                  capacity=3, flush_interval=0)
+        handler.handle(self.record(logging.INFO, 'a'))
+        handler.handle(self.record(logging.INFO, 'b'))
+        self.assertEqual('', stream.getvalue())
+
+        handler.handle(self.record(logging.INFO, 'c'))
+        self.assertEqual('a\nb\nc\n', stream.getvalue())
+
+        # warnings are written right away
+        handler.handle(self.record(logging.INFO, 'd'))
+        handler.handle(self.record(logging.WARNING, 'e'))
+        self.assertEqual('a\nb\nc\nd\ne\n', stream.getvalue())
+
+        handler.handle(self.record(logging.INFO, 'f'))
+        handler.close()
+        self.assertEqual('a\nb\nc\nd\ne\nf\n', stream.getvalue())
+
+    def test_handler_flushes_after_interval(self):
+        stream = io.StringIO()
+        handler = TxtStyleHandler(stream, styles=self.styles, fmt='%(message)s',
+                                  color_always=True, flush_interval=0.01)
+        handler.handle(self.record(logging.INFO, '1'))
+        handler._timer.join(5)
+        self.assertEqual('\x1b[1m1\x1b[m\n', stream.getvalue())
+        self.assertIsNone(handler._timer)
+        handler.close()
+
+    def record(self, level, msg, *args):
+        return logging.LogRecord('test', level, __file__, 1, msg, args, None)
+
+class StartupTests(unittest.TestCase):
+
+    @unittest.skipUnless(platform.python_implementation() == 'CPython', 'budget is for CPython')
+    def test_import_time_budget(self):
+        code = 'import time; t = time.perf_counter(); import txtstyle.txts; print(time.perf_counter() - t)'
+        times = [float(self.run_python(code)) for i in range(5)]
+        self.assertLess(min(times), _IMPORT_TIME_BUDGET)
+
+    def test_common_args_do_not_import_optional_modules(self):
+        code = ('import sys; from txtstyle import txts;'
+                'txts.parse_common_args(["-n", "java", "--color-always", "some.log"]);'
+                'print(" ".join(m for m in ["argparse", "multiprocessing", "txtstyle.parallel",'
+                '"txtstyle.styleprogram", "tempfile"] if m in sys.modules))')
+        self.assertEqual('', self.run_python(code).strip())
+
+    def test_parse_common_args(self):
+        args = parse_common_args(['-c', 'my.conf', '--name', 'java', '-j', '4', '--no-cache', 'app.log'])
+        self.assertEqual(['java'], args.name)
+        self.assertEqual(['my.conf'], args.conf)
+        self.assertEqual(4, args.jobs)
+        self.assertTrue(args.no_cache)
+        self.assertFalse(args.color_always)
+        self.assertEqual(['app.log'], args.filepath)
+        self.assertEqual(['a.log', 'b.log'], parse_common_args(['a.log', 'b.log']).filepath)
+
+        # left to argparse
+        self.assertIsNone(parse_common_args(['-h']))
+        self.assertIsNone(parse_common_args(['-r', 'foo']))
+        self.assertIsNone(parse_common_args(['-n', 'java', '-n', 'ps']))
+        self.assertIsNone(parse_common_args(['-n']))
+        self.assertIsNone(parse_common_args(['-j', 'many']))
+
+    def test_line_ranges_are_parsed(self):
+        args = parse_common_args(['--lines', '10:20', '--tail', '5', 'app.log'])
+        self.assertEqual(['10:20'], args.lines)
+        self.assertEqual(5, args.tail)
+        self.assertEqual((10, 20), parse_line_range('10:20'))
+        self.assertEqual((10, None), parse_line_range('10:'))
+        self.assertEqual((1, 20), parse_line_range(':20'))
+        self.assertEqual((7, 7), parse_line_range('7:7'))
+        for value in ['', '10', ':', '0:5', '20:10', 'a:b', '-1:5', '1:2:3']:
+            self.assertIsNone(parse_line_range(value), value)
+
+    def test_numeric_styles_are_resolved_on_use(self):
+        self.assertEqual('\x1b[38;5;172m', _STYLES['172'])
+        self.assertEqual('\x1b[48;5;1m', _STYLES['on-1'])
+        for key in ['0', '256', '01', 'on-', 'on-0', 'on-on-1']:
+            self.assertNotIn(key, _STYLES)
+        self.assertEqual(19 + 2 * 255, len(list(_STYLES)))
+        self.assertNotIn('1', NAMED_STYLE_MAP)
+
+    def run_python(self, code):
+        return subprocess.check_output([sys.executable, '-c', code]).decode('utf-8')
+
+class BenchmarkTests(unittest.TestCase):
+
+    def test_corpora_are_deterministic(self):
+        for case in bench.get_cases():
+            self.assertEqual(case.lines(50), case.lines(50))
+
+    def test_case_ids_are_unique_across_backends(self):
+        ids = [case.id for case in bench.get_cases(regexbackend.BACKENDS)]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertIn('style/java@re2', ids)
+
+    def test_corpora_are_styled(self):
+        for case in bench.get_cases():
+            if case.target != 'style' or case.density == 0.0:
+                continue
+            conf, style_name = case.conf()
+            transformer = Transformer(ConfParser(conf.splitlines()).get_styles(style_name))
+            lines = case.lines(50)
+            self.assertNotEqual(lines, [transformer.style(line) for line in lines], case.id)
+
+    def test_output_size_is_measured(self):
+        case = [c for c in bench.get_cases() if c.id == 'style/java'][0]
+        result = bench.run_case(case, 50, 1)
+        self.assertEqual(50, result['lines'])
+        self.assertGreater(result['output_bytes_per_line'], result['bytes'] / 50.0)
+
+    def test_startup_is_measured(self):
+        results = bench.run_startup(['ps'], 1)
+        self.assertEqual(['ps'], [r['style'] for r in results])
+        self.assertGreater(results[0]['cache_seconds'], 0)
+        self.assertGreater(results[0]['no_cache_seconds'], 0)
+
+    def test_compare_flags_regressions(self):
+        baseline = [{'case': 'a', 'lines_per_s': 100.0}, {'case': 'b', 'lines_per_s': 100.0}]
+        results = [{'case': 'a', 'lines_per_s': 95.0}, {'case': 'b', 'lines_per_s': 80.0},
+                   {'case': 'c', 'lines_per_s': 10.0}]
+        self.assertEqual(['b'], bench.compare(results, baseline, 0.1))
+        self.assertAlmostEqual(-0.05, results[0]['change'])
+        self.assertIsNone(results[2]['change'])
+
 
 if __name__ == "__main__":
     unittest.main()
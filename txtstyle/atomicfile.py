@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+
+def write_atomically(path, data):
+    """\
+    Writes bytes to a file through a temporary file in the same directory,
+    so readers see either the old content or the new, never a partial
+    write.
+    """
+    import tempfile
+
+    dirpath = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dirpath, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# Splitting of input into blocks of complete lines, shared by the readers of
+# files, streams and followed files. Lines are never split across blocks,
+# so blocks can be styled independently.
+
+
+class LineSplitter(object):
+    """\
+    Splits data read in chunks of any size into blocks of complete lines.
+    A partial last line is kept until the rest of it is read, or flushed.
+    """
+
+    def __init__(self):
+        self.remainder = b''
+
+    def split(self, data):
+        """\
+        Returns the complete lines of the data and the remainder before it,
+        or None if the data doesn't complete a line.
+        """
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            self.remainder += data
+            return None
+
+        block = self.remainder + data[:end]
+        self.remainder = data[end:]
+        return block
+
+    def flush(self):
+        """\
+        Returns the partial last line, which may be empty, and forgets it.
+        """
+        block, self.remainder = self.remainder, b''
+        return block
+
+
+def read_blocks(read, block_size):
+    """\
+    Yields blocks of complete lines returned by read(block_size) until it
+    returns no data. A partial last line is yielded last.
+    """
+    splitter = LineSplitter()
+    while True:
+        data = read(block_size)
+        if not data:
+            break
+
+        block = splitter.split(data)
+        if block is not None:
+            yield block
+
+    if splitter.remainder:
+        yield splitter.flush()
+
+
+def block_offsets(mapped, block_size, start=0, end=None):
+    """\
+    Yields (start, end) offsets of blocks of complete lines of a memory
+    mapped file, of about block_size bytes. start and end, if given, are
+    offsets of line starts bounding the lines.
+    """
+    size = len(mapped) if end is None else end
+    pos = start
+
+    while pos < size:
+        end = mapped.rfind(b'\n', pos, min(pos + block_size, size)) + 1
+        if end == 0:
+            # line longer than a block
+            end = mapped.find(b'\n', pos + block_size, size) + 1 or size
+        yield pos, end
+        pos = end
+
+
+def _split_lines(block):
+    lines = bytes(block).split(b'\n')
+    last = lines.pop() # empty after a trailing newline
+    lines = [line + b'\n' for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+def tail_lines(blocks, count):
+    """\
+    Returns the last count lines of blocks of complete lines, read up to
+    their end, as a single block.
+    """
+    import collections
+
+    lines = collections.deque(maxlen=max(count, 0))
+    for block in blocks:
+        lines.extend(_split_lines(block))
+    return b''.join(lines)
+
+
+def range_lines(blocks, start, end):
+    """\
+    Yields the lines start to end, numbered from 1 and inclusive, of blocks
+    of complete lines. end may be None for the last line.
+    """
+    number = 0 # lines before the block
+    for block in blocks:
+        lines = _split_lines(block)
+        first = max(start - 1 - number, 0)
+        last = len(lines) if end is None else min(end - number, len(lines))
+        if first < last:
+            yield b''.join(lines[first:last])
+        number += len(lines)
+        if end is not None and number >= end:
+            break
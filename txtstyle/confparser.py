@@ -2,27 +2,153 @@
 
 import os
 import re
+from .regexbackend import BACKENDS
+from .regexbackend import BACKEND_RE
 from .transformer import IndexStyle
 from .transformer import RegexStyle
 
-_STYLE_HEADER = re.compile('^\[\s*Style\s*=\s*\"?(\w+)\"?\s*\]$')
+_STYLE_HEADER = re.compile('^\[\s*Style\s*=\s*\"?(\w+)\"?(?:\s+backend\s*=\s*\"?(\w+)\"?)?\s*\]$')
 _REGEX_STYLE_DEF = re.compile('^(!?)([\w|\s|-]+):\s*regex\([\'|"](.+)[\'|"]\)$')
 _INDEX_STYLE_DEF = re.compile('^([\w|\s|-]+):\s*index\(\s*(.+)\s*\)$')
+_INCLUDE = re.compile(r'^include\s+"?([^"]+?)"?$')
+
+
+class ConfIndex(object):
+    """\
+    The style headers and include directives of a conf, found in a single
+    pass without parsing any style definitions. Each style is recorded with
+    the position of its definitions: a byte offset if the conf is read from
+    a file, or a line number if it is given as lines.
+
+    Definitions can't follow an include directive before the next header,
+    and leading_defs records definitions before the first header, which
+    an included file can't have: they would belong to the style the file
+    is included in, whose definitions are read from a single file.
+    """
+
+    def __init__(self, conf_lines=None, conf_path=None):
+        self.conf_lines = conf_lines
+        self.conf_path = conf_path
+        # name -> (order, backend, start, end) of the first definition, where
+        # end is None for the last one
+        self.styles = {}
+        # (order, path) of include directives
+        self.includes = []
+        self.leading_defs = False
+
+        if conf_lines is not None:
+            self._index((i, i + 1, line) for i, line in enumerate(conf_lines))
+        else:
+            with open(conf_path, 'rb') as f:
+                self._index(self._numbered_lines(f))
+
+    def _numbered_lines(self, f):
+        offset = 0
+        for line in f:
+            # only headers and includes need decoding
+            first = line.lstrip()[:1]
+            if first in (b'[', b'i'):
+                yield offset, offset + len(line), line.decode('utf-8')
+            elif first and first != b'#':
+                yield offset, offset + len(line), None # a definition
+            offset += len(line)
+
+    def _index(self, numbered_lines):
+        order = 0
+        # the style whose definitions are being skipped
+        section = None
+        # the last include directive
+        include = None
+        for start, end, line in numbered_lines:
+            line = line and line.strip()
+            match = None
+            if line and line.startswith('['):
+                match = re.match(_STYLE_HEADER, line)
+            elif line and line.startswith('include'):
+                match = re.match(_INCLUDE, line)
+            if not match:
+                if section or (line is not None and (not line or line.startswith('#'))):
+                    continue
+                if include:
+                    raise ConfParserException(
+                        'Style definitions after include "%s" must follow a style header' % include)
+                self.leading_defs = True
+                continue
+
+            if section:
+                self._add_style(section, start)
+            order += 1
+            section = None
+            if match.re is _INCLUDE:
+                include = match.group(1)
+                self.includes.append((order, self._include_path(include)))
+            else:
+                section = (order, match.group(1), match.group(2), end)
+
+        if section:
+            self._add_style(section, None)
+
+    def _add_style(self, section, end):
+        order, name, backend, start = section
+        if name not in self.styles:
+            self.styles[name] = (order, backend, start, end)
+
+    def _include_path(self, path):
+        path = os.path.expanduser(path)
+        conf_dir = os.path.dirname(self.conf_path) if self.conf_path else ''
+        return os.path.join(conf_dir, path)
+
+    def read_defs(self, start, end):
+        """\
+        Returns the definitions between two positions, without blank lines
+        and comments.
+        """
+        if self.conf_lines is not None:
+            lines = self.conf_lines[start:end]
+        else:
+            with open(self.conf_path, 'rb') as f:
+                f.seek(start)
+                data = f.read() if end is None else f.read(end - start)
+                lines = data.decode('utf-8').splitlines()
+        lines = [line.strip() for line in lines]
+        return [line for line in lines if line and not line.startswith('#')]
 
 
 class ConfParser(object):
 
-    def __init__(self, conf_lines):
+    def __init__(self, conf_lines=None, backend=None, conf_path=None):
+        """\
+        Styles are read from conf_lines or, if not given, from the file at
+        conf_path. The conf is indexed once and only the requested styles
+        are read and parsed. Files named in include directives are resolved
+        relative to conf_path and indexed when a style is looked up in them.
+
+        backend, if given, is the regex backend used for all styles instead
+        of the one named in their headers, e.g. [Style="java" backend="re2"].
+        """
         self.conf_lines = conf_lines
+        self.conf_path = conf_path
+        self.backend = backend
+        # patterns that are likely to be slow on some lines
+        self.warnings = []
+        # included files read to find the last requested style
+        self.included_paths = []
+        self._index = None
+        self._included = {}
 
     def get_styles(self, style_name):
-        style_defs = self._get_style_defs(style_name)
-        return [self._parse_style(s) for s in style_defs]
+        backend, style_defs = self._get_style_defs(style_name)
+        backend = self.backend or backend or BACKEND_RE
+        if backend not in BACKENDS:
+            raise ConfParserException('Invalid regex backend "%s" in style "%s"' % (backend, style_name))
+        styles = [self._parse_style(s, backend) for s in style_defs]
+        self.warnings = get_pattern_warnings(styles, 'Style "%s": ' % style_name)
+        return styles
 
-    def _parse_style(self, style_def):
+    def _parse_style(self, style_def, backend=BACKEND_RE):
         match = re.match(_REGEX_STYLE_DEF, style_def)
         if match:
-            return self._parse_regex_style(match)
+            return self._parse_regex_style(match, backend)
 
         match = re.match(_INDEX_STYLE_DEF, style_def)
         if match:
@@ -30,11 +156,11 @@ class ConfParser(object):
 
         raise ConfParserException("Invalid style definition: %s" % style_def)
 
-    def _parse_regex_style(self, match):
+    def _parse_regex_style(self, match, backend):
         apply_to_whole_line = match.group(1).strip() == '!'
         transforms = match.group(2).strip().split()
         pattern = match.group(3).strip()
-        return RegexStyle(pattern, transforms, apply_to_whole_line)
+        return RegexStyle(pattern, transforms, apply_to_whole_line, backend)
 
     def _parse_index_style(self, style_def, match):
         transforms = match.group(1).strip().split()
@@ -60,29 +186,76 @@ class ConfParser(object):
         return IndexStyle(regions, transforms)
 
     def _get_style_defs(self, style_name):
-        style_defs = []
-        is_style_header = False
+        """\
+        Returns the backend named in the style's header, if any, and the
+        style's definitions.
+        """
+        if self._index is None:
+            self._index = ConfIndex(self.conf_lines, self.conf_path)
+        self.included_paths = []
+        stack = [os.path.realpath(self.conf_path)] if self.conf_path else []
 
-        for line in self.conf_lines:
-            line = line.strip()
-            if line == '' or line.startswith('#'):
-                continue
-            
-            if self._is_style_header(line, style_name):
-                is_style_header = True
-            elif is_style_header and self._is_style_header(line):
-                break # next style def
-            elif is_style_header:
-                style_defs.append(line)
-        
-        if not is_style_header:
+        found = self._find_style(self._index, style_name, stack)
+        if not found:
             raise ConfParserException('Style "%s" is not defined' % style_name)
 
-        return style_defs
+        index, (order, backend, start, end) = found
+        return backend, index.read_defs(start, end)
+
+    def _find_style(self, index, style_name, stack):
+        """\
+        Returns the index defining the style first, as if included files
+        were pasted in place of their include directives, and the style's
+        entry in it.
+        """
+        entry = index.styles.get(style_name)
+        for order, path in index.includes:
+            if entry and order > entry[0]:
+                if order == entry[0] + 1:
+                    # the include ends the style's definitions
+                    self._include(path, stack)
+                break
+
+            included = self._include(path, stack)
+            found = self._find_style(included, style_name, stack + [os.path.realpath(path)])
+            if found:
+                return found
+
+        if entry:
+            return index, entry
+        return None
+
+    def _include(self, path, stack):
+        """\
+        Returns the index of an included file.
+        """
+        realpath = os.path.realpath(path)
+        if realpath in stack:
+            raise ConfParserException('Conf file includes itself: %s' % path)
+        if realpath not in self._included:
+            if not os.path.isfile(path):
+                raise ConfParserException('Included conf file not found: %s' % path)
+            self._included[realpath] = ConfIndex(conf_path=path)
+        if self._included[realpath].leading_defs:
+            raise ConfParserException('Included conf file must start with a style header: %s' % path)
+        self.included_paths.append(path)
+        return self._included[realpath]
+
+
+def get_pattern_warnings(styles, prefix=''):
+    """\
+    Returns a warning for each RegexStyle whose pattern may take
+    exponential time to match.
+    """
+    from .patternanalysis import backtracking_risk
 
-    def _is_style_header(self, line, style_name=None):
-        match = re.match(_STYLE_HEADER, line)
-        return match and (style_name is None or style_name == match.group(1))
+    warnings = []
+    for style in styles:
+        risk = backtracking_risk(getattr(style, 'regex_obj', None))
+        if risk:
+            warnings.append('%spattern "%s" may be very slow on some lines (%s)' %
+                            (prefix, style.regex_obj.pattern, risk))
+    return warnings
 
 
 class ConfParserException(Exception):
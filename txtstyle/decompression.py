@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# Compressed inputs, such as rotated logs, are detected by their magic
+# numbers and decompressed as they are read. gzip, bzip2 and xz are read
+# with the standard library; zstd with Python 3.14's compression.zstd or
+# the third-party zstandard module, if installed.
+
+import errno
+import queue
+import re
+import threading
+
+GZIP = 'gzip'
+BZIP2 = 'bzip2'
+XZ = 'xz'
+ZSTD = 'zstd'
+
+# Leading bytes of each format. Plain text could start with "BZh" so the
+# bzip2 block or end-of-stream magic is checked too.
+_MAGIC_NUMBERS = [
+    (re.compile(re.escape(b'\x1f\x8b\x08')), GZIP),
+    (re.compile(b'BZh[1-9](1AY&SY|\x17rE8P\x90)'), BZIP2),
+    (re.compile(re.escape(b'\xfd7zXZ\x00')), XZ),
+    (re.compile(re.escape(b'\x28\xb5\x2f\xfd')), ZSTD),
+]
+_MAGIC_LENGTH = 10
+
+# Number of blocks decompressed ahead of styling. Bounds the memory held
+# by the read-ahead queue to about this many blocks.
+DEFAULT_READ_AHEAD = 4
+
+# How often a reader thread blocked on a full queue checks if it was
+# stopped, in seconds
+_STOP_POLL_INTERVAL = 0.1
+
+
+def get_compression(infile):
+    """\
+    Returns the compression of a buffered binary file, such as GZIP, or
+    None if it isn't compressed. The leading bytes are peeked at, not
+    consumed.
+    """
+    head = infile.peek(_MAGIC_LENGTH)[:_MAGIC_LENGTH]
+    for magic, compression in _MAGIC_NUMBERS:
+        if magic.match(head):
+            return compression
+    return None
+
+
+class DecompressionError(IOError):
+    """\
+    Raised if a compressed input is corrupt or truncated, or its format
+    isn't supported by the installed modules.
+    """
+
+    def __init__(self, filename, reason):
+        super(DecompressionError, self).__init__(
+            errno.EIO, 'Cannot decompress %s: %s' % (filename, reason), filename)
+        self.reason = reason
+
+    def __reduce__(self):
+        # raised in worker processes too
+        return (DecompressionError, (self.filename, str(self.reason)))
+
+    def __str__(self):
+        return self.strerror
+
+
+def _open(infile, compression, name):
+    """\
+    Returns a file object decompressing infile and the errors it raises
+    for corrupt input.
+    """
+    if compression == GZIP:
+        import gzip
+        import zlib
+        return gzip.GzipFile(fileobj=infile, mode='rb'), (EOFError, OSError, zlib.error)
+    if compression == BZIP2:
+        import bz2
+        return bz2.BZ2File(infile), (EOFError, OSError)
+    if compression == XZ:
+        import lzma
+        return lzma.LZMAFile(infile), (EOFError, OSError, lzma.LZMAError)
+
+    try:
+        from compression import zstd # Python 3.14
+        return zstd.ZstdFile(infile), (EOFError, OSError, zstd.ZstdError)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise DecompressionError(name, 'zstd requires the zstandard module')
+    reader = zstandard.ZstdDecompressor().stream_reader(infile, read_across_frames=True)
+    return reader, (EOFError, OSError, zstandard.ZstdError)
+
+
+class DecompressedFile(object):
+    """\
+    Reads a compressed binary file as it is decompressed, keeping only the
+    decompressor's buffers in memory. Corrupt input is reported with a
+    DecompressionError naming the file.
+    """
+
+    def __init__(self, infile, compression, name=None):
+        self.name = name or getattr(infile, 'name', '<stdin>')
+        self.compression = compression
+        self._infile = infile
+        self._file, self._errors = _open(infile, compression, self.name)
+
+    def read(self, size=-1):
+        try:
+            data = self._file.read(size)
+            # some readers return less than size before the end
+            while 0 < len(data) < size:
+                more = self._file.read(size - len(data))
+                if not more:
+                    break
+                data += more
+        except self._errors as e:
+            raise DecompressionError(self.name, e)
+        return data
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            self._infile.close()
+
+
+def read_ahead(blocks, count=DEFAULT_READ_AHEAD):
+    """\
+    Yields the given blocks, read on a background thread up to count blocks
+    ahead of the caller, e.g. to decompress input while it is styled. An
+    exception raised while reading is raised by the generator instead.
+    """
+    ready = queue.Queue(count)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                ready.put(item, timeout=_STOP_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for block in blocks:
+                if not put((block, None)):
+                    return
+        except BaseException as e:
+            put((None, e))
+        else:
+            put((None, None))
+
+    # a daemon thread, as it may be blocked reading a pipe on exit
+    thread = threading.Thread(target=read, name='txtstyle-read-ahead', daemon=True)
+    thread.start()
+    try:
+        while True:
+            block, error = ready.get()
+            if error is not None:
+                raise error
+            if block is None:
+                return
+            yield block
+    finally:
+        stopped.set()
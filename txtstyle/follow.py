@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import select
+import sys
+import time
+
+from txtstyle.atomicfile import write_atomically
+from txtstyle.blocks import LineSplitter
+
+# Lines of a file output when following it starts, as by tail -F
+DEFAULT_TAIL_LINES = 10
+
+# inotify(7) events on the file's directory that may mean the file has
+# grown, been truncated or been replaced
+_IN_MODIFY = 0x002
+_IN_ATTRIB = 0x004
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM |
+               _IN_MOVED_TO | _IN_CREATE | _IN_DELETE)
+
+# Seconds between checks of an idle file
+MIN_POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 1.0
+
+
+class InotifyWatcher(object):
+    """\
+    Waits for changes in the directories of the followed files. Watching a
+    directory rather than a file also reports a new file created in its
+    place after rotation.
+    """
+
+    def __init__(self, dirpaths, timeout=MAX_POLL_INTERVAL):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        for dirpath in dirpaths:
+            if libc.inotify_add_watch(fd, os.fsencode(dirpath), _WATCH_MASK) < 0:
+                errno = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(errno, 'inotify_add_watch failed: %s' % dirpath)
+
+        self._fd = fd
+        # also check the files now and then in case an event is missed,
+        # e.g. on network file systems
+        self.timeout = timeout
+
+    def fileno(self):
+        return self._fd
+
+    def wait(self):
+        select.select([self._fd], [], [], self.timeout)
+        self.clear()
+
+    def clear(self):
+        """\
+        Discards pending events, the files are checked either way.
+        """
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def reset(self):
+        pass
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollWatcher(object):
+    """\
+    Sleeps between checks of the followed files, backing off exponentially
+    while they are idle.
+    """
+
+    def __init__(self, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = min_interval
+
+    def fileno(self):
+        return None
+
+    def wait(self):
+        time.sleep(self.timeout)
+        self.clear()
+
+    def clear(self):
+        self.timeout = min(self.timeout * 2, self.max_interval)
+
+    def reset(self):
+        self.timeout = self.min_interval
+
+    def close(self):
+        pass
+
+
+def get_watcher(filepaths):
+    """\
+    Returns an InotifyWatcher for the given files where inotify is
+    available, or a PollWatcher.
+    """
+    if sys.platform.startswith('linux'):
+        dirpaths = set(os.path.dirname(os.path.abspath(p)) for p in filepaths)
+        try:
+            return InotifyWatcher(sorted(dirpaths))
+        except (OSError, AttributeError):
+            pass
+    return PollWatcher()
+
+
+class Follower(object):
+    """\
+    Reads lines appended to a file, like tail -F, starting with its last
+    tail lines. A file that is truncated is read again from the start and a
+    file that is replaced, e.g. by log rotation, is followed under its name.
+
+    If an offset path is given, the offset of the last line read is saved
+    there so that following the same file again resumes after that line.
+    """
+
+    def __init__(self, filepath, block_size, offset_path=None, watcher=None,
+                 tail=DEFAULT_TAIL_LINES):
+        self.filepath = filepath
+        self.block_size = block_size
+        self.offset_path = offset_path
+        self.watcher = watcher
+        self.tail = tail
+        # offset after the last complete line read
+        self.offset = 0
+        self._infile = None
+        self._splitter = LineSplitter()
+
+    def blocks(self):
+        """\
+        Yields blocks of complete lines, waiting for more when the end of
+        the file is reached.
+        """
+        watcher = self.watcher or get_watcher([self.filepath])
+        try:
+            self.open()
+            while True:
+                block = self.read()
+                if block is None:
+                    watcher.wait()
+                    continue
+
+                watcher.reset()
+                yield block
+                self.save_offset()
+        finally:
+            self.close()
+            watcher.close()
+
+    def open(self):
+        """\
+        Opens the file after the last line read, if an offset was saved, or
+        at its last tail lines.
+        """
+        self._open()
+        if not self._resume():
+            self._seek_tail()
+
+    def _open(self):
+        self._infile = open(self.filepath, 'rb', buffering=0)
+        self._splitter = LineSplitter()
+        self.offset = 0
+
+    def read(self):
+        """\
+        Returns the next block of complete lines, or None if nothing was
+        appended. A partial last line is only returned once it is complete
+        or the file is replaced.
+        """
+        while True:
+            data = self._infile.read(self.block_size)
+            if data:
+                block = self._splitter.split(data)
+                if block is None:
+                    continue
+
+                self.offset = self._infile.tell() - len(self._splitter.remainder)
+                return block
+
+            elif self._is_truncated():
+                self._infile.seek(0)
+                self._splitter.flush()
+                self.offset = 0
+
+            elif self._is_replaced():
+                remainder = self._splitter.flush()
+                self.close()
+                # a new file is read from the start
+                self._open()
+                if remainder:
+                    return remainder
+
+            else:
+                return None
+
+    def close(self):
+        if self._infile:
+            self._infile.close()
+            self._infile = None
+
+    def _is_truncated(self):
+        return os.fstat(self._infile.fileno()).st_size < self._infile.tell()
+
+    def _is_replaced(self):
+        try:
+            stat = os.stat(self.filepath)
+        except OSError:
+            # moved away and not recreated yet
+            return False
+        current = os.fstat(self._infile.fileno())
+        return (stat.st_dev, stat.st_ino) != (current.st_dev, current.st_ino)
+
+    def _resume(self):
+        """\
+        Seeks to the saved offset, if any. Returns True if it was found.
+        """
+        state = self._load_offset()
+        if not state:
+            return False
+
+        stat = os.fstat(self._infile.fileno())
+        if ([state.get('dev'), state.get('ino')] == [stat.st_dev, stat.st_ino]
+                and 0 <= state.get('offset', -1) <= stat.st_size):
+            self.offset = state['offset']
+            self._infile.seek(self.offset)
+            return True
+        return False
+
+    def _seek_tail(self):
+        import mmap
+        from txtstyle.lineindex import tail_offset
+
+        try:
+            with mmap.mmap(self._infile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                self.offset = tail_offset(mapped, self.tail)
+        except (ValueError, OSError):
+            return # e.g. an empty file
+        self._infile.seek(self.offset)
+
+    def _load_offset(self):
+        if not self.offset_path:
+            return None
+        try:
+            with open(self.offset_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def save_offset(self):
+        if not self.offset_path:
+            return
+
+        stat = os.fstat(self._infile.fileno())
+        state = {'dev': stat.st_dev, 'ino': stat.st_ino, 'offset': self.offset}
+        write_atomically(self.offset_path, json.dumps(state).encode('utf-8'))
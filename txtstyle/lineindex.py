@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Sidecar indexes of the lines of large files, kept under the cache
+# directory. An index records the number of lines before every
+# DEFAULT_INTERVAL-th byte of a file, so a range of lines is found by
+# searching at most one interval, and is extended when the file grows.
+
+import array
+import bisect
+import hashlib
+import os
+import struct
+import zlib
+
+from .atomicfile import write_atomically
+from .stylecache import get_cache_dir
+
+# Bytes between checkpoints
+DEFAULT_INTERVAL = 256 * 1024
+
+# magic, interval, device and inode of the file, checksum of the indexed bytes
+_HEADER = struct.Struct('<8sQQQI')
+_MAGIC = b'TXTSIDX1'
+# Bytes at the start and end of the indexed part checked for changes
+_CHECKED_SIZE = 4096
+
+
+class LineOffsetIndex(object):
+    """\
+    Finds the offsets of lines of a memory-mapped file by their numbers.
+    checkpoints[k] is the number of lines ending before byte k * interval.
+    The index is loaded from the cache directory if the file is the one it
+    was built from and its indexed part is unchanged, extended over the
+    bytes appended since and saved again.
+    """
+
+    def __init__(self, path, mapped, interval=DEFAULT_INTERVAL, cache_dir=None):
+        self.path = os.path.realpath(path)
+        self.mapped = mapped
+        self.interval = interval
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.checkpoints = array.array('Q', [0])
+
+    def update(self):
+        """\
+        Loads the saved index and indexes the bytes since. Returns the
+        number of checkpoints added.
+        """
+        stat = os.stat(self.path)
+        identity = (self.interval, stat.st_dev, stat.st_ino)
+        checkpoints = self._load(identity)
+        if checkpoints is not None:
+            self.checkpoints = checkpoints
+
+        added = 0
+        mapped = self.mapped
+        count = self.checkpoints[-1]
+        start = (len(self.checkpoints) - 1) * self.interval
+        # only complete intervals are indexed
+        while start + self.interval <= len(mapped):
+            end = start + self.interval
+            count += mapped[start:end].count(b'\n')
+            self.checkpoints.append(count)
+            start = end
+            added += 1
+
+        if added:
+            self._save(identity)
+        return added
+
+    def offset_of(self, line):
+        """\
+        Returns the offset of the line with the given number, from 0, or
+        the size of the file if there are fewer lines.
+        """
+        if line <= 0:
+            return 0
+        # the last checkpoint before the end of the previous line
+        k = bisect.bisect_left(self.checkpoints, line) - 1
+        pos = k * self.interval
+        for i in range(line - self.checkpoints[k]):
+            pos = self.mapped.find(b'\n', pos) + 1
+            if pos == 0:
+                return len(self.mapped)
+        return pos
+
+    def _checksum(self, size):
+        mapped = self.mapped
+        head = mapped[:min(_CHECKED_SIZE, size)]
+        tail = mapped[max(size - _CHECKED_SIZE, 0):size]
+        return zlib.crc32(tail, zlib.crc32(head))
+
+    def _index_path(self):
+        digest = hashlib.sha1(self.path.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.cache_dir, 'index', digest + '.idx')
+
+    def _load(self, identity):
+        try:
+            with open(self._index_path(), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        if len(data) < _HEADER.size:
+            return None
+
+        magic, interval, dev, ino, checksum = _HEADER.unpack_from(data)
+        checkpoints = array.array('Q')
+        checkpoints.frombytes(data[_HEADER.size:])
+        indexed = (len(checkpoints) - 1) * interval
+        # a replaced, truncated or rewritten file is indexed again
+        if (magic != _MAGIC or (interval, dev, ino) != identity or not checkpoints
+                or indexed > len(self.mapped) or self._checksum(indexed) != checksum):
+            return None
+        return checkpoints
+
+    def _save(self, identity):
+        # the index is an optimisation, so failing to write it isn't an error
+        index_path = self._index_path()
+        indexed = (len(self.checkpoints) - 1) * self.interval
+        header = _HEADER.pack(_MAGIC, *(identity + (self._checksum(indexed),)))
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            write_atomically(index_path, header + self.checkpoints.tobytes())
+        except (IOError, OSError):
+            pass
+
+
+def line_range(path, mapped, start, end, cache_dir=None):
+    """\
+    Returns the offsets of the lines start to end of a file, numbered from
+    1 and inclusive, as (start offset, end offset). end may be None for the
+    last line.
+    """
+    index = LineOffsetIndex(path, mapped, cache_dir=cache_dir)
+    index.update()
+    end_offset = len(mapped) if end is None else index.offset_of(end)
+    return min(index.offset_of(start - 1), end_offset), end_offset
+
+
+def tail_offset(mapped, count):
+    """\
+    Returns the offset of the last count lines of a memory-mapped file,
+    searching back from its end.
+    """
+    pos = len(mapped)
+    if count <= 0:
+        return pos
+    if mapped[pos - 1 : pos] == b'\n':
+        pos -= 1
+    for i in range(count):
+        pos = mapped.rfind(b'\n', 0, pos)
+        if pos == -1:
+            return 0
+    return pos + 1
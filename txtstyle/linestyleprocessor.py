@@ -1,36 +1,319 @@
 # -*- coding: utf-8 -*-
 
+import os
 import re
+import types
+from bisect import bisect_right
+from time import perf_counter
 from txtstyle import transformer
 
+# Number of line lengths a StylePlan keeps the regions of IndexStyles for
+_PLAN_CACHE_SIZE = 1024
+# Number of lines after which independent styles are reordered by hit rate
+_REORDER_INTERVAL = 1000
+
+def _may_match(line, required_literals):
+    if required_literals is None:
+        return True
+    for literal in required_literals:
+        if literal in line:
+            return True
+    return False
+
+
+class RegionAllocator(object):
+    """\
+    Tracks the regions of a line that have been styled as a sorted list of
+    non-overlapping (start, end) intervals.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.styles = []
+        # regions with end <= start don't occupy any characters
+        self.empty_regions = {}
+        # number of characters styled
+        self.covered = 0
+
+    def allocate(self, start, end, style):
+        """\
+        Assigns the region to the style and returns True, unless it
+        overlaps a region that has already been allocated.
+        """
+        if end <= start:
+            self.empty_regions[(start, end)] = style
+            return True
+
+        # first allocated region ending after start
+        i = bisect_right(self.ends, start)
+        if i < len(self.starts) and self.starts[i] < end:
+            return False
+
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.styles.insert(i, style)
+        self.covered += end - start
+        return True
+
+    def style_map(self):
+        """\
+        Returns a map of regions to styles, ordered by region.
+        """
+        style_map = dict(zip(zip(self.starts, self.ends), self.styles))
+        if self.empty_regions:
+            style_map.update(self.empty_regions)
+            style_map = dict(sorted(style_map.items()))
+        return style_map
+
+
+def _clip(regions, line_length):
+    """\
+    Returns the regions that start within the line, ending at most at its end.
+    """
+    clipped = []
+    for region in regions:
+        start, end = region[0], region[1]
+        if start >= line_length:
+            continue
+        if end is None or end > line_length:
+            end = line_length
+        clipped.append((start, end))
+    return clipped
+
+
+class PlannedStyleMap(dict):
+    """\
+    A style map precomputed by a StylePlan and shared by all lines of the
+    same length. Transformer keeps how to render it in segments.
+    """
+    segments = None
+
+
+class _LengthPlan(object):
+    """\
+    The regions of IndexStyles in a line of a given length, allocated as if
+    no RegexStyle matched.
+    """
+
+    def __init__(self, index_styles, line_length):
+        self.index_styles = index_styles
+        self.regions = {}
+        # regions accepted per IndexStyle, in order
+        self.accepted = []
+        # characters styled before each IndexStyle and after the last one
+        self.covered = []
+        allocator = RegionAllocator()
+        for style in index_styles:
+            self.covered.append(allocator.covered)
+            regions = self.regions[style] = _clip(style.regions, line_length)
+            accepted = 0
+            for start, end in regions:
+                if allocator.allocate(start, end, style):
+                    accepted += 1
+            self.accepted.append(accepted)
+        self.covered.append(allocator.covered)
+        self.style_map = PlannedStyleMap(allocator.style_map())
+
+    def allocator(self, count):
+        """\
+        Returns a new allocator holding the regions of the first count
+        IndexStyles.
+        """
+        allocator = RegionAllocator()
+        for style in self.index_styles[:count]:
+            for start, end in self.regions[style]:
+                allocator.allocate(start, end, style)
+        return allocator
+
+
+def _may_add_empty_region(style):
+    if isinstance(style, transformer.IndexStyle):
+        return any(end is not None and end <= start for start, end in style.regions)
+    return not style.apply_to_whole_line and style.analyze('can_match_empty')
+
+
+def _is_reorderable(style):
+    return (isinstance(style, transformer.RegexStyle) and not style.apply_to_whole_line
+            and not style.analyze('can_match_empty'))
+
+
+class StylePlan(object):
+    """\
+    Compiles a style list into an evaluation order with early exits. The
+    resulting style maps are those of the declared order.
+
+    Once a line has been styled, whole-line styles are skipped, and once
+    it is fully styled, evaluation stops unless a remaining style may add
+    an empty region. Runs of RegexStyles whose matches can never overlap,
+    such as \\d+ and [a-z]+, are evaluated in order of their observed hit
+    rate, as the order among them doesn't change the result.
+
+    The regions of IndexStyles, which only depend on the length of a line,
+    are precomputed per line length. Until a RegexStyle matches, IndexStyles
+    are styled as planned without checking their regions for overlaps, so
+    a line no pattern matches is styled with a precomputed style map.
+    """
+
+    def __init__(self, styles, reorder=True, cache_size=_PLAN_CACHE_SIZE,
+                 reorder_interval=_REORDER_INTERVAL):
+        from txtstyle.lrucache import LRUCache
+
+        # evaluation order
+        self.order = list(styles)
+        self.index_styles = [s for s in styles if isinstance(s, transformer.IndexStyle)]
+        # per position; styles only move within groups, where both are False
+        self.whole_line = [getattr(s, 'apply_to_whole_line', False) for s in styles]
+        self.may_add_empty = [False] * (len(styles) + 1)
+        for i in reversed(range(len(styles))):
+            self.may_add_empty[i] = self.may_add_empty[i + 1] or _may_add_empty_region(styles[i])
+
+        # (start, end) slices of the order that can be reordered
+        self.groups = self._independent_groups() if reorder else []
+        self.hits = {}
+        for start, end in self.groups:
+            self.hits.update((s, 0) for s in self.order[start:end])
+        self.reorder_interval = reorder_interval
+        self.lines = 0
+        self._lengths = LRUCache(cache_size)
+
+    def _independent_groups(self):
+        groups = []
+        start = 0
+        while start < len(self.order):
+            end = start
+            while (end < len(self.order) and _is_reorderable(self.order[end])
+                   and not any(s.may_overlap(self.order[end]) for s in self.order[start:end])):
+                end += 1
+            if end - start > 1:
+                groups.append((start, end))
+            start = max(end, start + 1)
+        return groups
+
+    def count_line(self):
+        self.lines += 1
+        if self.lines >= self.reorder_interval:
+            self.reorder()
+
+    def reorder(self):
+        """\
+        Moves the styles that matched most often to the front of their
+        group. Older hits count half as much after each reordering.
+        """
+        hits = self.hits
+        for start, end in self.groups:
+            self.order[start:end] = sorted(self.order[start:end], key=lambda s: -hits[s])
+        for style in hits:
+            hits[style] //= 2
+        self.lines = 0
+
+    def get(self, line_length):
+        plan = self._lengths.get(line_length)
+        if plan is None:
+            plan = _LengthPlan(self.index_styles, line_length)
+            self._lengths.put(line_length, plan)
+        return plan
+
+
 class LineStyleProcessor(object):
 
-    def get_style_map(self, line, styles):
-        style_map = {}
+    # lines left partly unstyled, see BudgetedLineStyleProcessor
+    exceeded = 0
+
+    def __init__(self, stats=None):
+        # a Stats instance, if styles are profiled
+        self.stats = stats
+
+    def get_style_map(self, line, styles, program=None, plan=None):
+        """\
+        Returns a map of (start, end) regions to styles, ordered by region.
+        If a StyleProgram compiled from the styles is given, regex matches
+        are taken from it instead of scanning the line once per RegexStyle.
+        If a StylePlan of the styles is given, styles are evaluated as
+        planned.
+        """
+        stats = self.stats
+        if stats is not None:
+            started = perf_counter()
+
         line_is_clean = True
         line_length = len(line)
-        occupied = [False for i in range(line_length)]
+        length_plan = None
+        hits = None
+        if plan is not None:
+            styles = plan.order
+            hits = plan.hits
+            if hits:
+                plan.count_line()
+            if plan.index_styles:
+                length_plan = plan.get(line_length)
+                # IndexStyles styled as planned
+                planned = 0
+        # with a length plan, created once a RegexStyle matches
+        allocator = RegionAllocator() if length_plan is None else None
+        regex_regions = iter(program.find_regions(line)) if program else None
+
+        if stats is not None and program:
+            stats.program_seconds += perf_counter() - started
+
+        for position, style in enumerate(styles):
+            if plan is not None and not line_is_clean:
+                if plan.whole_line[position]:
+                    if regex_regions:
+                        next(regex_regions)
+                    continue
+                covered = allocator.covered if allocator is not None else length_plan.covered[planned]
+                if covered == line_length and not plan.may_add_empty[position]:
+                    break
+
+            if stats is not None:
+                rule = stats.rule(style)
+                started = perf_counter()
 
-        for style in styles:
             regions = []
             apply_to_whole_line = False
 
             if isinstance(style, transformer.IndexStyle):
-                regions = style.regions
-            else:
+                if allocator is None:
+                    accepted = length_plan.accepted[planned]
+                    planned += 1
+                    if accepted:
+                        line_is_clean = False
+                    if stats is not None:
+                        rule.evaluations += 1
+                        rule.matches += len(style.regions)
+                        rule.accepted += accepted
+                        rule.rejected += len(style.regions) - accepted
+                    continue
+                regions = length_plan.regions[style] if length_plan else style.regions
+            elif regex_regions:
+                regions = next(regex_regions)
+                apply_to_whole_line = style.apply_to_whole_line
+            elif _may_match(line, style.required_literals):
                 regions = self.find_regions(line, style.regex_obj)
                 apply_to_whole_line = style.apply_to_whole_line
 
+            if stats is not None:
+                rule.seconds += perf_counter() - started
+                rule.evaluations += 1
+                rule.matches += len(regions)
+
             if apply_to_whole_line and regions:
                 if line_is_clean:
-                    region = (0, line_length)
-                    style_map[region] = style
-                    break # can't apply any more styles
+                    if stats is not None:
+                        rule.accepted += 1
+                    return {(0, line_length): style} # can't apply any more styles
                 else:
                     # skip since other styles
                     # have already been applied
+                    if stats is not None:
+                        rule.rejected += len(regions)
                     continue
 
+            if allocator is None and regions:
+                allocator = length_plan.allocator(planned)
+
+            accepted = 0
             for region in regions:
                 start, end = region[0], region[1]
                 if start >= line_length:
@@ -38,16 +321,20 @@ class LineStyleProcessor(object):
 
                 if end is None or end > line_length:
                     end = line_length
-                    region = (start, end)
 
-                overlaps = any(occupied[start : end])
-                if not overlaps:
-                    for i in range(start, end):
-                        occupied[i] = True
-                    style_map[region] = style
+                if allocator.allocate(start, end, style):
                     line_is_clean = False
+                    accepted += 1
 
-        return style_map
+            if accepted and hits and style in hits:
+                hits[style] += 1
+            if stats is not None:
+                rule.accepted += accepted
+                rule.rejected += len(regions) - accepted
+
+        if allocator is None:
+            return length_plan.style_map
+        return allocator.style_map()
 
     def find_regions(self, line, regex_obj):
         """\
@@ -56,8 +343,94 @@ class LineStyleProcessor(object):
         if not regex_obj:
             return []
         
-        if isinstance(regex_obj, re.Pattern) and not regex_obj.pattern:
+        if isinstance(regex_obj, str):
+            regex_obj = re.compile(regex_obj)
+        elif not regex_obj.pattern:
             return []
 
-        return [(m.start(0), m.end(0)) for m in re.finditer(regex_obj, line)]
+        return [(m.start(0), m.end(0)) for m in regex_obj.finditer(line)]
+
+
+class LineBudgetExceeded(Exception):
+    pass
+
+
+# The empty style map of a line that went over the budget. It isn't cached,
+# so a later line with the same text is matched again.
+OVER_BUDGET = types.MappingProxyType({})
+
+
+class BudgetedLineStyleProcessor(LineStyleProcessor):
+    """\
+    Leaves a line unstyled if matching it takes longer than budget seconds,
+    e.g. because a pattern backtracks catastrophically on it.
+
+    In the main thread, where available, an interval timer interrupts
+    matching once the budget is exceeded. Elsewhere the line is only
+    checked after matching has finished. The timer is started by the first
+    line styled; stop_timer() stops it and restores the SIGALRM handler
+    and timer it replaced.
+    """
+
+    def __init__(self, budget, stats=None):
+        super(BudgetedLineStyleProcessor, self).__init__(stats)
+        self.budget = budget
+        # lines left unstyled
+        self.exceeded = 0
+        self._line_started = None
+        self._timer_pid = None
+        # SIGALRM handler and ITIMER_REAL value replaced by the timer
+        self._previous_timer = None
+
+    def get_style_map(self, line, styles, program=None, plan=None):
+        if self._timer_pid != os.getpid():
+            # also restarts the timer in forked worker processes
+            self._start_timer()
+
+        started = perf_counter()
+        try:
+            self._line_started = started
+            style_map = super(BudgetedLineStyleProcessor, self).get_style_map(
+                line, styles, program, plan)
+            self._line_started = None
+        except LineBudgetExceeded:
+            self._line_started = None
+            style_map = None
+
+        if style_map is None or perf_counter() - started > self.budget:
+            self.exceeded += 1
+            if self.stats is not None:
+                self.stats.budget_exceeded += 1
+            return OVER_BUDGET
+        return style_map
+
+    def stop_timer(self):
+        import signal
+
+        if self._timer_pid == os.getpid() and self._previous_timer is not None:
+            handler, (delay, interval) = self._previous_timer
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, signal.SIG_DFL if handler is None else handler)
+            if delay:
+                signal.setitimer(signal.ITIMER_REAL, delay, interval)
+        self._timer_pid = None
+        self._previous_timer = None
+
+    def _start_timer(self):
+        import signal
+
+        self._timer_pid = os.getpid()
+        if not hasattr(signal, 'setitimer'):
+            return # Windows
+        try:
+            handler = signal.signal(signal.SIGALRM, self._on_timer)
+        except ValueError:
+            return # not the main thread
+        self._previous_timer = (handler, signal.setitimer(signal.ITIMER_REAL, self.budget, self.budget))
 
+    def _on_timer(self, signum, frame):
+        started = self._line_started
+        if started is not None and perf_counter() - started > self.budget:
+            # raised only once per line
+            self._line_started = None
+            raise LineBudgetExceeded()
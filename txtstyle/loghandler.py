@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# Styles the console logs of Python programs with TxtStyle confs, e.g.
+#
+#   handler = TxtStyleHandler(style_name='example')
+#   logging.getLogger().addHandler(handler)
+
+import logging
+import os
+import sys
+import threading
+
+from txtstyle.transformer import Transformer
+
+# Number of styled lines, or region layouts of lines that differ only in
+# their digits, cached per formatter
+DEFAULT_CACHE_SIZE = 1024
+# Number of records buffered by a handler before they are written
+DEFAULT_CAPACITY = 256
+# Seconds after which buffered records are written regardless
+DEFAULT_FLUSH_INTERVAL = 0.1
+
+# (conf path, style name, backend) -> styles
+_styles = {}
+_styles_lock = threading.Lock()
+
+
+def load_styles(style_name, conf_path=None, backend=None):
+    """\
+    Returns the named style from the conf file, by default ~/.txts.conf or
+    the built-in conf if there is none. Styles are loaded once per process.
+    """
+    from txtstyle.txts import _USER_HOME_CONF_FILE
+
+    if conf_path is None and os.path.isfile(_USER_HOME_CONF_FILE):
+        conf_path = _USER_HOME_CONF_FILE
+
+    key = (conf_path, style_name, backend)
+    with _styles_lock:
+        if key not in _styles:
+            if conf_path is None:
+                from txtstyle.confparser import ConfParser
+                from txtstyle.txtsconf import DEFAULT_CONF
+                conf_parser = ConfParser(DEFAULT_CONF.splitlines(), backend)
+            else:
+                from txtstyle.stylecache import StyleCache
+                conf_parser = StyleCache(conf_path, backend=backend)
+            _styles[key] = conf_parser.get_styles(style_name)
+        return _styles[key]
+
+
+def _isatty(stream):
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False # no isatty() or closed
+
+
+class TxtStyleFormatter(logging.Formatter):
+    """\
+    Formats records like logging.Formatter and styles the result, unless
+    the stream the records are written to isn't a terminal.
+
+    Either the name of a style in a conf file or a list of styles is
+    given. The styles are compiled once and styled lines are cached, so
+    records that differ only in their numbers, such as timestamps, are
+    styled without matching the patterns again.
+    """
+
+    def __init__(self, fmt=None, datefmt=None, style='%', style_name=None, styles=None,
+                 conf_path=None, stream=None, color_always=False,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        super(TxtStyleFormatter, self).__init__(fmt, datefmt, style)
+        if styles is None:
+            if style_name is None:
+                raise Exception('Either style_name or styles is required')
+            styles = load_styles(style_name, conf_path)
+
+        self.transformer = Transformer(styles, cache_size=cache_size)
+        self.use_color = color_always or _isatty(sys.stderr if stream is None else stream)
+        # the formatter may be shared by handlers on several threads
+        self._lock = threading.Lock()
+
+    def format(self, record):
+        text = super(TxtStyleFormatter, self).format(record)
+        if not self.use_color:
+            return text
+        return self.style_text(text)
+
+    def style_text(self, text):
+        style = self.transformer.style
+        with self._lock:
+            if '\n' not in text:
+                return style(text)
+            # e.g. tracebacks
+            return '\n'.join([style(line) for line in text.split('\n')])
+
+
+class TxtStyleHandler(logging.StreamHandler):
+    """\
+    A StreamHandler that formats records with a TxtStyleFormatter and
+    writes them in batches. Buffered records are written once capacity
+    records are buffered, a record at flush_level or above is logged, or
+    flush_interval seconds have passed.
+    """
+
+    def __init__(self, stream=None, style_name=None, styles=None, conf_path=None,
+                 color_always=False, fmt=None, datefmt=None, capacity=DEFAULT_CAPACITY,
+                 flush_level=logging.WARNING, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super(TxtStyleHandler, self).__init__(stream)
+        self.setFormatter(TxtStyleFormatter(
+            fmt, datefmt, style_name=style_name, styles=styles, conf_path=conf_path,
+            stream=self.stream, color_always=color_always))
+        self.capacity = capacity
+        self.flush_level = flush_level
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self._timer = None
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record) + self.terminator)
+            if len(self.buffer) >= self.capacity or record.levelno >= self.flush_level:
+                self.flush()
+            elif self._timer is None and self.flush_interval:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self.buffer and self.stream:
+                buffer, self.buffer = self.buffer, []
+                self.stream.write(''.join(buffer))
+            super(TxtStyleHandler, self).flush()
+        finally:
+            self.release()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            super(TxtStyleHandler, self).close()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import os
+import selectors
+import stat
+
+from txtstyle.blocks import LineSplitter
+from txtstyle.decompression import DecompressedFile
+from txtstyle.decompression import get_compression
+from txtstyle.follow import Follower
+from txtstyle.follow import get_watcher
+
+# Number of bytes read from a stream at a time
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+
+def _open_file(path):
+    """\
+    Opens a regular file for reading, decompressing it if compressed.
+    """
+    infile = open(path, 'rb')
+    compression = get_compression(infile)
+    if compression is None:
+        return infile
+    return DecompressedFile(infile, compression, path)
+
+
+class _StreamSource(object):
+    """\
+    A file, pipe or socket read up to its end.
+    """
+
+    def __init__(self, name, infile, block_size):
+        self.name = name
+        self.infile = infile
+        self.block_size = block_size
+        self.eof = False
+        self._splitter = LineSplitter()
+
+    def fileno(self):
+        return self.infile.fileno()
+
+    def read(self):
+        """\
+        Returns the next block of complete lines, b'' at the end of the
+        stream or None if no complete line is available yet.
+        """
+        while True:
+            try:
+                data = self.infile.read(self.block_size)
+            except BlockingIOError:
+                data = None
+            if data is None:
+                return None
+
+            if not data:
+                self.eof = True
+                return self._splitter.flush()
+
+            block = self._splitter.split(data)
+            if block is not None:
+                return block
+
+    def close(self):
+        self.infile.close()
+
+
+class _FollowedSource(object):
+    """\
+    A regular file followed as it grows.
+    """
+
+    def __init__(self, name, block_size):
+        self.name = name
+        self.eof = False
+        self._follower = Follower(name, block_size)
+        self._follower.open()
+
+    def read(self):
+        return self._follower.read()
+
+    def close(self):
+        self._follower.close()
+
+
+class Multiplexer(object):
+    """\
+    Reads several files and streams at once on a single thread. Pipes and
+    sockets are read as they become readable; regular files are read a
+    block at a time in turn, and if followed, checked whenever a watcher
+    reports a change.
+    """
+
+    def __init__(self, paths, block_size=DEFAULT_BLOCK_SIZE, follow=False, watcher=None):
+        self.paths = paths
+        self.block_size = block_size
+        self.follow = follow
+        self.watcher = watcher
+
+    def blocks(self):
+        """\
+        Yields (path, block) tuples as blocks of complete lines arrive.
+        """
+        selector = selectors.DefaultSelector()
+        files = []
+        streams = []
+        watcher = None
+        try:
+            for path in self.paths:
+                if stat.S_ISREG(os.stat(path).st_mode):
+                    if self.follow:
+                        files.append(_FollowedSource(path, self.block_size))
+                    else:
+                        files.append(_StreamSource(path, _open_file(path), self.block_size))
+                else:
+                    source = _StreamSource(path, open(path, 'rb', buffering=0), self.block_size)
+                    os.set_blocking(source.fileno(), False)
+                    selector.register(source, selectors.EVENT_READ)
+                    streams.append(source)
+
+            if self.follow and files:
+                watcher = self.watcher or get_watcher([s.name for s in files])
+                if watcher.fileno() is not None:
+                    selector.register(watcher.fileno(), selectors.EVENT_READ)
+
+            while files or streams:
+                ready = False
+                for source in list(files):
+                    block = source.read()
+                    if block is not None:
+                        ready = True
+                    if block:
+                        yield source.name, block
+                    if source.eof:
+                        files.remove(source)
+                        source.close()
+
+                if ready:
+                    timeout = 0
+                elif watcher and files:
+                    timeout = watcher.timeout
+                elif streams:
+                    timeout = None
+                else:
+                    continue
+
+                for key, events in selector.select(timeout):
+                    source = key.fileobj
+                    if not isinstance(source, _StreamSource):
+                        continue # the watcher's events are cleared below
+
+                    block = source.read()
+                    if block:
+                        yield source.name, block
+                    if source.eof:
+                        selector.unregister(source)
+                        streams.remove(source)
+                        source.close()
+
+                if watcher:
+                    if ready:
+                        watcher.reset()
+                    else:
+                        watcher.clear()
+        finally:
+            for source in files + streams:
+                source.close()
+            if watcher:
+                watcher.close()
+            selector.close()
+
+
+async def style_stream(transformer, reader, block_size=DEFAULT_BLOCK_SIZE):
+    """\
+    Yields styled lines, without line endings, from an asyncio.StreamReader
+    as lines arrive. Invalid UTF-8 is decoded with surrogateescape, so it
+    is written back as it was read by encoding with the same handler.
+    """
+    splitter = LineSplitter()
+    while True:
+        data = await reader.read(block_size)
+        if not data:
+            break
+
+        block = splitter.split(data)
+        if block is None:
+            continue
+        for line in block[:-1].split(b'\n'):
+            yield transformer.style(line.decode('utf-8', 'surrogateescape'))
+
+    remainder = splitter.flush()
+    if remainder:
+        yield transformer.style(remainder.decode('utf-8', 'surrogateescape'))
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+#
+# A pager for files of any size. Lines are found from the current position
+# by searching the memory-mapped file for newlines, so opening a file or
+# jumping to its end doesn't read the lines before. Only the lines on
+# screen, and a few pages around them while idle, are styled.
+
+import array
+import bisect
+import os
+import re
+
+from txtstyle.lrucache import LRUCache
+from txtstyle.palette import DEFAULT_STYLE
+
+# Number of styled lines cached
+DEFAULT_CACHE_SIZE = 10000
+# Pages styled after and before the one on screen while idle
+DEFAULT_READ_AHEAD_PAGES = 2
+# Bytes searched for newlines at a time when numbering lines
+_INDEX_CHUNK_SIZE = 1024 * 1024
+_TAB_SIZE = 8
+
+_SGR = re.compile(r'(\x1b\[[0-9;]*m)')
+_NEWLINE = re.compile(b'\n')
+# A key read from the terminal: an escape sequence or a single character
+_KEY = re.compile(b'\x1b\\[[0-9;]*[~A-Za-z]|\x1bO.|.', re.DOTALL)
+
+# Screen control sequences
+_ALTERNATE_SCREEN = '\x1b[?1049h\x1b[?25l'
+_NORMAL_SCREEN = '\x1b[?25h\x1b[?1049l'
+_HOME = '\x1b[H'
+_CLEAR_LINE = '\x1b[K'
+_REVERSE = '\x1b[7m'
+
+
+class LineIndex(object):
+    """\
+    Finds the lines of a memory-mapped file by the offsets they start at.
+    Line numbers are indexed lazily, from the start of the file up to the
+    furthest line numbered so far.
+    """
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+        self.size = len(mapped)
+        # offsets of the lines numbered so far, and where numbering stopped
+        self._starts = array.array('q', [0])
+        self.indexed = 0
+
+    def line(self, offset):
+        end = self.mapped.find(b'\n', offset)
+        return self.mapped[offset : self.size if end == -1 else end]
+
+    def next(self, offset):
+        """\
+        Returns the offset of the line after the one at offset, or None if
+        it is the last line.
+        """
+        end = self.mapped.find(b'\n', offset) + 1
+        if end == 0 or end >= self.size:
+            return None
+        return end
+
+    def previous(self, offset):
+        """\
+        Returns the offset of the line before the one at offset, or None if
+        it is the first line.
+        """
+        if offset == 0:
+            return None
+        return self.mapped.rfind(b'\n', 0, offset - 1) + 1
+
+    def last(self):
+        """\
+        Returns the offset of the last line.
+        """
+        end = self.size
+        if end and self.mapped[end - 1 : end] == b'\n':
+            end -= 1
+        return self.mapped.rfind(b'\n', 0, end) + 1
+
+    def line_number(self, offset):
+        """\
+        Returns the number, from 1, of the line at offset if lines have been
+        numbered that far, or None.
+        """
+        if offset > self.indexed and self.indexed < self.size:
+            return None
+        i = bisect.bisect_right(self._starts, offset)
+        return i if i and self._starts[i - 1] == offset else None
+
+    def offset_of(self, number):
+        """\
+        Returns the offset of the line with the given number, from 1, or of
+        the last line if there are fewer lines. Numbers the lines up to it.
+        """
+        while len(self._starts) < number and self.indexed < self.size:
+            self._index_chunk()
+        if len(self._starts) < number:
+            return self.last()
+        return self._starts[max(number, 1) - 1]
+
+    def index_to(self, offset):
+        """\
+        Numbers the lines up to offset.
+        """
+        while self.indexed < min(offset, self.size):
+            self._index_chunk()
+
+    def _index_chunk(self):
+        start = self.indexed
+        end = min(start + _INDEX_CHUNK_SIZE, self.size)
+        starts = [m.end() for m in _NEWLINE.finditer(self.mapped, start, end)]
+        if starts and starts[-1] >= self.size:
+            starts.pop() # a trailing newline
+        self._starts.extend(starts)
+        self.indexed = end
+
+
+def clip(styled_line, left, width):
+    """\
+    Returns the columns [left, left + width) of a styled line, keeping the
+    escape sequences of the columns before so styles carry over. Tabs are
+    expanded and other control characters dropped.
+    """
+    columns = []
+    column = 0
+    reset = True
+    for i, part in enumerate(_SGR.split(styled_line)):
+        if i % 2:
+            columns.append(part)
+            reset = part == DEFAULT_STYLE
+            continue
+        for char in part:
+            if char == '\t':
+                count = _TAB_SIZE - column % _TAB_SIZE
+                char = ' '
+            elif char < ' ' or char == '\x7f':
+                continue
+            else:
+                count = 1
+            for n in range(count):
+                if left <= column < left + width:
+                    columns.append(char)
+                column += 1
+    if not reset:
+        columns.append(DEFAULT_STYLE)
+    return ''.join(columns)
+
+
+class Pager(object):
+    """\
+    The state of a pager showing height lines of width columns of a file
+    from the line at offset top. Styled lines are cached in an LRU cache.
+    """
+
+    def __init__(self, mapped, transformer, height, width, name='',
+                 cache_size=DEFAULT_CACHE_SIZE, read_ahead_pages=DEFAULT_READ_AHEAD_PAGES):
+        self.index = LineIndex(mapped)
+        self.transformer = transformer
+        self.cache = LRUCache(cache_size)
+        self.height = height
+        self.width = width
+        self.name = name
+        self.read_ahead_pages = read_ahead_pages
+        self.top = 0
+        self.left = 0
+        # a count typed before a command, e.g. 10 in 10j
+        self.count = ''
+
+    def resize(self, height, width):
+        self.height = max(height, 1)
+        self.width = max(width, 1)
+        self.top = min(self.top, self.last_top())
+
+    def styled_line(self, offset):
+        styled_line = self.cache.get(offset)
+        if styled_line is None:
+            line = self.index.line(offset).decode('utf-8', 'replace')
+            styled_line = self.transformer.style(line)
+            self.cache.put(offset, styled_line)
+        return styled_line
+
+    def page(self):
+        """\
+        Returns the offsets of the lines on screen.
+        """
+        offsets = []
+        offset = self.top
+        while offset is not None and len(offsets) < self.height:
+            offsets.append(offset)
+            offset = self.index.next(offset)
+        return offsets
+
+    def last_top(self):
+        """\
+        Returns the top line of the last page.
+        """
+        offset = self.index.last()
+        for i in range(self.height - 1):
+            previous = self.index.previous(offset)
+            if previous is None:
+                break
+            offset = previous
+        return offset
+
+    def down(self, lines):
+        last_top = self.last_top()
+        for i in range(lines):
+            if self.top >= last_top:
+                break
+            self.top = self.index.next(self.top)
+        self.top = min(self.top, last_top)
+
+    def up(self, lines):
+        for i in range(lines):
+            previous = self.index.previous(self.top)
+            if previous is None:
+                break
+            self.top = previous
+
+    def go_to_line(self, number):
+        self.top = min(self.index.offset_of(number), self.last_top())
+
+    def render(self):
+        """\
+        Returns the escape sequences and text drawing the screen: the page
+        followed by a status line.
+        """
+        screen = [_HOME]
+        offsets = self.page()
+        for offset in offsets:
+            screen.append(clip(self.styled_line(offset), self.left, self.width))
+            screen.append(_CLEAR_LINE + '\r\n')
+        for i in range(self.height - len(offsets)):
+            screen.append('~' + _CLEAR_LINE + '\r\n')
+        screen.append(_REVERSE + clip(self.status(), 0, self.width) + _CLEAR_LINE)
+        return ''.join(screen)
+
+    def status(self):
+        number = self.index.line_number(self.top)
+        if number is None:
+            size = self.index.size
+            position = '%i%%' % (100 * self.top // size if size else 100)
+        else:
+            position = 'line %i' % number
+        if self.top >= self.last_top():
+            position += ' (END)'
+        return ' ' + '  '.join(part for part in (self.name, position) if part)
+
+    def read_ahead(self):
+        """\
+        Yields the offsets of the lines after and before the page on
+        screen, nearest first, styling each as it is consumed.
+        """
+        lines = self.read_ahead_pages * self.height
+        after = self.top
+        for offset in self.page():
+            after = offset
+        before = self.top
+        for i in range(lines):
+            if after is not None:
+                after = self.index.next(after)
+            if before is not None:
+                before = self.index.previous(before)
+            if after is None and before is None:
+                return
+            for offset in (after, before):
+                if offset is not None and offset not in self.cache:
+                    self.styled_line(offset)
+                    yield offset
+
+    def handle_key(self, key):
+        """\
+        Applies a key, given as bytes. Returns False if the pager should
+        quit.
+        """
+        if key.isdigit():
+            self.count += key.decode('ascii')
+            return True
+        count, self.count = int(self.count or 0), ''
+
+        if key in (b'q', b'Q'):
+            return False
+        elif key in (b'j', b'e', b'\r', b'\n', b'\x1b[B', b'\x1bOB'):
+            self.down(count or 1)
+        elif key in (b'k', b'y', b'\x1b[A', b'\x1bOA'):
+            self.up(count or 1)
+        elif key in (b' ', b'f', b'\x1b[6~'):
+            self.down((count or 1) * self.height)
+        elif key in (b'b', b'\x1b[5~'):
+            self.up((count or 1) * self.height)
+        elif key == b'd':
+            self.down(max(self.height // 2, 1))
+        elif key == b'u':
+            self.up(max(self.height // 2, 1))
+        elif key in (b'g', b'<', b'\x1b[H', b'\x1bOH'):
+            self.go_to_line(count or 1)
+        elif key in (b'G', b'>', b'\x1b[F', b'\x1bOF'):
+            if count:
+                self.go_to_line(count)
+            else:
+                self.top = self.last_top()
+        elif key in (b'\x1b[C', b'\x1bOC'):
+            self.left += max(self.width // 2, 1)
+        elif key in (b'\x1b[D', b'\x1bOD'):
+            self.left = max(self.left - max(self.width // 2, 1), 0)
+
+        # numbers the lines while the user scrolls from the start, but not
+        # the whole file when jumping to its end
+        if self.top - self.index.indexed < _INDEX_CHUNK_SIZE:
+            self.index.index_to(self.top)
+        return True
+
+
+def page_file(path, transformer, cache_size=DEFAULT_CACHE_SIZE):
+    """\
+    Shows a file in the terminal until the user quits.
+    """
+    import mmap
+    import select
+    import shutil
+    import sys
+    import termios
+    import tty
+
+    with open(path, 'rb') as infile:
+        try:
+            mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return # empty file
+
+    tty_fd = os.open('/dev/tty', os.O_RDONLY)
+    saved_mode = termios.tcgetattr(tty_fd)
+    out = sys.stdout
+    try:
+        tty.setcbreak(tty_fd)
+        out.write(_ALTERNATE_SCREEN)
+        size = shutil.get_terminal_size()
+        pager = Pager(mapped, transformer, size.lines - 1, size.columns,
+                      os.path.basename(path), cache_size)
+        read_ahead = None
+        while True:
+            if read_ahead is None:
+                out.write(pager.render())
+                out.flush()
+                read_ahead = pager.read_ahead()
+
+            # styles the lines around the page until a key is pressed,
+            # then checks now and then if the terminal was resized
+            timeout = 0 if read_ahead else 0.25
+            if not select.select([tty_fd], [], [], timeout)[0]:
+                if read_ahead and next(read_ahead, None) is None:
+                    read_ahead = False
+                size = shutil.get_terminal_size()
+                if (size.lines - 1, size.columns) != (pager.height, pager.width):
+                    pager.resize(size.lines - 1, size.columns)
+                    read_ahead = None
+                continue
+
+            keys = _KEY.findall(os.read(tty_fd, 1024))
+            if not all([pager.handle_key(key) for key in keys]):
+                break
+            read_ahead = None
+    except KeyboardInterrupt:
+        pass
+    finally:
+        out.write(_NORMAL_SCREEN)
+        out.flush()
+        termios.tcsetattr(tty_fd, termios.TCSADRAIN, saved_mode)
+        os.close(tty_fd)
+        mapped.close()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import multiprocessing
+
+# Transformer of the current worker process
+_transformer = None
+
+
+def _init_worker(transformer):
+    global _transformer
+    _transformer = transformer
+
+
+def _style_block(block):
+    """\
+    Styles a block and returns it with the number of its lines that went
+    over the line budget, if any.
+    """
+    processor = _transformer.line_style_processor
+    exceeded = processor.exceeded
+    styled_block = _transformer.style_block(block)
+    return styled_block, processor.exceeded - exceeded
+
+
+class ParallelStyler(object):
+    """\
+    Styles blocks of lines in a pool of worker processes. Styled blocks are
+    returned in the order they were read, and at most `window` blocks are
+    in flight at any time so memory stays bounded regardless of input size.
+    """
+
+    def __init__(self, transformer, jobs, window=None):
+        self.transformer = transformer
+        self.jobs = jobs
+        self.window = window or 2 * jobs
+
+    def style_blocks(self, blocks):
+        pool = multiprocessing.Pool(
+            self.jobs, initializer=_init_worker, initargs=(self.transformer,))
+        try:
+            pending = collections.deque()
+            for block in blocks:
+                # copies slices of memory-mapped files
+                pending.append(pool.apply_async(_style_block, (bytes(block),)))
+                if len(pending) >= self.window:
+                    yield self._result(pending.popleft())
+
+            while pending:
+                yield self._result(pending.popleft())
+
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _result(self, result):
+        styled_block, exceeded = result.get()
+        # lines over the budget are reported by the parent process
+        self.transformer.line_style_processor.exceeded += exceeded
+        return styled_block
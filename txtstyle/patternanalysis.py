@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+#
+# Static analysis of regex patterns, based on the parse tree of the
+# stdlib regex parser.
+
+import re
+
+import string
+
+try:
+    from re import _compiler as sre_compile
+    from re import _parser as sre_parse
+except ImportError: # Python < 3.11
+    import sre_compile
+    import sre_parse
+
+_REPEATS = tuple(op for op in (
+    sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None))
+    if op is not None)
+# Opcodes that refer to other groups by number
+GROUP_REFERENCES = (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS)
+
+# Repeats that backtrack, and the repeat count from which a bounded
+# repeat is considered as costly as an unbounded one
+_BACKTRACKING_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+_MANY = 10
+_ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+_CHARACTER_ITEMS = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY)
+_ZERO_WIDTH = (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT)
+# Characters used to tell whether character classes overlap
+_SAMPLE_CHARS = frozenset(string.printable + '\xa0\xe9\xdf\u0660\u20ac\u4e2d')
+
+_DIGITS = frozenset(range(ord('0'), ord('9') + 1))
+# Character categories that contain every ASCII digit
+_DIGIT_CATEGORIES = (sre_parse.CATEGORY_DIGIT, sre_parse.CATEGORY_WORD,
+                     sre_parse.CATEGORY_NOT_SPACE, sre_parse.CATEGORY_NOT_LINEBREAK)
+
+# Categories whose characters are compared with those of other patterns,
+# with their Unicode meaning, which includes the ASCII one
+_CATEGORY_PATTERNS = {
+    sre_parse.CATEGORY_DIGIT: re.compile(r'\d'),
+    sre_parse.CATEGORY_SPACE: re.compile(r'\s'),
+    sre_parse.CATEGORY_WORD: re.compile(r'\w'),
+}
+_DISJOINT_CATEGORIES = frozenset([
+    frozenset([sre_parse.CATEGORY_DIGIT, sre_parse.CATEGORY_SPACE]),
+    frozenset([sre_parse.CATEGORY_WORD, sre_parse.CATEGORY_SPACE]),
+])
+# Largest range of a character set whose characters are listed
+_MAX_LISTED_RANGE = 256
+
+
+def required_literals(regex_obj):
+    """\
+    Returns a tuple of strings at least one of which occurs in every match
+    of the pattern, or None if no such strings were found.
+    """
+    if not isinstance(regex_obj, re.Pattern) or not isinstance(regex_obj.pattern, str):
+        return None
+    if regex_obj.flags & (re.IGNORECASE | re.LOCALE):
+        return None
+    try:
+        parsed = sre_parse.parse(regex_obj.pattern, regex_obj.flags)
+    except re.error:
+        return None
+
+    literals = _required_literals(parsed)
+    if not literals or '' in literals:
+        return None
+    return tuple(sorted(literals))
+
+
+def _required_literals(subpattern):
+    """\
+    Returns the most selective set of alternative strings required by a
+    sequence of the parse tree, or None.
+    """
+    best = None
+    run = []
+
+    for op, av in subpattern:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+
+        best = _more_selective(best, _run_literal(run))
+        run = []
+
+        if op is sre_parse.SUBPATTERN:
+            add_flags, p = av[1], av[3]
+            if not add_flags & (re.IGNORECASE | re.LOCALE):
+                best = _more_selective(best, _required_literals(p))
+        elif op is sre_parse.BRANCH:
+            alternatives = [_required_literals(p) for p in av[1]]
+            if all(alternatives):
+                best = _more_selective(best, frozenset().union(*alternatives))
+        elif op in _REPEATS and av[0] >= 1:
+            best = _more_selective(best, _required_literals(av[2]))
+
+    return _more_selective(best, _run_literal(run))
+
+
+def _run_literal(run):
+    return frozenset([''.join(run)]) if run else None
+
+
+def _more_selective(a, b):
+    if not a or not b:
+        return a or b
+    return a if min(map(len, a)) >= min(map(len, b)) else b
+
+
+def is_digit_agnostic(regex_obj):
+    """\
+    Returns True if the pattern treats all ASCII digits alike, so that it
+    matches the same regions of two lines that differ only in their digits.
+    """
+    if not isinstance(regex_obj, re.Pattern) or not isinstance(regex_obj.pattern, str):
+        return False
+    try:
+        parsed = sre_parse.parse(regex_obj.pattern, regex_obj.flags)
+    except re.error:
+        return False
+    return _is_digit_agnostic(parsed)
+
+
+def _is_digit_agnostic(subpattern):
+    for op, av in subpattern:
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL):
+            if av in _DIGITS:
+                return False
+        elif op is sre_parse.IN:
+            if not _is_digit_agnostic_set(av):
+                return False
+        elif op in GROUP_REFERENCES:
+            # e.g. (\d)\1 compares digits
+            return False
+        elif not all(_is_digit_agnostic(p) for p in subpatterns(av)):
+            return False
+    return True
+
+
+def _is_digit_agnostic_set(items):
+    digits = set()
+    for op, av in items:
+        if op is sre_parse.CATEGORY and av in _DIGIT_CATEGORIES:
+            return True
+        if op is sre_parse.LITERAL:
+            digits.add(av)
+        elif op is sre_parse.RANGE:
+            digits.update(range(max(av[0], ord('0')), min(av[1], ord('9')) + 1))
+    # negation doesn't matter if the set has none or all of the digits
+    digits &= _DIGITS
+    return not digits or digits == _DIGITS
+
+
+def can_match_empty(regex_obj):
+    """\
+    Returns True unless every match of the pattern is at least one
+    character long.
+    """
+    if not isinstance(regex_obj, re.Pattern):
+        return True
+    try:
+        parsed = sre_parse.parse(regex_obj.pattern, regex_obj.flags)
+    except re.error:
+        return True
+    return parsed.getwidth()[0] == 0
+
+
+def may_overlap(regex_a, regex_b):
+    """\
+    Returns False if a match of one pattern can never contain a character
+    that a match of the other pattern contains, e.g. for \\d+ and [a-z]+,
+    so that their matches never overlap.
+    """
+    a = _match_alphabet(regex_a)
+    b = _match_alphabet(regex_b)
+    if a is None or b is None:
+        return True
+
+    (chars_a, categories_a), (chars_b, categories_b) = a, b
+    if chars_a & chars_b:
+        return True
+    for categories, chars in [(categories_a, chars_b), (categories_b, chars_a)]:
+        for category in categories:
+            matcher = _CATEGORY_PATTERNS[category]
+            if any(matcher.match(chr(c)) for c in chars):
+                return True
+    for category_a in categories_a:
+        for category_b in categories_b:
+            if frozenset([category_a, category_b]) not in _DISJOINT_CATEGORIES:
+                return True
+    return False
+
+
+def _match_alphabet(regex_obj):
+    """\
+    Returns the code points and categories of the characters a match of the
+    pattern may contain, or None if they can't be listed.
+    """
+    if not isinstance(regex_obj, re.Pattern) or regex_obj.flags & (re.IGNORECASE | re.LOCALE):
+        return None
+    try:
+        parsed = sre_parse.parse(regex_obj.pattern, regex_obj.flags)
+    except re.error:
+        return None
+
+    chars, categories = set(), set()
+    if not _add_alphabet(parsed, chars, categories):
+        return None
+    return chars, categories
+
+
+def _add_alphabet(subpattern, chars, categories):
+    for op, av in subpattern:
+        if op is sre_parse.LITERAL:
+            chars.add(av)
+        elif op is sre_parse.IN:
+            for item_op, item_av in av:
+                if item_op is sre_parse.LITERAL:
+                    chars.add(item_av)
+                elif item_op is sre_parse.RANGE and item_av[1] - item_av[0] <= _MAX_LISTED_RANGE:
+                    chars.update(range(item_av[0], item_av[1] + 1))
+                elif item_op is sre_parse.CATEGORY and item_av in _CATEGORY_PATTERNS:
+                    categories.add(item_av)
+                else:
+                    return False # negated sets and other categories
+        elif op in _ZERO_WIDTH:
+            continue # lookarounds don't add characters to the match
+        elif op is sre_parse.SUBPATTERN:
+            if av[1] & (re.IGNORECASE | re.LOCALE) or not _add_alphabet(av[3], chars, categories):
+                return False
+        elif op in _REPEATS:
+            if not _add_alphabet(av[2], chars, categories):
+                return False
+        elif op is sre_parse.BRANCH:
+            if not all(_add_alphabet(p, chars, categories) for p in av[1]):
+                return False
+        elif op is _ATOMIC_GROUP:
+            if not _add_alphabet(av, chars, categories):
+                return False
+        else:
+            return False # e.g. . and backreferences
+    return True
+
+
+def subpatterns(av):
+    """\
+    Yields the parse trees nested in the argument of an opcode.
+    """
+    for item in (av if isinstance(av, (tuple, list)) else [av]):
+        if isinstance(item, sre_parse.SubPattern):
+            yield item
+        elif isinstance(item, (tuple, list)):
+            for subpattern in subpatterns(item):
+                yield subpattern
+
+
+def backtracking_risk(regex_obj):
+    """\
+    Returns a description of a construct that is likely to make matching
+    the pattern take exponential time on some lines, or None. Only the
+    most common causes are detected, such as nested quantifiers in (a+)+
+    and overlapping alternatives in (a\\w|\\wb)*.
+    """
+    if not isinstance(regex_obj, re.Pattern) or not isinstance(regex_obj.pattern, str):
+        return None
+    try:
+        parsed = sre_parse.parse(regex_obj.pattern, regex_obj.flags)
+    except re.error:
+        return None
+    return _backtracking_risk(parsed, parsed.state)
+
+
+def _backtracking_risk(subpattern, state):
+    for op, av in subpattern:
+        if op in _BACKTRACKING_REPEATS and av[1] >= _MANY:
+            body = av[2]
+            first = _charset(_first_items(body), state)
+            for repeat in _trailing_repeats(body):
+                if first & _charset(_first_items(repeat), state):
+                    return 'nested quantifiers'
+            if _has_overlapping_alternatives(body, state, first):
+                return 'overlapping alternatives in a repeat'
+
+        if op is _ATOMIC_GROUP:
+            continue # can't backtrack into it
+        for p in subpatterns(av):
+            risk = _backtracking_risk(p, state)
+            if risk:
+                return risk
+    return None
+
+
+def _trailing_repeats(items):
+    """\
+    Returns the bodies of unbounded repeats that can end a match of items.
+    """
+    repeats = []
+    for op, av in reversed(list(items)):
+        if op in _BACKTRACKING_REPEATS:
+            if av[1] >= _MANY:
+                repeats.append(av[2])
+            else:
+                repeats.extend(_trailing_repeats(av[2]))
+            if av[0] > 0 and not _can_be_empty(av[2]):
+                break
+        elif op is sre_parse.SUBPATTERN:
+            repeats.extend(_trailing_repeats(av[3]))
+            if not _can_be_empty(av[3]):
+                break
+        elif op is sre_parse.BRANCH:
+            for alternative in av[1]:
+                repeats.extend(_trailing_repeats(alternative))
+            if not any(_can_be_empty(a) for a in av[1]):
+                break
+        elif op not in _ZERO_WIDTH:
+            break
+    return repeats
+
+
+def _has_overlapping_alternatives(items, state, follow):
+    """\
+    Returns True if a branch in items has alternatives that can match the
+    same text. follow is the set of characters that can follow items, the
+    first characters of the next iteration of the enclosing repeat.
+    """
+    items = list(items)
+    for i, (op, av) in enumerate(items):
+        if op is not sre_parse.SUBPATTERN and op is not sre_parse.BRANCH:
+            continue
+        rest = items[i + 1:]
+        after = _charset(_first_items(rest), state)
+        if _can_be_empty(rest):
+            after = after | follow
+
+        if op is sre_parse.SUBPATTERN:
+            if _has_overlapping_alternatives(av[3], state, after):
+                return True
+            continue
+
+        seen = set()
+        nullable = 0
+        for alternative in av[1]:
+            first = _charset(_first_items(alternative), state)
+            if seen & first:
+                return True
+            seen |= first
+            nullable += _can_be_empty(alternative)
+        # common prefixes are factored out of the alternatives, e.g. (a|aa)
+        # is parsed as a(?:|a), where skipping the branch competes with the
+        # other alternatives for the characters that follow it
+        if nullable > 1 or (nullable and seen & after):
+            return True
+    return False
+
+
+def _first_items(items):
+    """\
+    Returns the single character items that can start a match of items, or
+    None if they can't be determined.
+    """
+    first = []
+    for op, av in items:
+        if op in _CHARACTER_ITEMS:
+            first.append((op, av))
+            return first
+        elif op in _ZERO_WIDTH:
+            continue
+        elif op is sre_parse.SUBPATTERN:
+            body, may_skip = av[3], _can_be_empty(av[3])
+        elif op in _REPEATS:
+            body, may_skip = av[2], av[0] == 0 or _can_be_empty(av[2])
+        elif op is sre_parse.BRANCH:
+            body, may_skip = None, any(_can_be_empty(a) for a in av[1])
+            for alternative in av[1]:
+                alternative_first = _first_items(alternative)
+                if alternative_first is None:
+                    return None
+                first.extend(alternative_first)
+        else:
+            return None
+
+        if body is not None:
+            body_first = _first_items(body)
+            if body_first is None:
+                return None
+            first.extend(body_first)
+        if not may_skip:
+            return first
+    return first
+
+
+def _can_be_empty(items):
+    return sre_parse.SubPattern(None, list(items)).getwidth()[0] == 0
+
+
+def _charset(items, state):
+    """\
+    Returns the characters of a sample alphabet matched by any of the
+    single character items.
+    """
+    if items is None:
+        return _SAMPLE_CHARS
+    chars = set()
+    for item in items:
+        matcher = sre_compile.compile(sre_parse.SubPattern(state, [item]))
+        chars.update(c for c in _SAMPLE_CHARS if matcher.fullmatch(c))
+    return frozenset(chars)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Regex engines that RegexStyle patterns can be compiled with. Besides the
+# stdlib re module, the third-party regex module and RE2 bindings, which
+# match in linear time, are used when installed.
+
+import re
+
+BACKEND_RE = 're'
+BACKEND_REGEX = 'regex'
+BACKEND_RE2 = 're2'
+BACKENDS = (BACKEND_RE, BACKEND_REGEX, BACKEND_RE2)
+
+# Imported backend modules, or None for backends that aren't installed
+_modules = {BACKEND_RE: re}
+
+
+def get_module(backend):
+    """\
+    Returns the module implementing the backend, or None if it isn't
+    installed.
+    """
+    if backend not in BACKENDS:
+        raise Exception('Invalid regex backend: "%s"' % backend)
+
+    if backend not in _modules:
+        import importlib
+        try:
+            _modules[backend] = importlib.import_module(backend)
+        except ImportError:
+            _modules[backend] = None
+    return _modules[backend]
+
+
+def available_backends():
+    return [b for b in BACKENDS if get_module(b) is not None]
+
+
+def compile_pattern(pattern, backend=BACKEND_RE):
+    """\
+    Compiles the pattern with the backend. Falls back to the re module if
+    the backend isn't installed or doesn't support the pattern, e.g. RE2
+    and backreferences. Patterns already compiled with re are only
+    recompiled if they use no flags other than the default ones.
+    """
+    module = get_module(backend)
+    if isinstance(pattern, re.Pattern):
+        if module is re or pattern.flags & ~re.UNICODE:
+            return pattern
+        source = pattern.pattern
+    else:
+        source = pattern
+
+    if module is not None and module is not re:
+        try:
+            return module.compile(source)
+        except Exception:
+            pass # unsupported feature
+    return re.compile(pattern)
+
+
+def get_backend(regex_obj):
+    """\
+    Returns the name of the backend a pattern was compiled with.
+    """
+    module = type(regex_obj).__module__.split('.')[0].lstrip('_')
+    return module if module in BACKENDS else BACKEND_RE
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# Rotated log sets, such as app.log, app.log.1 and app.log.2.gz, are
+# styled oldest file first, as a single log. With several jobs, worker
+# processes read, decompress and style the files ahead of the one being
+# written.
+
+import collections
+import mmap
+import os
+import re
+import shutil
+
+from txtstyle.blocks import block_offsets
+from txtstyle.blocks import read_blocks
+from txtstyle.decompression import DecompressedFile
+from txtstyle.decompression import get_compression
+from txtstyle.decompression import read_ahead
+
+# Bytes of an uncompressed file styled by a worker at a time. Compressed
+# files are styled by a single worker each.
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+# Number of bytes read at a time
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# app.log, app.log.1, app.log.2.gz or app.log-20240101.gz
+_ROTATED_NAME = re.compile(r'^(.+?)(?:[.-](\d+))?(\.(?:gz|bz2|xz|zst))?$')
+# Longer suffixes are dates, which grow with time unlike rotation indexes
+_MAX_INDEX_DIGITS = 4
+_GLOB_CHARS = re.compile(r'[*?[]')
+
+
+def expand_paths(paths):
+    """\
+    Returns the files named by paths, which may be directories or glob
+    patterns, and whether any directory or pattern was expanded. Patterns
+    that match no file are kept as they are.
+    """
+    files = []
+    expanded = False
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(n for n in os.listdir(path) if not n.startswith('.'))
+            files.extend(p for p in (os.path.join(path, n) for n in names) if os.path.isfile(p))
+            expanded = True
+        elif _GLOB_CHARS.search(path) and not os.path.exists(path):
+            import glob
+            matches = sorted(p for p in glob.glob(path) if os.path.isfile(p))
+            files.extend(matches or [path])
+            expanded = True
+        else:
+            files.append(path)
+    return files, expanded
+
+
+def _split_name(path):
+    """\
+    Returns the path without rotation suffixes and the suffix, if any.
+    """
+    dirname, name = os.path.split(path)
+    base, suffix, extension = _ROTATED_NAME.match(name).groups()
+    return os.path.join(dirname, base), suffix
+
+
+def is_rotation_set(paths):
+    """\
+    Returns True if paths are several regular files with the same name but
+    for rotation suffixes, e.g. app.log and app.log.1.gz.
+    """
+    if len(paths) < 2 or not all(os.path.isfile(p) for p in paths):
+        return False
+    return len(set(_split_name(p)[0] for p in paths)) == 1
+
+
+def order_rotated(paths):
+    """\
+    Returns the files oldest first: by rotation index or date suffix if
+    they form a rotation set, by modification time otherwise.
+    """
+    if not is_rotation_set(paths):
+        return sorted(paths, key=lambda p: (os.stat(p).st_mtime, p))
+
+    def key(path):
+        suffix = _split_name(path)[1]
+        if suffix is None:
+            return (2, 0) # the file being written to
+        if len(suffix) > _MAX_INDEX_DIGITS:
+            return (1, int(suffix))
+        return (0, -int(suffix))
+    return sorted(paths, key=key)
+
+
+def prefix_lines(prefix, block):
+    return b''.join(prefix + line for line in block.splitlines(True))
+
+
+def _range_blocks(path, start, end, block_size):
+    """\
+    Yields blocks of the lines of an uncompressed file that start within
+    [start, end).
+    """
+    with open(path, 'rb') as infile, \
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        # a line belongs to the part its first byte is in
+        pos = 0
+        if start:
+            pos = mapped.find(b'\n', start - 1) + 1
+            if pos == 0:
+                return # the last line starts before the part
+        if end < len(mapped):
+            end = mapped.find(b'\n', end - 1) + 1 or len(mapped)
+        else:
+            end = len(mapped)
+        for block_start, block_end in block_offsets(mapped, block_size, pos, end):
+            yield mapped[block_start:block_end]
+
+
+# Transformer and spool directory of the current worker process
+_transformer = None
+_spool_dir = None
+
+
+def _init_worker(transformer, spool_dir):
+    global _transformer, _spool_dir
+    _transformer = transformer
+    _spool_dir = spool_dir
+
+
+def _style_part(part):
+    """\
+    Styles a part of a file into a spool file and returns its path with
+    the number of lines of the part that went over the line budget. A part
+    of a compressed file is given as its decompressed lines.
+    """
+    import tempfile
+
+    path, start, end, data, prefix, block_size = part
+    if data is None:
+        blocks = _range_blocks(path, start, end, block_size)
+    else:
+        blocks = (data[i:j] for i, j in block_offsets(data, block_size))
+
+    processor = _transformer.line_style_processor
+    exceeded = processor.exceeded
+    fd, spool_path = tempfile.mkstemp(dir=_spool_dir)
+    with os.fdopen(fd, 'wb') as spool:
+        for block in blocks:
+            styled_block = _transformer.style_block(block)
+            if prefix:
+                styled_block = prefix_lines(prefix, styled_block)
+            spool.write(styled_block)
+    return spool_path, processor.exceeded - exceeded
+
+
+class RotatedSetStyler(object):
+    """\
+    Styles files in a pool of worker processes. Uncompressed files are split
+    into parts of about part_size bytes, which the workers read themselves.
+    Compressed files are decompressed on a thread of the calling process, a
+    few parts ahead, and their lines sent to the workers in parts of about
+    part_size bytes. Styled parts are spooled to temporary files and
+    returned in order; at most `window` parts are in flight at any time, so
+    memory and disk use stay bounded regardless of the size of the set.
+    """
+
+    def __init__(self, transformer, jobs, part_size=DEFAULT_PART_SIZE,
+                 block_size=DEFAULT_BLOCK_SIZE, window=None):
+        self.transformer = transformer
+        self.jobs = jobs
+        self.part_size = part_size
+        self.block_size = block_size
+        self.window = window or 2 * jobs
+
+    def get_parts(self, paths, prefixes=None):
+        for path in paths:
+            prefix = prefixes[path] if prefixes else None
+            with open(path, 'rb') as infile:
+                compression = get_compression(infile)
+                size = os.fstat(infile.fileno()).st_size
+            if compression is not None:
+                for part in self._decompressed_parts(path, compression, prefix):
+                    yield part
+                continue
+            for start in range(0, size, self.part_size):
+                yield (path, start, start + self.part_size, None, prefix, self.block_size)
+
+    def _decompressed_parts(self, path, compression, prefix):
+        with open(path, 'rb') as infile:
+            decompressed = DecompressedFile(infile, compression, path)
+            parts = read_ahead(read_blocks(decompressed.read, self.part_size))
+            try:
+                for data in parts:
+                    yield (path, None, None, data, prefix, self.block_size)
+            finally:
+                parts.close()
+
+    def style_files(self, paths, prefixes=None):
+        """\
+        Yields blocks of the styled files in the given order. prefixes
+        optionally maps paths to bytes written before each of their lines.
+        """
+        import multiprocessing
+        import tempfile
+
+        spool_dir = tempfile.mkdtemp(prefix='txts-')
+        pool = multiprocessing.Pool(
+            self.jobs, initializer=_init_worker, initargs=(self.transformer, spool_dir))
+        try:
+            pending = collections.deque()
+            for part in self.get_parts(paths, prefixes):
+                pending.append(pool.apply_async(_style_part, (part,)))
+                if len(pending) >= self.window:
+                    for block in self._read_spool(pending.popleft()):
+                        yield block
+
+            while pending:
+                for block in self._read_spool(pending.popleft()):
+                    yield block
+
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            shutil.rmtree(spool_dir, ignore_errors=True)
+
+    def _read_spool(self, result):
+        spool_path, exceeded = result.get()
+        # lines over the budget are reported by the parent process
+        self.transformer.line_style_processor.exceeded += exceeded
+        try:
+            with open(spool_path, 'rb') as spool:
+                while True:
+                    block = spool.read(self.block_size)
+                    if not block:
+                        break
+                    yield block
+        finally:
+            os.remove(spool_path)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from time import perf_counter
+
+# Width of the rule column of the report
+_RULE_WIDTH = 48
+
+
+def _rule_name(style):
+    regex_obj = getattr(style, 'regex_obj', None)
+    if regex_obj is None:
+        return repr(style)
+    if style.apply_to_whole_line:
+        return '%s (whole line)' % regex_obj.pattern
+    return regex_obj.pattern
+
+
+class RuleStats(object):
+    """\
+    Counters of a single style.
+    """
+
+    def __init__(self, style):
+        self.style = style
+        self.evaluations = 0
+        self.matches = 0
+        # regions styled vs. dropped for overlapping earlier regions
+        self.accepted = 0
+        self.rejected = 0
+        self.seconds = 0.0
+
+
+class Stats(object):
+    """\
+    Collects per-rule counters from a LineStyleProcessor along with overall
+    throughput from Transformer and Txts.
+    """
+
+    def __init__(self):
+        self.rules = {}
+        self.lines = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.io_seconds = 0.0
+        self.style_seconds = 0.0
+        # time spent in a StyleProgram, which matches all rules at once
+        self.program_seconds = 0.0
+        # lines left unstyled for exceeding the time budget
+        self.budget_exceeded = 0
+        self.line_cache = None
+        self.started = perf_counter()
+
+    def rule(self, style):
+        # copies of the styles used for ASCII lines count as the originals
+        style = getattr(style, 'text_style', style)
+        try:
+            return self.rules[style]
+        except KeyError:
+            rule = self.rules[style] = RuleStats(style)
+            return rule
+
+    def timed_reads(self, blocks):
+        """\
+        Yields the given blocks, counting the time spent waiting for each
+        one as I/O.
+        """
+        blocks = iter(blocks)
+        while True:
+            started = perf_counter()
+            try:
+                block = next(blocks)
+            except StopIteration:
+                return
+            finally:
+                self.io_seconds += perf_counter() - started
+            yield block
+
+    def report(self):
+        elapsed = perf_counter() - self.started
+        lines_per_s = self.lines / elapsed if elapsed > 0 else 0.0
+        report = [
+            'lines: %i in %.3f s (%.0f lines/s)' % (self.lines, elapsed, lines_per_s),
+            'bytes in: %i, bytes out: %i' % (self.bytes_in, self.bytes_out),
+            'time in I/O: %.3f s, styling: %.3f s' % (self.io_seconds, self.style_seconds),
+        ]
+        if self.line_cache is not None:
+            report.append('line cache: %i hits, %i misses' %
+                          (self.line_cache.hits, self.line_cache.misses))
+        if self.budget_exceeded:
+            report.append('lines over time budget: %i' % self.budget_exceeded)
+        if self.program_seconds:
+            report.append('time in style program: %.3f s' % self.program_seconds)
+
+        report.append('%-*s %10s %10s %10s %10s %10s' % (
+            _RULE_WIDTH, 'rule', 'evals', 'matches', 'accepted', 'rejected', 'time (ms)'))
+        for rule in sorted(self.rules.values(), key=lambda r: -r.seconds):
+            name = _rule_name(rule.style)
+            if len(name) > _RULE_WIDTH:
+                name = name[:_RULE_WIDTH - 3] + '...'
+            report.append('%-*s %10i %10i %10i %10i %10.1f' % (
+                _RULE_WIDTH, name, rule.evaluations, rule.matches,
+                rule.accepted, rule.rejected, rule.seconds * 1000))
+        return '\n'.join(report) + '\n'
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import marshal
+import os
+import re
+
+from .regexbackend import BACKEND_RE
+from .transformer import IndexStyle
+from .transformer import RegexStyle
+from .version import VERSION
+
+
+def get_cache_dir():
+    cache_home = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'txtstyle')
+
+
+class StyleCache(object):
+    """\
+    Reads styles from a conf file, caching the parsed style definitions,
+    resolved transforms and the analysis of their patterns on disk. A cache
+    entry is only used if the mtime and size of the conf file, and of the
+    included files read to find the style, match the ones it was created
+    from, so a hit doesn't read the conf file.
+
+    Regexes are still compiled when styles are loaded from the cache since
+    compiled patterns can't be stored. Entries are stored with marshal,
+    which is faster to load than JSON and needs no import.
+    """
+
+    def __init__(self, conf_path, cache_dir=None, backend=None):
+        self.conf_path = os.path.abspath(conf_path)
+        self.cache_dir = cache_dir or get_cache_dir()
+        # overrides the regex backends named in the conf, as in ConfParser
+        self.backend = backend
+        self.warnings = []
+
+    def get_styles(self, style_name):
+        state = self._file_state(self.conf_path)
+        cache_path = self._cache_path(style_name)
+
+        entry = self._load(cache_path)
+        if (entry and entry.get('version') == VERSION
+                and entry.get('conf_path') == self.conf_path
+                and entry.get('style_name') == style_name
+                and state is not None and entry.get('state') == state
+                and all(self._file_state(path) == include_state
+                        for path, include_state in entry.get('includes', ()))):
+            return self._decode_styles(entry, style_name)
+
+        from .confparser import ConfParser
+        from .transformer import analyze_styles
+
+        # the entry records the backends named in the conf, not the override
+        with open(self.conf_path, 'rb') as f:
+            conf = f.read()
+        conf_parser = ConfParser(conf.decode('utf-8').splitlines(), conf_path=self.conf_path)
+        styles = conf_parser.get_styles(style_name)
+        analyze_styles(styles)
+        includes = []
+        for path in conf_parser.included_paths:
+            include_state = self._file_state(path)
+            if include_state and path not in [i[0] for i in includes]:
+                includes.append((path, include_state))
+
+        entry = {
+            'version': VERSION,
+            'conf_path': self.conf_path,
+            'style_name': style_name,
+            'state': state,
+            'styles': [self._encode_style(s) for s in styles],
+            'warnings': conf_parser.warnings,
+            'includes': includes,
+        }
+        self._save(cache_path, entry)
+        if self.backend:
+            return self._decode_styles(entry, style_name)
+        self.warnings = conf_parser.warnings
+        return styles
+
+    def _decode_styles(self, entry, style_name):
+        styles = [self._decode_style(s) for s in entry['styles']]
+        self.warnings = entry['warnings']
+        if self.backend:
+            from .confparser import get_pattern_warnings
+            self.warnings = get_pattern_warnings(styles, 'Style "%s": ' % style_name)
+        return styles
+
+    def _file_state(self, path):
+        """\
+        Returns the mtime and size of a file, or None if it doesn't exist.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _cache_path(self, style_name):
+        from binascii import crc32
+
+        # entries record the conf path and style name, so a collision is a miss
+        key = '%s\n%s' % (self.conf_path, style_name)
+        name = '%08x.cache' % crc32(key.encode('utf-8', 'surrogateescape'))
+        return os.path.join(self.cache_dir, name)
+
+    def _load(self, cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                entry = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        return entry if isinstance(entry, dict) else None
+
+    def _save(self, cache_path, entry):
+        from .atomicfile import write_atomically
+
+        # the cache is an optimisation, so failing to write it isn't an error
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write_atomically(cache_path, marshal.dumps(entry))
+        except (IOError, OSError, ValueError):
+            pass
+
+    def _encode_style(self, style):
+        if isinstance(style, IndexStyle):
+            return {'index': style.regions, 'transforms': style.transforms}
+
+        return {
+            'regex': style.regex_obj.pattern,
+            'flags': getattr(style.regex_obj, 'flags', 0),
+            'apply_to_whole_line': style.apply_to_whole_line,
+            'backend': style.backend,
+            'transforms': style.transforms,
+            'analysis': style.analysis,
+        }
+
+    def _decode_style(self, entry):
+        if 'index' in entry:
+            style = IndexStyle([tuple(r) for r in entry['index']], [])
+        else:
+            backend = self.backend or entry.get('backend', BACKEND_RE)
+            pattern = entry['regex']
+            if backend == BACKEND_RE:
+                pattern = re.compile(pattern, entry['flags'])
+            # the analysis is of the pattern as compiled with the conf's backend
+            analysis = None if self.backend else entry['analysis']
+            style = RegexStyle(pattern, [], entry['apply_to_whole_line'], backend, analysis)
+
+        # transform keys were resolved when the entry was created
+        style.transforms = entry['transforms']
+        return style
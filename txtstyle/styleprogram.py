@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+from txtstyle.patternanalysis import GROUP_REFERENCES
+from txtstyle.patternanalysis import may_overlap
+from txtstyle.patternanalysis import sre_parse
+from txtstyle.patternanalysis import subpatterns
+
+_GROUP_NAME = '_txts%i'
+# Characters searched per character of a line, plus a constant, before the
+# line is matched rule by rule instead, e.g. if long matches of overlapping
+# patterns are searched again from every position inside them
+_WORK_PER_CHAR = 8
+_MIN_WORK = 1024
+
+
+def compile_program(regex_objs):
+    """\
+    Returns a StyleProgram for the given compiled patterns, or None if
+    any of them can't be merged.
+    """
+    if not regex_objs or not all(is_mergeable(r) for r in regex_objs):
+        return None
+
+    flags = set(r.flags for r in regex_objs)
+    if len(flags) > 1:
+        return None # conflicting flags
+
+    try:
+        return StyleProgram(regex_objs)
+    except re.error:
+        # e.g. the same group name used in two patterns
+        return None
+
+
+def is_mergeable(regex_obj):
+    """\
+    Returns True if the pattern can be embedded in a combined alternation
+    without changing what it matches.
+    """
+    if not isinstance(regex_obj, re.Pattern) or not isinstance(regex_obj.pattern, str):
+        return False
+    try:
+        parsed = sre_parse.parse(regex_obj.pattern, regex_obj.flags)
+    except re.error:
+        return False
+
+    if parsed.getwidth()[0] == 0:
+        # zero-width matches advance differently in finditer()
+        return False
+
+    return not _has_group_references(parsed)
+
+
+def _has_group_references(subpattern):
+    for op, av in subpattern:
+        # group numbers can't be renumbered
+        if op in GROUP_REFERENCES:
+            return True
+        if any(_has_group_references(p) for p in subpatterns(av)):
+            return True
+    return False
+
+
+class StyleProgram(object):
+    """\
+    Scans a line once for all patterns of a style instead of once per pattern.
+
+    The patterns are merged into an alternation with one named group per
+    pattern, in declaration order. Each position where the alternation
+    matches is a position where at least one pattern matches. If other
+    patterns also match there, a lookahead probe reports all of them so that
+    every pattern's matches are exactly those re.finditer() would return.
+
+    The search resumes after a match if no other pattern can match inside
+    it, and at the next position otherwise. Lines where that costs more
+    than a few searches per character are matched rule by rule.
+    """
+
+    def __init__(self, regex_objs):
+        flags = regex_objs[0].flags
+        patterns = [r.pattern for r in regex_objs]
+        names = [_GROUP_NAME % i for i in range(len(patterns))]
+
+        self.pattern_count = len(patterns)
+        # characters searched for the last line, over max_work if it was
+        # matched rule by rule
+        self.work = 0
+        self._regex_objs = regex_objs
+        # whether another pattern may match inside a match of each pattern
+        self._overlapped = [
+            any(j != i and may_overlap(a, b) for j, b in enumerate(regex_objs))
+            for i, a in enumerate(regex_objs)]
+        self._alternation = re.compile(
+            '|'.join('(?P<%s>%s)' % (n, p) for n, p in zip(names, patterns)), flags)
+        self._reverse_alternation = re.compile(
+            '|'.join('(?P<%s>%s)' % (n, p) for n, p in reversed(list(zip(names, patterns)))), flags)
+        self._probe = re.compile(
+            ''.join('(?=(?P<%s>%s))?' % (n, p) for n, p in zip(names, patterns)), flags)
+
+        self._index_of = self._group_index(self._alternation, names)
+        self._reverse_index_of = self._group_index(self._reverse_alternation, names)
+        probe_groups = self._probe.groupindex
+        self._probe_groups = [(i, probe_groups[n]) for i, n in enumerate(names)]
+
+    def _group_index(self, regex_obj, names):
+        index_of = [None] * (regex_obj.groups + 1)
+        for i, name in enumerate(names):
+            index_of[regex_obj.groupindex[name]] = i
+        return index_of
+
+    def find_regions(self, line):
+        """\
+        Returns a list of region lists, one per pattern, each equal to
+        LineStyleProcessor.find_regions() for that pattern.
+        """
+        regions = [[] for i in range(self.pattern_count)]
+        # position after the last match of each pattern
+        cursors = [0] * self.pattern_count
+
+        search = self._alternation.search
+        reverse_match = self._reverse_alternation.match
+        index_of = self._index_of
+        reverse_index_of = self._reverse_index_of
+        overlapped = self._overlapped
+        max_work = _WORK_PER_CHAR * len(line) + _MIN_WORK
+        work = 0
+
+        pos = 0
+        while True:
+            match = search(line, pos)
+            if match is None:
+                break
+
+            start = match.start()
+            end = match.end()
+            work += end - pos
+            if work > max_work:
+                self.work = work
+                return self._find_regions_per_rule(line)
+
+            i = index_of[match.lastindex]
+            if reverse_index_of[reverse_match(line, start).lastindex] == i:
+                # the only pattern that matches at this position
+                if cursors[i] <= start:
+                    regions[i].append((start, end))
+                    cursors[i] = end
+                    if not overlapped[i]:
+                        pos = end
+                        continue
+            else:
+                self._probe_all(line, start, regions, cursors)
+
+            pos = start + 1
+
+        self.work = work
+        return regions
+
+    def _find_regions_per_rule(self, line):
+        return [[m.span() for m in r.finditer(line)] for r in self._regex_objs]
+
+    def _probe_all(self, line, pos, regions, cursors):
+        spans = self._probe.match(line, pos).regs
+        for i, group in self._probe_groups:
+            start, end = spans[group]
+            if start >= 0 and cursors[i] <= start:
+                regions[i].append((start, end))
+                cursors[i] = end
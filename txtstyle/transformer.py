@@ -1,25 +1,173 @@
 # -*- coding: utf-8 -*-
 
 import re
+from collections.abc import Mapping
+from txtstyle.linestyleprocessor import BudgetedLineStyleProcessor
+from txtstyle.linestyleprocessor import StylePlan
 from txtstyle.linestyleprocessor import LineStyleProcessor
+from txtstyle.linestyleprocessor import OVER_BUDGET
+from txtstyle.linestyleprocessor import PlannedStyleMap
 from txtstyle.palette import DEFAULT_STYLE, NAMED_STYLE_MAP
+from txtstyle.regexbackend import BACKEND_RE
+from txtstyle.regexbackend import compile_pattern
+from txtstyle.regexbackend import get_backend
 
 _FOREGROUND = '38'
 _BACKGROUND = '48'
 
+# Evaluate each RegexStyle separately
+ENGINE_PER_RULE = 'per-rule'
+# Merge all RegexStyles into a single StyleProgram where possible
+ENGINE_PROGRAM = 'program'
+
+# Replaces every ASCII digit with 0 to get the shape of a line
+_MASK_DIGITS = str.maketrans('123456789', '000000000')
+_MASK_DIGIT_BYTES = bytes.maketrans(b'123456789', b'000000000')
+
+_DEFAULT_STYLE_BYTES = DEFAULT_STYLE.encode('ascii')
+
+# An SGR (Select Graphic Rendition) escape sequence and its parameters
+_SGR = re.compile(r'\x1b\[([0-9;]*)m')
+
+# Bytes a block must be decoded for: anything outside ASCII, and the
+# separators that \s matches in str patterns but not in bytes patterns
+_NEEDS_TEXT = re.compile(b'[^\x00-\x1b\x20-\x7f]')
+
 # http://tldp.org/HOWTO/Bash-Prompt-HOWTO/x329.html
-def _create_style_map():
-    def add_numeric_styles(style_map, color_type):
+def _numeric_style(key):
+    """\
+    Returns the escape sequence for a numeric key such as "172" or
+    "on-172", or None if the key isn't a valid numeric key.
+    """
+    color_type = _FOREGROUND
+    if key.startswith('on-'):
+        color_type = _BACKGROUND
+        key = key[3:]
+
+    if not key.isdigit() or str(int(key)) != key or not 1 <= int(key) <= 255:
+        return None
+    return "\x1b[%s;5;%sm" % (color_type, key)
+
+
+class _StyleMap(Mapping):
+    """\
+    Maps named and numeric style keys to escape sequences. Numeric keys
+    ("1" to "255" and "on-1" to "on-255") are resolved on first use.
+    """
+
+    def __init__(self, named_styles):
+        self._named_keys = list(named_styles)
+        self._styles = dict(named_styles)
+
+    def __getitem__(self, key):
+        try:
+            return self._styles[key]
+        except KeyError:
+            style = _numeric_style(key) if isinstance(key, str) else None
+            if style is None:
+                raise
+            self._styles[key] = style
+            return style
+
+    def __iter__(self):
+        for key in self._named_keys:
+            yield key
+        for i in range(1, 256):
+            yield str(i)
         for i in range(1, 256):
-            key = str(i) if color_type is _FOREGROUND else "on-%i" % i
-            style_map[key] = "\x1b[%s;5;%im" % (color_type, i)
+            yield "on-%i" % i
+
+    def __len__(self):
+        return len(self._named_keys) + 2 * 255
+
+_STYLES = _StyleMap(NAMED_STYLE_MAP)
 
-    style_map = NAMED_STYLE_MAP
-    add_numeric_styles(style_map, _FOREGROUND)
-    add_numeric_styles(style_map, _BACKGROUND)
-    return style_map
 
-_STYLES = _create_style_map()
+def _join_sgr(sequences):
+    """\
+    Joins SGR escape sequences into one, e.g. bold and red into
+    "\\x1b[1;31m". Other sequences are concatenated.
+    """
+    if len(sequences) < 2:
+        return ''.join(sequences)
+    params = []
+    for sequence in sequences:
+        match = _SGR.fullmatch(sequence)
+        if match is None:
+            return ''.join(sequences)
+        params.append(match.group(1) or '0')
+    return '\x1b[%sm' % ';'.join(params)
+
+
+# The attribute set by each SGR parameter, except 256-color ones
+_SGR_ATTRIBUTES = dict(
+    [('1', 'intensity'), ('2', 'intensity'), ('22', 'intensity'),
+     ('4', 'underline'), ('24', 'underline'), ('39', 'foreground'), ('49', 'background')] +
+    [(str(i), 'foreground') for i in range(30, 38)] +
+    [(str(i), 'background') for i in range(40, 48)])
+# Attributes that don't show on spaces
+_SPACELESS_ATTRIBUTES = frozenset(['intensity', 'foreground'])
+# transforms -> attributes they set
+_attributes_cache = {}
+# (previous transforms, transforms) -> _transition()
+_transition_cache = {}
+
+
+def _sgr_attributes(transforms):
+    """\
+    Returns the attributes set by transforms given as a single SGR escape
+    sequence, as str or bytes, or None if they aren't all known.
+    """
+    try:
+        return _attributes_cache[transforms]
+    except KeyError:
+        pass
+    sequence = transforms.decode('ascii') if isinstance(transforms, bytes) else transforms
+    match = _SGR.fullmatch(sequence)
+    attributes = None
+    if match is not None and match.group(1):
+        params = match.group(1).split(';')
+        attributes = set()
+        while params:
+            param = params.pop(0)
+            if param in ('38', '48') and len(params) >= 2 and params[0] == '5':
+                attributes.add('foreground' if param == '38' else 'background')
+                del params[:2]
+            elif param in _SGR_ATTRIBUTES:
+                attributes.add(_SGR_ATTRIBUTES[param])
+            else:
+                attributes = None
+                break
+    if attributes is not None:
+        attributes = frozenset(attributes)
+    _attributes_cache[transforms] = attributes
+    return attributes
+
+
+def _transition(previous, transforms):
+    """\
+    Returns (needs_reset, spans_spaces) for a region styled with the
+    transforms following one styled with the previous ones: whether a reset
+    is needed in between, as it is unless the transforms set every
+    attribute the previous ones set, and whether the previous style may be
+    extended over spaces up to the region instead of being reset before
+    them.
+    """
+    key = (previous, transforms)
+    try:
+        return _transition_cache[key]
+    except KeyError:
+        pass
+    attributes = _sgr_attributes(transforms)
+    previous_attributes = _sgr_attributes(previous)
+    needs_reset = (transforms != previous and (
+        attributes is None or previous_attributes is None
+        or not previous_attributes <= attributes))
+    spans_spaces = (not needs_reset and previous_attributes is not None
+                    and previous_attributes <= _SPACELESS_ATTRIBUTES)
+    transition = _transition_cache[key] = (needs_reset, spans_spaces)
+    return transition
+
 
 class BaseStyle(object):
 
@@ -28,19 +176,68 @@ class BaseStyle(object):
              raise Exception('Invalid style key: "%s"' % key)
 
         transforms = [(_STYLES[k] if k in _STYLES else error(k)) for k in keys]
-        self.transforms = ''.join(transforms)
+        self.transforms = _join_sgr(transforms)
 
 class RegexStyle(BaseStyle):
-    def __init__(self, pattern, transform_keys, apply_to_whole_line=False):
+    def __init__(self, pattern, transform_keys, apply_to_whole_line=False, backend=BACKEND_RE,
+                 analysis=None):
         super(RegexStyle, self).__init__(transform_keys)
-        self.regex_obj = re.compile(pattern)
+        self.regex_obj = compile_pattern(pattern, backend)
         self.apply_to_whole_line = apply_to_whole_line
+        # the requested backend, the pattern may have been compiled with re
+        self.backend = backend
+        # results of the analysis of the pattern by function name, kept
+        # with the style so the style cache can store them
+        self.analysis = {} if analysis is None else analysis
+        # the regex can't match lines that contain none of these
+        self.required_literals = self.analyze('required_literals')
+
+    def analyze(self, name):
+        """\
+        Returns the result of the patternanalysis function of the given name
+        for the pattern, computed once.
+        """
+        if name not in self.analysis:
+            from txtstyle import patternanalysis
+            # ASCII copies are analysed as the style they were copied from
+            regex_obj = getattr(self, 'text_style', self).regex_obj
+            self.analysis[name] = getattr(patternanalysis, name)(regex_obj)
+        return self.analysis[name]
+
+    def may_overlap(self, other):
+        """\
+        Returns False if matches of the pattern never overlap matches of the
+        pattern of another RegexStyle, computed once per pattern.
+        """
+        overlaps = self.analysis.setdefault('may_overlap', {})
+        key = _pattern_key(other)
+        if key not in overlaps:
+            from txtstyle.patternanalysis import may_overlap
+            overlaps[key] = may_overlap(getattr(self, 'text_style', self).regex_obj,
+                                        getattr(other, 'text_style', other).regex_obj)
+        return overlaps[key]
 
     def __repr__(self):
         return "RegexStyle[\"%s\", apply_to_whole_line = %s]" % \
             (self.regex_obj.pattern, self.apply_to_whole_line)
 
 
+def _pattern_key(style):
+    regex_obj = getattr(style, 'text_style', style).regex_obj
+    return '%i:%s' % (getattr(regex_obj, 'flags', 0), regex_obj.pattern)
+
+
+def analyze_styles(styles):
+    """\
+    Runs the analysis of the patterns a Transformer of the styles needs, so
+    that its results are kept with the styles.
+    """
+    StylePlan(styles)
+    for style in styles:
+        if isinstance(style, RegexStyle):
+            style.analyze('is_digit_agnostic')
+
+
 class IndexStyle(BaseStyle):
     """ Takes a list of indexes i.e. (start,end) tuples and transform keys.
     """
@@ -48,41 +245,241 @@ class IndexStyle(BaseStyle):
         super(IndexStyle, self).__init__(transform_keys)
         self.regions = regions
 
+    def __repr__(self):
+        return "IndexStyle%s" % list(self.regions)
+
+
+def _ascii_style(style):
+    """\
+    Returns a copy of the style for lines given as ASCII bytes, or None if
+    its pattern can't be compiled as a bytes pattern.
+    """
+    import copy
+
+    ascii_style = copy.copy(style)
+    ascii_style.text_style = style
+    ascii_style.transforms = style.transforms.encode('ascii')
+    if not isinstance(style, RegexStyle):
+        return ascii_style
+
+    regex_obj = style.regex_obj
+    if not isinstance(regex_obj.pattern, str) or not regex_obj.pattern.isascii():
+        return None
+    pattern = regex_obj.pattern.encode('ascii')
+    try:
+        if isinstance(regex_obj, re.Pattern):
+            ascii_style.regex_obj = re.compile(pattern, regex_obj.flags & ~re.UNICODE)
+        else:
+            ascii_style.regex_obj = compile_pattern(pattern, get_backend(regex_obj))
+    except Exception:
+        return None # e.g. \u escapes
+    if style.required_literals is not None:
+        ascii_style.required_literals = tuple(l.encode('utf-8') for l in style.required_literals)
+    return ascii_style
+
 
 class Transformer(object):
 
-    def __init__(self, styles):
+    def __init__(self, styles, engine=ENGINE_PER_RULE, cache_size=0, stats=None,
+                 line_budget=None):
+        """\
+        If cache_size is given, up to that many styled lines are cached. If
+        no pattern can tell digits apart, as many region layouts are also
+        cached by line shape, so lines that differ only in their numbers
+        are styled without matching the patterns again.
+
+        If a Stats instance is given, styling is profiled.
+
+        If line_budget is given, lines that take longer than that many
+        seconds to match are left unstyled.
+
+        Blocks of ASCII text are styled without decoding them, with copies
+        of the styles compiled as bytes patterns, unless a pattern can't be
+        compiled as such or the styles are merged into a StyleProgram.
+
+        Styles are evaluated as planned by a StylePlan, which stops early
+        and precomputes the regions of IndexStyles per line length.
+        """
+        if engine not in (ENGINE_PER_RULE, ENGINE_PROGRAM):
+            raise Exception('Invalid engine: "%s"' % engine)
+
         self.styles = styles
-        self.line_style_processor = LineStyleProcessor()
+        self.stats = stats
+        if line_budget:
+            self.line_style_processor = BudgetedLineStyleProcessor(line_budget, stats)
+        else:
+            self.line_style_processor = LineStyleProcessor(stats)
+        self.program = None
+        if engine == ENGINE_PROGRAM and styles:
+            from txtstyle.styleprogram import compile_program
+            # falls back to the per-rule engine if patterns can't be merged
+            self.program = compile_program(
+                [s.regex_obj for s in styles if isinstance(s, RegexStyle)])
+
+        self.ascii_styles = None
+        if self.program is None:
+            ascii_styles = [_ascii_style(s) for s in styles]
+            if None not in ascii_styles:
+                self.ascii_styles = ascii_styles
+
+        # the order of a StyleProgram's regions is fixed
+        reorder = self.program is None
+        self.plan = StylePlan(styles, reorder)
+        self.ascii_plan = None
+        if self.ascii_styles is not None:
+            self.ascii_plan = StylePlan(self.ascii_styles, reorder)
+
+        self.line_cache = None
+        self.shape_cache = None
+        if cache_size and styles:
+            from txtstyle.lrucache import LRUCache
+            self.line_cache = LRUCache(cache_size)
+            if all(s.analyze('is_digit_agnostic') for s in styles if isinstance(s, RegexStyle)):
+                self.shape_cache = LRUCache(cache_size)
+            if stats is not None:
+                stats.line_cache = self.line_cache
+
+    def close(self):
+        """\
+        Stops the line budget timer, if any. Styling another line starts it
+        again.
+        """
+        if isinstance(self.line_style_processor, BudgetedLineStyleProcessor):
+            self.line_style_processor.stop_timer()
 
     def style(self, line):
-        if not self.styles:
+        return self._style(line, self.styles, self.program, self.plan)
+
+    def _style(self, line, styles, program=None, plan=None):
+        if self.stats is not None:
+            self.stats.lines += 1
+        if not styles:
             return line
+        if self.line_cache is None:
+            return self._render(line, self._get_style_map(line, styles, program, plan))
+
+        styled_line = self.line_cache.get(line)
+        if styled_line is None:
+            style_map = self._get_style_map(line, styles, program, plan)
+            styled_line = self._render(line, style_map)
+            if style_map is not OVER_BUDGET:
+                self.line_cache.put(line, styled_line)
+        return styled_line
+
+    def _get_style_map(self, line, styles, program, plan):
+        if self.shape_cache is None:
+            return self.line_style_processor.get_style_map(line, styles, program, plan)
 
-        style_map = self.line_style_processor.get_style_map(line, self.styles)
-        regions = sorted(style_map.keys())
-        
-        pos = 0
+        if isinstance(line, bytes):
+            shape = line.translate(_MASK_DIGIT_BYTES)
+        else:
+            shape = line.translate(_MASK_DIGITS)
+        style_map = self.shape_cache.get(shape)
+        if style_map is None:
+            style_map = self.line_style_processor.get_style_map(line, styles, program, plan)
+            if style_map is not OVER_BUDGET:
+                self.shape_cache.put(shape, style_map)
+        return style_map
+
+    def _render(self, line, style_map):
+        """\
+        Returns the line with the escape sequences of the style map, or the
+        line itself if no region is styled.
+        """
+        if isinstance(line, bytes):
+            empty, reset = b'', _DEFAULT_STYLE_BYTES
+        else:
+            empty, reset = '', DEFAULT_STYLE
+
+        if isinstance(style_map, PlannedStyleMap):
+            segments = style_map.segments
+            if segments is None:
+                segments = style_map.segments = self._segments(style_map, len(line), empty, reset)
+        else:
+            segments = self._segments(style_map, len(line), empty, reset, line)
+
+        if not segments:
+            return line
         styled_line = []
-        for region in regions:
-            style = style_map[region]
-            start, end = region[0], region[1]
-
-            if pos < start:
-                self._append_to(styled_line, line, pos, start)
-
-            self._append_to(styled_line, line, start, end, style)
-            pos = end
-
-        if pos <= len(line) - 1:
-            self._append_to(styled_line, line, pos, len(line))
-        
-        return ''.join(styled_line)
-
-    def _append_to(self, styled_line, line, start, end, style=None):
-        if style:
-            styled_line.append(style.transforms)
-            
-        styled_line.append(line[start : end])
-        styled_line.append(DEFAULT_STYLE)
-        
+        for start, end, prefix in segments:
+            styled_line.append(prefix)
+            styled_line.append(line[start : end])
+        return empty.join(styled_line)
+
+    def _segments(self, style_map, line_length, empty, reset, line=None):
+        """\
+        Returns the (start, end, prefix) slices of a line of the given
+        length that _render() emits for the style map, where prefix is the
+        escape sequences written before the slice. The last slice may be an
+        empty one carrying the final reset.
+
+        Adjacent regions with the same style are merged. A reset is only
+        written where a style ends and isn't overridden by the next one. If
+        the line is given, styles that don't show on spaces are extended
+        over the spaces up to the next region if that saves a reset.
+        """
+        blank = b' ' if isinstance(empty, bytes) else ' '
+        segments = []
+        append = segments.append
+        # the run of regions with the same style that is yet to be added
+        previous = None
+        for (start, end), style in style_map.items():
+            transforms = style.transforms
+            if start == end or not transforms:
+                continue
+            if previous is None:
+                if start:
+                    append((0, start, empty))
+                prefix = transforms
+            else:
+                if run_end < start and line is not None:
+                    needs_reset, spans_spaces = _transition(previous, transforms)
+                    if spans_spaces and not line[run_end : start].strip(blank):
+                        if previous == transforms:
+                            run_end = end
+                            continue
+                        run_end = start
+                elif run_end == start and previous == transforms:
+                    run_end = end
+                    continue
+
+                append((run_start, run_end, prefix))
+                if run_end < start:
+                    append((run_end, start, reset))
+                    prefix = transforms
+                elif _transition(previous, transforms)[0]:
+                    prefix = reset + transforms
+                else:
+                    prefix = transforms
+            run_start, run_end, previous = start, end, transforms
+
+        if previous is None:
+            return segments
+        append((run_start, run_end, prefix))
+        append((run_end, line_length, reset))
+        return segments
+
+    def style_block(self, block):
+        """\
+        Styles a block of UTF-8 encoded lines, given as a bytes-like object.
+        Returns the styled block encoded as UTF-8, with every line terminated
+        by a newline. Invalid UTF-8 is written back as it was read.
+        """
+        if self.ascii_styles is not None and not _NEEDS_TEXT.search(block):
+            lines = bytes(block).split(b'\n')
+            if lines[-1] == b'':
+                lines.pop()
+
+            style, styles, plan = self._style, self.ascii_styles, self.ascii_plan
+            styled_lines = [style(line, styles, None, plan) for line in lines]
+            styled_lines.append(b'')
+            return b'\n'.join(styled_lines)
+
+        lines = str(block, 'utf-8', 'surrogateescape').split('\n')
+        if lines[-1] == '':
+            lines.pop()
+
+        style = self.style
+        styled_lines = [style(line) for line in lines]
+        styled_lines.append('')
+        return '\n'.join(styled_lines).encode('utf-8', 'surrogateescape')
@@ -14,16 +14,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import argparse
 import errno
 import itertools
+import mmap
 import os
 import sys
 import time
+import types
+from time import perf_counter
 
-from .confparser import ConfParser
-from .confparser import ConfParserException
-from .palette import Palette
+from .blocks import block_offsets
+from .blocks import read_blocks
+from .palette import DEFAULT_STYLE
+from .regexbackend import BACKENDS
+from .regexbackend import BACKEND_RE
+from .regexbackend import get_module
+from .transformer import _STYLES
 from .transformer import Transformer
 from .transformer import RegexStyle
 from .txtsconf import *
@@ -36,65 +42,355 @@ Apache License v2.0 or later: <http://www.apache.org/licenses/LICENSE-2.0>
 
 _USER_HOME_CONF_FILE = os.path.join(os.getenv('HOME', os.getenv("USERPROFILE")), '.txts.conf')
 
+# Number of bytes read from the input at a time
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# Colors of the path prefixes when reading several files
+_PREFIX_COLORS = ['cyan', 'magenta', 'yellow', 'green', 'blue', 'red']
+
 class Txts(object):
 
-    def __init__(self, styles, filepath=None, color_always=False):
-        self.transformer = Transformer(styles)
+    def __init__(self, styles, filepath=None, color_always=False,
+                 block_size=DEFAULT_BLOCK_SIZE, jobs=1, cache_size=0,
+                 follow=False, offset_path=None, filepaths=None, prefix=False,
+                 stats=None, line_budget=None, rotated=False, pager=False,
+                 lines=None, tail=None):
+        """\
+        filepaths, if given, are several files or streams read at once
+        instead of filepath. With prefix, their lines are tagged with the
+        path they were read from.
+
+        If rotated, filepaths are a rotated log set, oldest file first,
+        which is styled one file after another. With several jobs, worker
+        processes style the files ahead of the one being written.
+
+        If a Stats instance is given, reading, styling and writing are
+        profiled. Blocks are then styled in this process regardless of jobs.
+
+        Lines that take longer than line_budget seconds to match are left
+        unstyled.
+
+        With pager, filepath is shown in a pager if the output is a
+        terminal, styling only the lines on screen.
+
+        lines, a (start, end) tuple of line numbers from 1 where end may be
+        None, or tail, a number of lines, selects the lines of filepath
+        styled. The lines are found without reading the rest of the file.
+        """
+        self.transformer = Transformer(styles, cache_size=cache_size, stats=stats,
+                                       line_budget=line_budget)
+        self.stats = stats
         self.filepath = filepath
+        self.filepaths = filepaths
+        self.prefix = prefix
         self.color_always = color_always
+        self.block_size = block_size
+        self.jobs = jobs
+        self.follow = follow
+        self.offset_path = offset_path
+        self.rotated = rotated
+        self.pager = pager
+        self.lines = lines
+        self.tail = tail
+        self.use_color = color_always
 
     def transform(self):
-        if self.filepath:
-            self._transform_file()
-        elif not sys.stdin.isatty():
-            self._transform_pipe()
+        self.use_color = self.color_always or sys.stdout.isatty()
+        try:
+            if self.filepath or self.filepaths:
+                self._transform_file()
+            elif not sys.stdin.isatty():
+                self._transform_pipe()
+        finally:
+            self.transformer.close()
 
     def _transform_file(self):
         try:
-            with open(self.filepath, 'r', encoding='utf-8', errors='ignore') as infile:
-                for line in infile:
-                    self._style(line)
+            if self.rotated:
+                self._transform_rotated()
+                return
+            if self.filepaths:
+                self._multiplex_files()
+                return
+            if self.follow:
+                self._follow_file()
+                return
+            if self.lines or self.tail is not None:
+                self._transform_range()
+                return
+            if self.pager and sys.stdout.isatty():
+                self._page_file()
+                return
+            self._transform_path(self.filepath)
         except KeyboardInterrupt:
             pass
         except IOError as e:
-            if e.errno == errno.ENOENT:
-                sys.stderr.write("File not found: %s\n" % self.filepath)
-            elif e.errno == errno.EPIPE:
-                # broken pipe
-                pass
+            self._exit_on_error(e)
+
+    def _exit_on_error(self, e):
+        if e.errno == errno.ENOENT:
+            sys.stderr.write("File not found: %s\n" % (e.filename or self.filepath))
+        elif e.errno == errno.EPIPE:
+            # broken pipe
+            pass
+        else:
+            sys.stderr.write("%s\n" % e)
+        sys.exit(e.errno)
+
+    def _page_file(self):
+        from .decompression import get_compression
+        from .pager import page_file
+
+        with open(self.filepath, 'rb') as infile:
+            if get_compression(infile) is not None:
+                sys.stderr.write("--pager requires an uncompressed file\n")
+                sys.exit(2)
+        page_file(self.filepath, self.transformer)
+
+    def _transform_range(self):
+        from .decompression import get_compression
+        from .lineindex import line_range, tail_offset
+
+        with open(self.filepath, 'rb') as infile:
+            if get_compression(infile) is not None:
+                sys.stderr.write("--lines and --tail require an uncompressed file\n")
+                sys.exit(2)
+            mapped = self._map(infile)
+            if mapped is None:
+                # e.g. an empty file, a pipe or a device
+                self._transform_range_stream(infile)
+                return
+            with mapped:
+                if self.tail is not None:
+                    start, end = tail_offset(mapped, self.tail), len(mapped)
+                else:
+                    start, end = line_range(self.filepath, mapped, *self.lines)
+                blocks = self._map_blocks(mapped, start, end)
+                try:
+                    self._transform_blocks(blocks)
+                finally:
+                    blocks.close()
+
+    def _transform_range_stream(self, infile):
+        from .blocks import range_lines, tail_lines
+
+        blocks = self._read_blocks(infile)
+        if self.tail is not None:
+            block = tail_lines(blocks, self.tail)
+            self._transform_blocks([block] if block else [])
+        else:
+            self._transform_blocks(range_lines(blocks, *self.lines))
+
+    def _transform_path(self, path, prefix=None):
+        with open(path, 'rb') as infile:
+            from .decompression import get_compression
+            compression = get_compression(infile)
+            if compression is not None:
+                self._transform_compressed(infile, compression, prefix)
+                return
+
+            mapped = self._map(infile)
+            if mapped is None:
+                self._transform_blocks(self._read_blocks(infile), prefix)
             else:
-                sys.stderr.write("%s\n" % e)
-            sys.exit(e.errno)
+                with mapped:
+                    blocks = self._map_blocks(mapped)
+                    try:
+                        self._transform_blocks(blocks, prefix)
+                    finally:
+                        # releases the slice in use if interrupted
+                        blocks.close()
+
+    def _transform_rotated(self):
+        prefixes = None
+        if self.prefix:
+            prefixes = dict((path, self._prefix(path, 0)) for path in self.filepaths)
+
+        if not (self.use_color and self.jobs > 1 and self.stats is None):
+            for path in self.filepaths:
+                self._transform_path(path, prefixes[path] if prefixes else None)
+            return
+
+        from .rotation import RotatedSetStyler
+
+        outstream = sys.stdout.buffer
+        styled_blocks = RotatedSetStyler(self.transformer, self.jobs).style_files(
+            self.filepaths, prefixes)
+        try:
+            for styled_block in styled_blocks:
+                self._write(outstream, styled_block)
+        finally:
+            styled_blocks.close()
+
+    def _follow_file(self):
+        from .follow import Follower
+
+        follower = Follower(self.filepath, self.block_size, self.offset_path)
+        blocks = follower.blocks()
+        try:
+            self._transform_blocks(blocks)
+        finally:
+            blocks.close()
+
+    def _multiplex_files(self):
+        from .multiplex import Multiplexer
+        from .rotation import prefix_lines
+
+        prefixes = dict((path, self._prefix(path, i)) for i, path in enumerate(self.filepaths))
+        outstream = sys.stdout.buffer
+        blocks = Multiplexer(self.filepaths, self.block_size, self.follow).blocks()
+        try:
+            for path, block in self._timed_reads(blocks):
+                styled_block = self._style(block)
+                if self.prefix:
+                    styled_block = prefix_lines(prefixes[path], styled_block)
+                self._write(outstream, styled_block)
+        finally:
+            blocks.close()
+
+    def _prefix(self, path, index):
+        prefix = '%s: ' % path
+        if self.use_color:
+            color = _PREFIX_COLORS[index % len(_PREFIX_COLORS)]
+            prefix = _STYLES[color] + prefix + DEFAULT_STYLE
+        return prefix.encode('utf-8')
 
     def _transform_pipe(self):
         sys.stdin = sys.stdin.detach()
 
         try:
-            while True:
-                line = sys.stdin.readline()
-                if not line:
-                    break
-                self._style(line.decode('utf-8', errors='ignore'))
+            self._transform_stream(sys.stdin)
         except KeyboardInterrupt:
             pass
+        except IOError as e:
+            self._exit_on_error(e)
         finally:
             sys.stdin.close()
 
-    def _style(self, line):
-        if sys.stdout.isatty() or self.color_always:
-            styled_line = self.transformer.style(line.strip('\n'))
-            sys.stdout.write(styled_line + '\n')
+    def _transform_stream(self, instream):
+        from .decompression import get_compression
+
+        compression = get_compression(instream)
+        if compression is None:
+            self._transform_blocks(self._read_blocks(instream))
+        else:
+            self._transform_compressed(instream, compression)
+
+    def _transform_compressed(self, infile, compression, prefix=None):
+        """\
+        Styles a compressed file or stream as it is decompressed on another
+        thread, a few blocks ahead.
+        """
+        from .decompression import DecompressedFile
+        from .decompression import read_ahead
+
+        blocks = read_ahead(self._read_blocks(DecompressedFile(infile, compression)))
+        try:
+            self._transform_blocks(blocks, prefix)
+        finally:
+            blocks.close()
+
+    def _transform_blocks(self, blocks, prefix=None):
+        """\
+        Styles blocks of lines, writing each block with a single write. If
+        prefix is given, it is written before every line.
+        """
+        outstream = sys.stdout.buffer
+        blocks = self._timed_reads(blocks)
+
+        # a parallel window would hold back the lines of a followed file
+        if self.use_color and self.jobs > 1 and not self.follow and self.stats is None:
+            from .parallel import ParallelStyler
+            styled_blocks = ParallelStyler(self.transformer, self.jobs).style_blocks(blocks)
         else:
-            sys.stdout.write(line)
+            styled_blocks = (self._style(block) for block in blocks)
+
+        for styled_block in styled_blocks:
+            if prefix:
+                from .rotation import prefix_lines
+                styled_block = prefix_lines(prefix, styled_block)
+            self._write(outstream, styled_block)
+
+    def _timed_reads(self, blocks):
+        if self.stats is None:
+            return blocks
+        return self.stats.timed_reads(blocks)
+
+    def _write(self, outstream, styled_block):
+        if self.stats is None:
+            outstream.write(styled_block)
+            outstream.flush()
+            return
+
+        started = perf_counter()
+        outstream.write(styled_block)
+        outstream.flush()
+        self.stats.io_seconds += perf_counter() - started
+        self.stats.bytes_out += len(styled_block)
 
+    def _read_blocks(self, instream):
+        """\
+        Yields blocks of complete lines. A partial last line is carried
+        over to the next block.
+        """
+        # read1() returns whatever is available instead of
+        # waiting for a full block, e.g. when following a log
+        read = getattr(instream, 'read1', instream.read)
+        return read_blocks(read, self.block_size)
+
+    def _map(self, infile):
+        """\
+        Returns the file mapped into memory, or None if it can't be mapped,
+        e.g. if it is empty or not a regular file.
+        """
+        try:
+            return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            return None
+
+    def _map_blocks(self, mapped, start=0, end=None):
+        """\
+        Yields blocks of complete lines as slices of the mapped file,
+        without copying them. start and end, if given, are offsets of
+        line starts bounding the lines.
+        """
+        with memoryview(mapped) as view:
+            for start, end in block_offsets(mapped, self.block_size, start, end):
+                block = view[start:end]
+                try:
+                    yield block
+                finally:
+                    # the mapping can't be closed while slices are in use
+                    block.release()
+
+    def _style(self, block):
+        if self.stats is not None:
+            return self._profile_style(block)
+        if not self.use_color:
+            return block
+        return self.transformer.style_block(block)
+
+    def _profile_style(self, block):
+        stats = self.stats
+        stats.bytes_in += len(block)
+        if not self.use_color:
+            stats.lines += bytes(block).count(b'\n')
+            return block
+
+        started = perf_counter()
+        styled_block = self.transformer.style_block(block)
+        stats.style_seconds += perf_counter() - started
+        return styled_block
 
 
 def parse_args():
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog='TxtStyle',
         description='Prettifies output of console programs.')
 
-    parser.add_argument('filepath', nargs='?', help='Path to a file.')
+    parser.add_argument('filepath', nargs='*', help='Paths to files. Several files are read at once.')
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument('-p', '--palette', help='Print a palette of available styles.', action='store_true')
@@ -102,23 +398,96 @@ def parse_args():
     group.add_argument('-r', '--regex', nargs=1, action='append', help='Highlight text based on the given regular expression.')
     parser.add_argument('-c', '--conf', nargs=1, help='Path to a conf file. Default is: ~/.txt.conf')
     parser.add_argument('--color-always', help='Always use color. Similar to grep --color=always.', action='store_true')
+    parser.add_argument('--no-cache', help='Parse the conf file instead of using cached styles.', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes used for styling. Default is: 1')
+    parser.add_argument('-f', '--follow', help='Output the last 10 lines of the file, then lines appended to it as it grows, like tail -F.', action='store_true')
+    parser.add_argument('--offset-file', nargs=1, help='With --follow, save the offset of the last line read to this file and resume from it.')
+    parser.add_argument('--pager', help='Page through the file, styling only the lines on screen.', action='store_true')
+    parser.add_argument('--lines', nargs=1, metavar='START:END', help='Style only lines START to END of the file, numbered from 1. Either may be omitted.')
+    parser.add_argument('--tail', type=int, metavar='N', help='Style only the last N lines of the file.')
+    parser.add_argument('--prefix', help='Prefix lines with the path of the file they were read from, when reading several files.', action='store_true')
+    parser.add_argument('--regex-backend', choices=BACKENDS, help='Regex engine used for all styles, if installed. Default is: re, or the one named in the style header')
+    parser.add_argument('--line-budget', type=float, metavar='MS', help='Leave lines that take longer than MS milliseconds to match unstyled.')
+    parser.add_argument('--stats', help='Print profiling statistics to stderr on exit or on SIGUSR1.', action='store_true')
+    parser.add_argument('--cache-size', type=int, default=0, help='Number of styled lines to cache for repeated lines. Default is: 0')
 
     version_group = parser.add_mutually_exclusive_group()
     version_group.add_argument('--version', help='Print version information', action='store_true')
     return parser.parse_args()
 
+def parse_common_args(argv):
+    """\
+    Parses the most common command lines, such as "-n NAME [filepath ...]",
+    without importing argparse. Returns None for anything else, which is
+    then left to parse_args().
+    """
+    args = types.SimpleNamespace(
+        filepath=[], palette=False, name=None, regex=None, conf=None,
+        color_always=False, no_cache=False, jobs=1, cache_size=0,
+        follow=False, offset_file=None, prefix=False, stats=False, pager=False,
+        lines=None, tail=None,
+        regex_backend=None, line_budget=None, version=False)
+    options = {'-n': 'name', '--name': 'name', '-c': 'conf', '--conf': 'conf',
+               '-j': 'jobs', '--jobs': 'jobs', '--cache-size': 'cache_size',
+               '--offset-file': 'offset_file', '--lines': 'lines', '--tail': 'tail'}
+    flags = {'--color-always': 'color_always', '--no-cache': 'no_cache',
+             '-f': 'follow', '--follow': 'follow', '--prefix': 'prefix', '--stats': 'stats',
+             '--pager': 'pager'}
+    seen = set()
+
+    argv = list(argv)
+    while argv:
+        arg = argv.pop(0)
+        dest = options.get(arg) or flags.get(arg)
+        if dest and dest in seen:
+            return None
+        seen.add(dest)
+
+        if arg in flags:
+            setattr(args, dest, True)
+        elif arg in options:
+            if not argv or argv[0].startswith('-'):
+                return None
+            value = argv.pop(0)
+            if dest in ('jobs', 'cache_size', 'tail'):
+                if not value.isdigit():
+                    return None
+                setattr(args, dest, int(value))
+            else:
+                setattr(args, dest, [value])
+        elif not arg.startswith('-'):
+            args.filepath.append(arg)
+        else:
+            return None
+
+    return args
+
+def parse_line_range(value):
+    """\
+    Parses "START:END", where either may be omitted, into a (start, end)
+    tuple of line numbers from 1. Returns None if the range is invalid.
+    """
+    start, sep, end = value.partition(':')
+    if not sep or not (start or end) or not (start.isdigit() or not start) \
+            or not (end.isdigit() or not end):
+        return None
+    start = int(start) if start else 1
+    end = int(end) if end else None
+    if start < 1 or (end is not None and end < start):
+        return None
+    return start, end
+
 def get_styles(conf_parser, style_def_name):
     try:
         return conf_parser.get_styles(style_def_name)
-    except ConfParserException as e:
+    except Exception as e:
+        # imported here so cached styles are read without loading the parser
+        from .confparser import ConfParserException
+        if not isinstance(e, ConfParserException):
+            raise
         sys.stderr.write("%s\n" % e)
         sys.exit(1)
 
-def get_conf_lines(args):
-    confpath = get_conf_path(args)
-    with open(confpath, 'r') as f:
-        return f.readlines()
-
 def get_conf_path(args):
     if args.conf:
         # User-specified conf file
@@ -140,27 +509,128 @@ def loop_default_colors():
             for col in ['red', 'green', 'blue', 'magenta', 'cyan', 'white']:
                 yield ( col, style )
 
+def print_warnings(warnings):
+    for warning in warnings:
+        sys.stderr.write("Warning: %s\n" % warning)
+
+def start_stats():
+    """\
+    Returns a new Stats instance, printed on SIGUSR1 where available.
+    """
+    import signal
+    from .stats import Stats
+
+    stats = Stats()
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: print_stats(stats))
+    return stats
+
+def print_stats(stats):
+    sys.stderr.write(stats.report())
+    sys.stderr.flush()
+
 def main():
-    args = parse_args()
+    args = parse_common_args(sys.argv[1:]) or parse_args()
     styles = []
 
+    if args.regex_backend and get_module(args.regex_backend) is None:
+        sys.stderr.write('Regex backend "%s" is not installed, using re\n' % args.regex_backend)
+
     if args.version:
         sys.stdout.write(VERSION_INFO)
         sys.exit(0)
     elif args.palette:
+        from .palette import Palette
         Palette().print_palette()
         sys.exit(0)
     elif args.name:
-        conf_lines = get_conf_lines(args)
-        conf_parser = ConfParser(conf_lines)
+        if args.no_cache:
+            from .confparser import ConfParser
+            conf_parser = ConfParser(backend=args.regex_backend, conf_path=get_conf_path(args))
+        else:
+            from .stylecache import StyleCache
+            conf_parser = StyleCache(get_conf_path(args), backend=args.regex_backend)
         style_def_name = args.name[0]
         styles = get_styles(conf_parser, style_def_name)
+        print_warnings(conf_parser.warnings)
     elif args.regex:
         rexps = list(itertools.chain.from_iterable(args.regex))
-        styles = [ RegexStyle(regex, style) for regex, style in zip(rexps, loop_default_colors()) ]
+        backend = args.regex_backend or BACKEND_RE
+        styles = [ RegexStyle(regex, style, backend=backend) for regex, style in zip(rexps, loop_default_colors()) ]
+        from .confparser import get_pattern_warnings
+        print_warnings(get_pattern_warnings(styles))
+
+    if args.jobs < 1:
+        sys.stderr.write("Invalid number of jobs: %i\n" % args.jobs)
+        sys.exit(2)
+    if args.cache_size < 0:
+        sys.stderr.write("Invalid cache size: %i\n" % args.cache_size)
+        sys.exit(2)
+    if args.line_budget is not None and args.line_budget <= 0:
+        sys.stderr.write("Invalid line budget: %g\n" % args.line_budget)
+        sys.exit(2)
+    if args.follow and not args.filepath:
+        sys.stderr.write("--follow requires a file\n")
+        sys.exit(2)
+    if args.offset_file and (not args.follow or len(args.filepath) > 1):
+        sys.stderr.write("--offset-file requires --follow and a single file\n")
+        sys.exit(2)
+
+    paths, rotated = args.filepath, False
+    if paths and not args.follow and (len(paths) > 1 or not os.path.isfile(paths[0])):
+        from .rotation import expand_paths, is_rotation_set, order_rotated
+        paths, expanded = expand_paths(paths)
+        if not paths:
+            sys.stderr.write("No files found in: %s\n" % ' '.join(args.filepath))
+            sys.exit(errno.ENOENT)
+        # a directory, a pattern or files such as app.log and app.log.1
+        rotated = (expanded or is_rotation_set(paths)) and all(os.path.isfile(p) for p in paths)
+        if rotated:
+            paths = order_rotated(paths)
+
+    filepath, filepaths = None, None
+    if len(paths) == 1 and not rotated:
+        filepath = paths[0]
+    elif paths:
+        filepaths = paths
 
-    txts = Txts(styles, args.filepath, args.color_always)
-    txts.transform()
+    if args.pager and (filepath is None or args.follow):
+        sys.stderr.write("--pager requires a single file\n")
+        sys.exit(2)
+
+    lines = None
+    if args.lines or args.tail is not None:
+        if filepath is None or args.follow or args.pager or (args.lines and args.tail is not None):
+            sys.stderr.write("--lines or --tail requires a single file, without --follow or --pager\n")
+            sys.exit(2)
+        if args.lines:
+            lines = parse_line_range(args.lines[0])
+            if lines is None:
+                sys.stderr.write("Invalid line range: %s\n" % args.lines[0])
+                sys.exit(2)
+        elif args.tail < 0:
+            sys.stderr.write("Invalid number of lines: %i\n" % args.tail)
+            sys.exit(2)
+
+    stats = None
+    if args.stats:
+        stats = start_stats()
+
+    txts = Txts(styles, filepath, args.color_always,
+                jobs=args.jobs, cache_size=args.cache_size, follow=args.follow,
+                offset_path=args.offset_file[0] if args.offset_file else None,
+                filepaths=filepaths, prefix=args.prefix, stats=stats,
+                line_budget=args.line_budget / 1000.0 if args.line_budget else None,
+                rotated=rotated, pager=args.pager, lines=lines, tail=args.tail)
+    try:
+        txts.transform()
+    finally:
+        if stats is not None:
+            print_stats(stats)
+        exceeded = txts.transformer.line_style_processor.exceeded
+        if exceeded:
+            sys.stderr.write("%i line(s) took longer than %g ms to match and were left unstyled\n"
+                             % (exceeded, args.line_budget))
 
 if __name__ == "__main__":
     main()